@@ -0,0 +1,120 @@
+"""
+
+    Recall-vs-latency benchmark for the IVF item-factor index.
+
+    Author: Explore Data Science Academy.
+
+    Description: Builds `recommenders.ann` indexes over a set of item
+    factors and compares their results with an exact brute-force search,
+    reporting recall@k, mean query latency and speed-up for a grid of
+    `n_lists` / `n_probe` settings. By default a synthetic, clustered
+    catalogue of several hundred thousand items is used; pass `--model`
+    to benchmark the factors of a trained SVD instead.
+
+    Usage:
+
+        python -m benchmarks.bench_ann --n-items 300000 --dim 200
+        python -m benchmarks.bench_ann --model resources/models/SVD.pkl
+
+"""
+
+# Script dependencies
+import argparse
+import pickle
+import time
+import numpy as np
+from recommenders.ann import build_ivf, search, brute_force
+
+
+def synthetic_factors(n_items, dim, n_topics=500, seed=0):
+    """Generate clustered item factors resembling a trained SVD.
+
+    Parameters
+    ----------
+    n_items : int
+        Number of items.
+    dim : int
+        Number of latent factors.
+    n_topics : int
+        Number of latent "genres" the items are scattered around.
+    seed : int
+        Random seed.
+
+    Returns
+    -------
+    numpy.ndarray
+        float32 matrix of shape (n_items, dim).
+
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, dim)).astype(np.float32)
+    labels = rng.integers(n_topics, size=n_items)
+    noise = rng.normal(scale=0.7, size=(n_items, dim)).astype(np.float32)
+    return topics[labels] + noise
+
+
+def recall_at_k(approx, exact):
+    """Fraction of the exact neighbours found by the approximate search."""
+    hits = [len(np.intersect1d(a[0], e[0])) / len(e[0])
+            for a, e in zip(approx, exact)]
+    return float(np.mean(hits))
+
+
+def run(vectors, n_queries, k, n_lists_grid, n_probe_grid, seed=1):
+    """Benchmark every (n_lists, n_probe) combination.
+
+    Returns
+    -------
+    list of dict
+        One record per setting with recall, latency and build time.
+
+    """
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(vectors.shape[0], n_queries, replace=False)]
+
+    start = time.perf_counter()
+    exact = brute_force(vectors, queries, k=k)
+    brute_ms = (time.perf_counter() - start) * 1000 / n_queries
+    print(f"Brute force: {brute_ms:.2f} ms/query over {vectors.shape[0]} items")
+
+    records = []
+    for n_lists in n_lists_grid:
+        start = time.perf_counter()
+        index = build_ivf(vectors, n_lists=n_lists)
+        build_s = time.perf_counter() - start
+        for n_probe in n_probe_grid:
+            if n_probe > n_lists:
+                continue
+            start = time.perf_counter()
+            approx = search(index, queries, k=k, n_probe=n_probe)
+            query_ms = (time.perf_counter() - start) * 1000 / n_queries
+            record = {'n_lists': n_lists, 'n_probe': n_probe,
+                      'recall': recall_at_k(approx, exact),
+                      'query_ms': query_ms, 'speedup': brute_ms / query_ms,
+                      'build_s': build_s}
+            records.append(record)
+            print("n_lists={n_lists:5d} n_probe={n_probe:4d} "
+                  "recall@{k}={recall:.3f} {query_ms:7.2f} ms/query "
+                  "x{speedup:5.1f} (build {build_s:.1f}s)".format(k=k, **record))
+    return records
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--model', help='Pickled surprise SVD to take `qi` from')
+    parser.add_argument('--n-items', type=int, default=300000)
+    parser.add_argument('--dim', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--n-lists', type=int, nargs='+', default=[256, 1024])
+    parser.add_argument('--n-probe', type=int, nargs='+',
+                        default=[1, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    if args.model:
+        with open(args.model, 'rb') as f:
+            vectors = np.asarray(pickle.load(f).qi, dtype=np.float32)
+    else:
+        vectors = synthetic_factors(args.n_items, args.dim)
+    run(vectors, args.queries, args.k, args.n_lists, args.n_probe)
@@ -0,0 +1,131 @@
+"""
+
+    Peak memory of ratings ingestion against file size.
+
+    Author: Explore Data Science Academy.
+
+    Description: Writes synthetic MovieLens-style `ratings.csv` files of
+    increasing size and builds the sparse user-item store from each one,
+    every run in a fresh Python process so peak RSS is not shared:
+
+      - `stream`: `utils.ingest.stream_user_item` (chunked, two passes);
+      - `pandas`: `pd.read_csv` of the whole file followed by
+        `recommenders.item_similarity.build_user_item`.
+
+    Usage:
+
+        python -m benchmarks.bench_ingest
+        python -m benchmarks.bench_ingest --rows 1e6 5e6 25e6 --chunk-rows 500000
+
+"""
+
+# Script dependencies
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from benchmarks.common import peak_rss_mb
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METHODS = ('stream', 'pandas')
+
+
+def write_ratings(path, n_rows, n_users=None, n_items=None, seed=0,
+                  block_users=10000):
+    """Write a synthetic ratings file with MovieLens' columns.
+
+    Users get a skewed number of ratings, over distinct items that are
+    biased towards low ids, so (user, movie) pairs are unique and a few
+    items hold most ratings, as in the real data.
+
+    """
+    n_users = n_users or max(n_rows // 150, 10)
+    n_items = n_items or max(n_rows // 400, 10)
+    rng = np.random.default_rng(seed)
+    counts = rng.pareto(1.5, n_users) + 1
+    counts = np.minimum(counts * n_rows / counts.sum(), n_items).astype(np.int64)
+    counts[-1] += max(n_rows - counts.sum(), 0)
+    counts = np.minimum(counts, n_items)
+    with open(path, 'w') as f:
+        f.write('userId,movieId,rating,timestamp\n')
+        for start in range(0, n_users, block_users):
+            block = counts[start:start + block_users]
+            users = np.repeat(np.arange(start, start + len(block)), block)
+            # Consecutive items from a skewed offset are distinct per user
+            offsets = (rng.pareto(1.2, len(block)) * n_items / 50).astype(np.int64)
+            first = np.repeat(np.cumsum(block) - block, block)
+            items = (np.repeat(offsets, block) + np.arange(len(users)) - first)
+            pd.DataFrame({
+                'userId': users + 1,
+                'movieId': items % n_items + 1,
+                'rating': rng.integers(1, 11, len(users)) / 2,
+                'timestamp': rng.integers(8e8, 1.6e9, len(users)),
+            }).to_csv(f, header=False, index=False)
+
+
+def measure(method, path, chunk_rows):
+    """Build the user-item store in the current (fresh) process."""
+    start = time.perf_counter()
+    if method == 'stream':
+        from utils.ingest import stream_user_item
+        store = stream_user_item(path, chunk_rows)
+    else:
+        from recommenders.item_similarity import build_user_item
+        store = build_user_item(pd.read_csv(path))
+    return {
+        'method': method,
+        'seconds': time.perf_counter() - start,
+        'nnz': int(store['matrix'].nnz),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_child(method, path, chunk_rows):
+    """Measure one method in a new interpreter."""
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_ingest', '--child', method,
+         '--path', path, '--chunk-rows', str(chunk_rows)],
+        cwd=ROOT_DIR, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingestion peak RSS.')
+    parser.add_argument('--rows', type=float, nargs='+',
+                        default=[1e5, 1e6, 5e6])
+    parser.add_argument('--chunk-rows', type=int, default=1000000)
+    parser.add_argument('--methods', nargs='+', default=list(METHODS),
+                        choices=METHODS)
+    parser.add_argument('--json', help='Write the raw measurements here')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.path, args.chunk_rows)))
+        sys.exit(0)
+
+    records = []
+    print(f"{'rows':>10s} {'file':>9s} {'method':>7s} {'time':>8s} "
+          f"{'peak RSS':>10s}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_rows in map(int, args.rows):
+            path = os.path.join(tmp_dir, f'ratings_{n_rows}.csv')
+            write_ratings(path, n_rows)
+            size_mb = os.path.getsize(path) / 2 ** 20
+            for method in args.methods:
+                record = run_child(method, path, args.chunk_rows)
+                record.update(rows=n_rows, file_mb=size_mb)
+                records.append(record)
+                print("{:10d} {:7.0f}MB {:>7s} {:7.2f}s {:8.0f}MB".format(
+                    n_rows, size_mb, method, record['seconds'],
+                    record['peak_rss_mb']))
+            os.remove(path)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(records, f, indent=2)
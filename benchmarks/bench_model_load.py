@@ -0,0 +1,172 @@
+"""
+
+    Startup time and per-process memory of the SVD model formats.
+
+    Author: Explore Data Science Academy.
+
+    Description: Exports one model to every format the collaborative
+    recommender can serve from, then for each format starts several
+    processes at once (like several Streamlit workers on one host) that
+    each load the model and serve a first request:
+
+      - `pickle`: unpickling the full `surprise` model, then extracting
+        its factors (only with a pickled `--model`);
+      - `npz`: the single-file `.npz` artifact, read into memory;
+      - `mmap`: the artifact directory, memory-mapped.
+
+    Per process it reports `load_s`, `first_request_s` (scoring all
+    users for one item and all items against one item, which touches
+    every factor page), and `rss_mb` / `pss_mb` once every process has
+    loaded the model. Memory-mapped factors are counted in full in each
+    process's RSS but shared between processes in PSS: the total PSS
+    shows what the host actually pays.
+
+    Usage:
+
+        python -m benchmarks.bench_model_load --model resources/models/SVD.pkl
+        python -m benchmarks.bench_model_load --synthetic 162541 59047 --processes 8
+
+"""
+
+# Script dependencies
+import argparse
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from benchmarks.common import memory_mb
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FORMATS = ('pickle', 'npz', 'mmap')
+
+
+def write_artifacts(root, model_path=None, synthetic=None, dim=200, seed=0):
+    """Write the model in every format under `root`.
+
+    Returns
+    -------
+    dict
+        Format -> path.
+
+    """
+    from recommenders.svd_factors import (extract_factors, make_factors,
+                                          save_factors)
+
+    if synthetic is not None:
+        n_users, n_items = synthetic
+        rng = np.random.default_rng(seed)
+        factors = make_factors(
+            pu=rng.normal(scale=0.1, size=(n_users, dim)),
+            qi=rng.normal(scale=0.1, size=(n_items, dim)),
+            bu=rng.normal(scale=0.3, size=n_users),
+            bi=rng.normal(scale=0.3, size=n_items),
+            global_mean=3.5, rating_scale=(0.5, 5),
+            user_ids=np.arange(1, n_users + 1),
+            item_ids=np.arange(1, n_items + 1))
+        paths = {}
+    else:
+        with open(model_path, 'rb') as f:
+            factors = extract_factors(pickle.load(f))
+        paths = {'pickle': model_path}
+    paths['npz'] = os.path.join(root, 'svd_factors.npz')
+    paths['mmap'] = os.path.join(root, 'svd_factors')
+    save_factors(factors, paths['npz'])
+    save_factors(factors, paths['mmap'])
+    return paths
+
+
+def load(fmt, path):
+    """Load a model the way the collaborative recommender does."""
+    from recommenders.svd_factors import extract_factors, load_factors
+
+    if fmt == 'pickle':
+        with open(path, 'rb') as f:
+            return extract_factors(pickle.load(f))
+    return load_factors(path)
+
+
+def run_child(fmt, path):
+    """Load and serve one request, then report memory when told to."""
+    from recommenders.svd_factors import top_users
+
+    start = time.perf_counter()
+    factors = load(fmt, path)
+    load_s = time.perf_counter() - start
+    start = time.perf_counter()
+    top_users(factors, factors['item_ids'][:1], 10)
+    np.argsort(factors['qi'] @ factors['qi'][0])[-10:]
+    first_request_s = time.perf_counter() - start
+    print(json.dumps({'load_s': load_s, 'first_request_s': first_request_s}),
+          flush=True)
+    # Memory is measured once every process has loaded its model
+    sys.stdin.readline()
+    print(json.dumps(memory_mb()), flush=True)
+
+
+def measure(fmt, path, processes):
+    """Run `processes` concurrent children on one format."""
+    children = [subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.bench_model_load',
+         '--child', fmt, path],
+        cwd=ROOT_DIR, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        text=True) for _ in range(processes)]
+    runs = [json.loads(child.stdout.readline()) for child in children]
+    for child, run in zip(children, runs):
+        child.stdin.write('\n')
+        child.stdin.flush()
+        run.update(json.loads(child.stdout.readline()))
+    for child in children:
+        child.wait()
+    pss = [run['pss_mb'] for run in runs]
+    return {
+        'format': fmt,
+        'processes': processes,
+        'load_s': float(np.mean([run['load_s'] for run in runs])),
+        'first_request_s': float(np.mean([run['first_request_s']
+                                          for run in runs])),
+        'rss_mb': float(np.mean([run['rss_mb'] for run in runs])),
+        'pss_mb': None if None in pss else float(np.mean(pss)),
+        'total_pss_mb': None if None in pss else float(np.sum(pss)),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Startup time and memory of the SVD model formats.')
+    parser.add_argument('--model', default='resources/models/SVD.pkl',
+                        help='Pickled surprise SVD model')
+    parser.add_argument('--synthetic', type=int, nargs=2,
+                        metavar=('N_USERS', 'N_ITEMS'),
+                        help='Use random factors of this size instead')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--json', help='Write the results here')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        sys.exit(0)
+
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        model = os.path.join(ROOT_DIR, args.model)
+        paths = write_artifacts(root, model, args.synthetic)
+        print(f"{'format':8s} {'load':>9s} {'1st req':>9s} {'RSS':>9s} "
+              f"{'PSS':>9s} {'total PSS':>10s}")
+        for fmt in FORMATS:
+            if fmt not in paths:
+                continue
+            result = measure(fmt, paths[fmt], args.processes)
+            results.append(result)
+            pss = result['pss_mb'] or float('nan')
+            total = result['total_pss_mb'] or float('nan')
+            print(f"{fmt:8s} {result['load_s'] * 1000:7.1f}ms "
+                  f"{result['first_request_s'] * 1000:7.1f}ms "
+                  f"{result['rss_mb']:7.1f}MB {pss:7.1f}MB {total:8.1f}MB")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
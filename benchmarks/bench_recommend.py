@@ -0,0 +1,310 @@
+"""
+
+    Latency and load test of the recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: Measures what a "Recommend" click costs for each
+    recommender of the app:
+
+      - `content`: `recommenders.content_based.content_model`;
+      - `collab`: `recommenders.collaborative_based.collab_model`;
+      - `pearson`: the sparse item-item correlation path used by the
+        collaborative page of `edsa_recommender.py`.
+
+    Each scale runs in a fresh Python process. Scale 1 uses the bundled
+    data; larger scales use a temporary copy of the data with `scale`
+    renumbered copies of every movie, user and rating, and synthetic SVD
+    factors of the matching size. For every recommender it reports:
+
+      - `import_s`: importing the recommender modules;
+      - `cold_s`: the first request, including lazy data/model loads;
+      - `p50_ms` / `p95_ms` / `p99_ms`: latency of random favourite-movie
+        triples, bypassing the result cache;
+      - `throughput`: requests per second with 1, 4, ... concurrent
+        callers (threads, as in the Streamlit server);
+      - `peak_rss_mb`: peak resident memory of the process.
+
+    Results can be written as JSON and compared with a saved baseline;
+    metrics that got worse by more than `--tolerance` are reported as
+    regressions and make the script exit with status 1.
+
+    Usage:
+
+        python -m benchmarks.bench_recommend --json current.json
+        python -m benchmarks.bench_recommend --save-baseline baseline.json
+        python -m benchmarks.bench_recommend --scales 1 10 100 --baseline baseline.json
+
+"""
+
+# Script dependencies
+import argparse
+import concurrent.futures
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from benchmarks.common import peak_rss_mb, latency_summary
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS = ('content', 'collab', 'pearson')
+# Metric -> True if higher is better
+COMPARED = {'import_s': False, 'cold_s': False, 'p50_ms': False,
+            'p95_ms': False, 'p99_ms': False, 'peak_rss_mb': False,
+            'throughput': True}
+
+
+def write_scaled_data(root, scale, dim=100, seed=0):
+    """Write the bundled data, replicated `scale` times, under `root`.
+
+    Copy `j` of a movie gets id `movieId + j * id_step` and the title
+    suffix `#j`; copy `j` of a user rates the same copies of movies.
+    Synthetic SVD factors covering every user and movie are saved as
+    the compact factor artifact.
+
+    """
+    from recommenders.svd_factors import make_factors, save_factors
+    from benchmarks.bench_ann import synthetic_factors
+
+    movies = pd.read_csv(os.path.join(ROOT_DIR, 'resources/data/movies.csv'))
+    ratings = pd.read_csv(os.path.join(ROOT_DIR, 'resources/data/ratings.csv'))
+    id_step = int(max(movies['movieId'].max(), ratings['movieId'].max())) + 1
+    user_step = int(ratings['userId'].max()) + 1
+    movie_copies, rating_copies = [], []
+    for j in range(scale):
+        movie_copies.append(movies.assign(
+            movieId=movies['movieId'] + j * id_step,
+            title=movies['title'] + (f' #{j}' if j else '')))
+        rating_copies.append(ratings.assign(
+            userId=ratings['userId'] + j * user_step,
+            movieId=ratings['movieId'] + j * id_step))
+    data_dir = os.path.join(root, 'resources', 'data')
+    models_dir = os.path.join(root, 'resources', 'models')
+    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(models_dir, exist_ok=True)
+    pd.concat(movie_copies).to_csv(os.path.join(data_dir, 'movies.csv'),
+                                   index=False)
+    ratings = pd.concat(rating_copies)
+    ratings.to_csv(os.path.join(data_dir, 'ratings.csv'), index=False)
+
+    rng = np.random.default_rng(seed)
+    user_ids = np.unique(ratings['userId'].to_numpy())
+    item_ids = np.unique(ratings['movieId'].to_numpy())
+    factors = make_factors(
+        pu=rng.normal(scale=0.1, size=(len(user_ids), dim)),
+        qi=synthetic_factors(len(item_ids), dim, seed=seed) * 0.1,
+        bu=rng.normal(scale=0.3, size=len(user_ids)),
+        bi=rng.normal(scale=0.3, size=len(item_ids)),
+        global_mean=float(ratings['rating'].mean()), rating_scale=(0.5, 5),
+        user_ids=user_ids, item_ids=item_ids)
+    save_factors(factors, os.path.join(models_dir, 'svd_factors'),
+                 metadata={'synthetic': True, 'scale': scale})
+
+
+def _recommenders(models):
+    """Uncached request functions `f(titles)` of the chosen recommenders."""
+    functions = {}
+    if 'content' in models:
+        from recommenders.content_based import content_model
+        functions['content'] = lambda titles: content_model.__wrapped__(titles, 10)
+    if 'collab' in models:
+        from recommenders.collaborative_based import collab_model
+        functions['collab'] = lambda titles: collab_model.__wrapped__(titles, 10)
+    if 'pearson' in models:
+        from recommenders.item_similarity import recommend_similar
+        from utils.catalogue import get_catalogue, title_to_row
+        from utils.ingest import stream_user_item
+        from utils.lazy import resource
+
+        @resource
+        def user_item():
+            return stream_user_item()
+
+        def pearson(titles):
+            catalogue = get_catalogue()
+            seeds = [(catalogue['movie_ids'][title_to_row(title)], 5)
+                     for title in titles]
+            return recommend_similar(user_item(), seeds, top_n=10,
+                                     method='pearson')
+        functions['pearson'] = pearson
+    return functions
+
+
+def request_titles(n_requests, seed=0, min_ratings=10):
+    """Random favourite-movie triples among movies with enough ratings."""
+    from utils.catalogue import get_catalogue, ids_to_rows
+    from utils.data_store import load_ratings
+
+    counts = load_ratings()['movieId'].value_counts()
+    rows = ids_to_rows(counts.index[counts >= min_ratings].to_numpy())
+    titles = get_catalogue()['titles'][rows[rows >= 0]]
+    rng = np.random.default_rng(seed)
+    return [list(rng.choice(titles, 3, replace=False))
+            for _ in range(n_requests)]
+
+
+def measure(models, n_requests, concurrency, seed=0):
+    """Benchmark the recommenders in the current (fresh) process.
+
+    Returns
+    -------
+    list of dict
+        One record per recommender.
+
+    """
+    start = time.perf_counter()
+    functions = _recommenders(models)
+    import_time = time.perf_counter() - start
+    requests = request_titles(n_requests, seed)
+
+    records = []
+    for model in models:
+        recommend = functions[model]
+        start = time.perf_counter()
+        recommend(requests[0])
+        cold = time.perf_counter() - start
+
+        latencies = []
+        for titles in requests:
+            start = time.perf_counter()
+            recommend(titles)
+            latencies.append(time.perf_counter() - start)
+
+        throughput = {}
+        for workers in concurrency:
+            with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+                start = time.perf_counter()
+                list(pool.map(recommend, requests))
+                throughput[str(workers)] = (len(requests)
+                                            / (time.perf_counter() - start))
+        records.append({'model': model, 'import_s': import_time,
+                        'cold_s': cold, **latency_summary(latencies),
+                        'throughput': throughput,
+                        'peak_rss_mb': peak_rss_mb()})
+    return records
+
+
+def run_scale(scale, models, n_requests, concurrency):
+    """Measure one scale in a new interpreter and working directory."""
+    command = [sys.executable, '-m', 'benchmarks.bench_recommend', '--child',
+               '--models', *models, '--requests', str(n_requests),
+               '--concurrency', *map(str, concurrency)]
+    env = dict(os.environ, PYTHONPATH=ROOT_DIR)
+    # Results must not come from a shared on-disk cache
+    env.pop('RECOMMENDATION_CACHE_DB', None)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if scale == 1:
+            cwd = ROOT_DIR
+        else:
+            write_scaled_data(tmp_dir, scale)
+            cwd = tmp_dir
+        output = subprocess.run(command, cwd=cwd, env=env, check=True,
+                                capture_output=True, text=True).stdout
+    records = json.loads(output.strip().splitlines()[-1])
+    for record in records:
+        record['scale'] = scale
+    return records
+
+
+def _metric_values(record):
+    """Flatten a record into comparable metrics."""
+    values = {name: record[name] for name in COMPARED if name != 'throughput'}
+    for workers, rps in record['throughput'].items():
+        values[f'throughput@{workers}'] = rps
+    return values
+
+
+def compare(records, baseline, tolerance):
+    """Find metrics that got worse than the baseline by over `tolerance`.
+
+    Returns
+    -------
+    list of str
+        Human-readable description of each regression.
+
+    """
+    previous = {(r['scale'], r['model']): r for r in baseline['results']}
+    regressions = []
+    for record in records:
+        old = previous.get((record['scale'], record['model']))
+        if old is None:
+            continue
+        old_values = _metric_values(old)
+        for name, value in _metric_values(record).items():
+            if name not in old_values or not old_values[name]:
+                continue
+            higher_is_better = COMPARED[name.split('@')[0]]
+            change = value / old_values[name] - 1
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(
+                    f"scale {record['scale']} {record['model']} {name}: "
+                    f"{old_values[name]:.4g} -> {value:.4g} ({change:+.0%})")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recommender load test.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--models', nargs='+', default=list(MODELS),
+                        choices=MODELS)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 4, 8])
+    parser.add_argument('--json', help='Write the results here')
+    parser.add_argument('--save-baseline', help='Write the results as the '
+                        'baseline to compare later runs with')
+    parser.add_argument('--baseline', help='Compare with this baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative change reported as a regression')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.models, args.requests,
+                                 args.concurrency)))
+        sys.exit(0)
+
+    records = []
+    print(f"{'scale':>5s} {'model':>8s} {'import':>7s} {'cold':>7s} "
+          f"{'p50':>8s} {'p95':>8s} {'p99':>8s} {'req/s':>16s} {'RSS':>7s}")
+    for scale in args.scales:
+        for record in run_scale(scale, args.models, args.requests,
+                                args.concurrency):
+            records.append(record)
+            print("{:5d} {:>8s} {:6.2f}s {:6.2f}s {:6.2f}ms {:6.2f}ms "
+                  "{:6.2f}ms {:>16s} {:5.0f}MB".format(
+                      scale, record['model'], record['import_s'],
+                      record['cold_s'], record['p50_ms'], record['p95_ms'],
+                      record['p99_ms'],
+                      '/'.join(f"{rps:.0f}"
+                               for rps in record['throughput'].values()),
+                      record['peak_rss_mb']))
+
+    report = {
+        'meta': {'python': platform.python_version(),
+                 'platform': platform.platform(),
+                 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'requests': args.requests,
+                 'concurrency': args.concurrency},
+        'results': records,
+    }
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(records, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(f"    {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}.")
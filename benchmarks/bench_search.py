@@ -0,0 +1,157 @@
+"""
+
+    Query latency of the title search at catalogue scale.
+
+    Author: Explore Data Science Academy.
+
+    Description: Builds the catalogue index (`utils.catalogue`) of a
+    synthetic catalogue and replays the queries the movie selector of the
+    app sends while a user types:
+
+      - `title`: every prefix of the first words of a title, keystroke
+        by keystroke ("t", "to", "toy", "toy s", ...);
+      - `words`: two words picked anywhere in a title, the last one
+        partially typed;
+      - `page`: the third page of a one-letter query;
+      - `typo`: the first words of a title with one letter of its
+        longest word replaced, answered by the typo-tolerant fallback.
+
+    Synthetic titles are drawn from the words of the bundled
+    `movies.csv`, with their frequencies, and a release year. For every
+    kind of query it reports mean and p50/p95/p99 latency, next to the
+    build time and peak memory of the index. A linear scan over the
+    normalised titles, as a list filter would do, is timed on a sample
+    of the queries for comparison.
+
+    Usage:
+
+        python -m benchmarks.bench_search --titles 1000000
+        python -m benchmarks.bench_search --titles 62423 100000 1000000 --json search.json
+
+"""
+
+# Script dependencies
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from benchmarks.common import latency_summary, peak_rss_mb
+from utils.catalogue import build_catalogue, normalize_title, search_titles
+from utils.data_store import load_movies, MOVIES_PATH
+
+PAGE_SIZE = 20
+
+
+def synthetic_titles(n_titles, movies_path=MOVIES_PATH, seed=0):
+    """Random titles built from the words of a movie file.
+
+    Returns
+    -------
+    Pandas Dataframe
+        `movieId` and `title` columns of `n_titles` movies.
+
+    """
+    rng = np.random.default_rng(seed)
+    titles = load_movies(movies_path)['title'].fillna('')
+    words = pd.Series(titles.str.replace(r'\s*\(\d{4}\)\s*$', '', regex=True)
+                      .str.split().explode().dropna())
+    counts = words.value_counts()
+    vocabulary = counts.index.to_numpy(dtype=object)
+    p = counts.to_numpy(dtype=np.float64) / counts.sum()
+    lengths = rng.integers(1, 6, size=n_titles)
+    picked = vocabulary[rng.choice(len(vocabulary), size=lengths.sum(), p=p)]
+    years = rng.integers(1900, 2021, size=n_titles)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return pd.DataFrame({
+        'movieId': np.arange(1, n_titles + 1),
+        'title': [' '.join(picked[offsets[i]:offsets[i + 1]]) + f' ({years[i]})'
+                  for i in range(n_titles)],
+    })
+
+
+def make_queries(catalogue, n_titles, seed=1):
+    """Queries of every kind, typed from random titles of the catalogue."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(catalogue['keys']), size=n_titles, replace=False)
+    queries = {'title': [], 'words': [], 'page': [], 'typo': []}
+    for row in rows:
+        key = catalogue['keys'][row]
+        words = key.split()
+        typed = ' '.join(words[:3])
+        queries['title'] += [typed[:i] for i in range(1, len(typed) + 1)]
+        if len(words) >= 2:
+            first, second = rng.choice(len(words), size=2, replace=False)
+            last = words[second]
+            queries['words'].append(
+                f'{words[first]} {last[:rng.integers(1, len(last) + 1)]}')
+        queries['page'].append(key[0])
+        typed = words[:3]
+        longest = max(range(len(typed)), key=lambda i: len(typed[i]))
+        word = typed[longest]
+        at = rng.integers(len(word))
+        typed[longest] = word[:at] + ('x' if word[at] != 'x' else 'y') + word[at + 1:]
+        queries['typo'].append(' '.join(typed))
+    return queries
+
+
+def time_queries(queries, catalogue, offset=0):
+    """Latency of each query, in seconds."""
+    seconds = []
+    for query in queries:
+        start = time.perf_counter()
+        search_titles(query, PAGE_SIZE, offset, catalogue)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def time_scan(queries, keys):
+    """Latency of a linear prefix scan over the normalised titles."""
+    seconds = []
+    for query in queries:
+        start = time.perf_counter()
+        query = normalize_title(query)
+        [key for key in keys if key.startswith(query)][:PAGE_SIZE]
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def run(n_titles, n_queries=200, n_scans=20):
+    """Benchmark the search over a synthetic catalogue of `n_titles`."""
+    movies = synthetic_titles(n_titles)
+    start = time.perf_counter()
+    catalogue = build_catalogue(movies)
+    result = {'titles': n_titles, 'build_s': time.perf_counter() - start}
+    queries = make_queries(catalogue, min(n_queries, n_titles))
+    for kind, batch in queries.items():
+        offset = 2 * PAGE_SIZE if kind == 'page' else 0
+        result[kind] = latency_summary(time_queries(batch, catalogue, offset))
+        result[kind]['queries'] = len(batch)
+    result['scan'] = latency_summary(
+        time_scan(queries['title'][:n_scans], catalogue['keys']))
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Query latency of the title search.')
+    parser.add_argument('--titles', type=int, nargs='+', default=[1000000])
+    parser.add_argument('--queries', type=int, default=200,
+                        help='Number of titles the queries are typed from')
+    parser.add_argument('--json', help='Write the results here')
+    args = parser.parse_args()
+
+    results = []
+    for n_titles in args.titles:
+        result = run(n_titles, args.queries)
+        results.append(result)
+        print(f"{n_titles} titles: index built in {result['build_s']:.1f}s, "
+              f"peak RSS {result['peak_rss_mb']:.0f}MB")
+        for kind in ('title', 'words', 'page', 'typo', 'scan'):
+            print("  {kind:6s} mean {mean_ms:7.3f}ms  p50 {p50_ms:7.3f}ms  "
+                  "p95 {p95_ms:7.3f}ms  p99 {p99_ms:7.3f}ms".format(
+                      kind=kind, **result[kind]))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
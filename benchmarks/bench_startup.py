@@ -0,0 +1,121 @@
+"""
+
+    Cold-start cost of each page of the Streamlit app.
+
+    Author: Explore Data Science Academy.
+
+    Description: For every page, starts a fresh Python process, runs
+    `edsa_recommender.py` headlessly with Streamlit's `AppTest`, opens the
+    page (and clicks "Recommend" on the recommender pages) and reports:
+
+      - `first_run_s`: importing the app and rendering the landing page;
+      - `page_s`: opening the page, including any lazy data/model loads;
+      - `peak_rss_mb`: peak resident memory of the process;
+      - `resources`: build time of each lazily loaded resource.
+
+    Usage:
+
+        python -m benchmarks.bench_startup
+        python -m benchmarks.bench_startup --pages Info --repeat 5 --json out.json
+
+"""
+
+# Script dependencies
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from benchmarks.common import peak_rss_mb
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT_DIR, 'edsa_recommender.py')
+
+# Page name -> (sidebar option, recommender algorithm or None)
+PAGES = {
+    'Home': ('Home', None),
+    'Info': ('Info', None),
+    'Solution Overview': ('Solution Overview', None),
+    'Insights': ('Insights', None),
+    'Recommender (content)': ('Recommender System', 'Content Based Filtering'),
+    'Recommender (collaborative)': ('Recommender System',
+                                    'Collaborative Based Filtering'),
+}
+
+
+def measure_page(page, timeout=600):
+    """Measure one page in the current (fresh) process.
+
+    Returns
+    -------
+    dict
+        Timings, peak RSS and lazily loaded resources.
+
+    """
+    from streamlit.testing.v1 import AppTest
+    from utils.lazy import loaded_resources
+
+    option, algorithm = PAGES[page]
+    start = time.perf_counter()
+    app = AppTest.from_file(APP_PATH, default_timeout=timeout).run()
+    first_run = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if option != 'Home':
+        app.sidebar.selectbox[0].select(option).run()
+    if algorithm is not None:
+        app.radio[0].set_value(algorithm).run()
+        next(b for b in app.button if b.label == 'Recommend').click().run()
+    page_time = time.perf_counter() - start
+
+    return {
+        'page': page,
+        'first_run_s': first_run,
+        'page_s': page_time,
+        'peak_rss_mb': peak_rss_mb(),
+        'errors': [str(e.value) for e in app.exception],
+        'resources': loaded_resources(),
+    }
+
+
+def run_cold(page):
+    """Measure a page in a new interpreter, so nothing is already loaded."""
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_startup', '--child', page],
+        cwd=ROOT_DIR, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cold-start cost per page.')
+    parser.add_argument('--pages', nargs='+', default=list(PAGES),
+                        choices=list(PAGES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='Write the raw measurements here')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # The app uses paths relative to the repository root
+        os.chdir(ROOT_DIR)
+        print(json.dumps(measure_page(args.child)))
+        sys.exit(0)
+
+    records = []
+    print(f"{'page':30s} {'first run':>10s} {'page':>8s} {'peak RSS':>10s}")
+    for page in args.pages:
+        runs = [run_cold(page) for _ in range(args.repeat)]
+        records.extend(runs)
+        print("{:30s} {:9.2f}s {:7.2f}s {:8.0f}MB".format(
+            page,
+            statistics.median(r['first_run_s'] for r in runs),
+            statistics.median(r['page_s'] for r in runs),
+            max(r['peak_rss_mb'] for r in runs)))
+        for run in runs:
+            for error in run['errors']:
+                print(f"    error: {error}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(records, f, indent=2)
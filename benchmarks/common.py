@@ -0,0 +1,57 @@
+"""
+
+    Helpers shared by the benchmark scripts.
+
+    Author: Explore Data Science Academy.
+
+"""
+
+# Script dependencies
+import resource as rusage
+import numpy as np
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process, in MB.
+
+    `ru_maxrss` keeps the high-water mark of the parent across `exec`,
+    so the per-address-space `VmHWM` is preferred where available.
+
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return rusage.getrusage(rusage.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def memory_mb():
+    """Current resident and proportional set sizes of this process, in MB.
+
+    `pss_mb` splits pages shared with other processes (e.g. memory-mapped
+    files) between them, so it adds up across processes where `rss_mb`
+    counts shared pages in full in each. Where `/proc/self/smaps_rollup`
+    is not available, `rss_mb` is the peak RSS and `pss_mb` is None.
+
+    """
+    sizes = {'rss_mb': None, 'pss_mb': None}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key = {'Rss:': 'rss_mb', 'Pss:': 'pss_mb'}.get(line.split()[0])
+                if key:
+                    sizes[key] = int(line.split()[1]) / 1024
+    except OSError:
+        sizes['rss_mb'] = peak_rss_mb()
+    return sizes
+
+
+def latency_summary(seconds):
+    """Mean and p50/p95/p99 of a list of latencies, in milliseconds."""
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {'mean_ms': float(ms.mean()), 'p50_ms': float(p50),
+            'p95_ms': float(p95), 'p99_ms': float(p99)}
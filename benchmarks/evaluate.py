@@ -0,0 +1,330 @@
+"""
+
+    Offline evaluation of the recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: Measures how well, and how fast, each recommender
+    predicts movies a user went on to rate highly. The app's protocol is
+    replayed for every evaluated user: their best-rated training movies
+    are submitted as the favourites, and the top-k recommendations are
+    compared with their held-out ratings.
+
+      - Users with at least `--min-ratings` ratings are split into
+        `--folds` disjoint groups; each fold evaluates one group.
+      - Each evaluated user's `--holdout` latest ratings (`time` split)
+        or `--holdout` random ratings (`random` split, leave-k-out) are
+        the test set; everything else is training data.
+      - Models that learn from ratings are refitted on the training data
+        of each fold, so no test rating leaks into them:
+          - `collab`: SVD factors trained from scratch with the same SGD
+            as `recommenders.online`, then the cosine similarity of the
+            item factors, as served by `collab_model` (exact search
+            rather than the approximate index);
+          - `pearson`: the item-item Pearson correlation of the app's
+            collaborative page (`recommend_similar`);
+          - `popular`: the Bayesian-average ranking of
+            `recommenders.popularity`, as a baseline.
+        `content` (`content_model`) only uses `movies.csv`.
+      - Metrics over users with at least one relevant test movie (rated
+        `--threshold` or more): precision@k, recall@k, NDCG@k, catalogue
+        coverage of the recommendations, and per-request latency.
+
+    Fold/model pairs run in parallel on a process pool and metrics are
+    computed with array operations over all users of a fold. Latencies
+    are measured while the other folds run, so they are pessimistic on
+    a loaded machine.
+
+    Usage:
+
+        python -m benchmarks.evaluate
+        python -m benchmarks.evaluate --split random --folds 5 --users 1000 \\
+            --models collab pearson --json eval.json
+
+"""
+
+# Script dependencies
+import argparse
+import concurrent.futures
+import json
+import os
+import time
+import numpy as np
+from benchmarks.common import latency_summary
+
+MODELS = ('content', 'collab', 'pearson', 'popular')
+N_SEEDS = 3
+DIM = 50
+
+
+def split(ratings, fold, n_folds, method='time', holdout=5, min_ratings=10,
+          max_users=None, seed=0):
+    """Training and test ratings of one fold.
+
+    Parameters
+    ----------
+    ratings : Pandas Dataframe
+        `userId`, `movieId`, `rating`, `timestamp` records.
+    fold, n_folds : int
+        Fold to build and number of folds.
+    method : str
+        `'time'` (hold out each user's latest ratings) or `'random'`.
+    holdout : int
+        Number of test ratings per evaluated user.
+    min_ratings : int
+        Users with fewer ratings are never evaluated.
+    max_users : int, optional
+        Evaluate at most this many users of the fold.
+    seed : int
+        Random seed of the user folds and the random split.
+
+    Returns
+    -------
+    tuple (Pandas Dataframe, Pandas Dataframe)
+        Training ratings (all users) and test ratings (evaluated users).
+
+    """
+    users, counts = np.unique(ratings['userId'].to_numpy(), return_counts=True)
+    eligible = users[counts >= min_ratings]
+    eligible = np.random.default_rng(seed).permutation(eligible)[fold::n_folds]
+    if max_users is not None:
+        eligible = eligible[:max_users]
+    user_col = ratings['userId'].to_numpy()
+    candidate = np.flatnonzero(np.isin(user_col, eligible))
+    if method == 'time':
+        key = -ratings['timestamp'].to_numpy()[candidate]
+    elif method == 'random':
+        key = np.random.default_rng([seed, fold]).random(len(candidate))
+    else:
+        raise ValueError(f"Unknown split: {method}")
+    # Rank of each rating within its user, by the split key
+    order = np.lexsort((key, user_col[candidate]))
+    candidate = candidate[order]
+    grouped = user_col[candidate]
+    starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+    sizes = np.diff(np.r_[starts, len(grouped)])
+    rank = np.arange(len(grouped)) - np.repeat(starts, sizes)
+    test = np.zeros(len(ratings), dtype=bool)
+    test[candidate[rank < holdout]] = True
+    return ratings[~test], ratings[test]
+
+
+def favourites(train, users, n=N_SEEDS):
+    """Each user's best-rated training movies (latest first on ties)."""
+    mine = train[train['userId'].isin(users)].sort_values(
+        ['userId', 'rating', 'timestamp'], ascending=[True, False, False])
+    top = mine.groupby('userId', sort=False).head(n)
+    return {user: (group['movieId'].to_numpy(), group['rating'].to_numpy())
+            for user, group in top.groupby('userId')}
+
+
+def fit(model, train, movies):
+    """Fit a model on training ratings; returns its state."""
+    if model == 'collab':
+        from recommenders.ann import normalize_rows
+        from recommenders.online import fold_in
+        from recommenders.svd_factors import make_factors
+
+        empty = make_factors(np.zeros((0, DIM)), np.zeros((0, DIM)),
+                             np.zeros(0), np.zeros(0),
+                             train['rating'].mean(), (0.5, 5),
+                             np.zeros(0, dtype=np.int64),
+                             np.zeros(0, dtype=np.int64))
+        factors, _ = fold_in(empty, train, n_epochs=20)
+        return {'unit_qi': normalize_rows(factors['qi']),
+                'item_ids': factors['item_ids'],
+                'item_index': factors['item_index']}
+    if model == 'pearson':
+        from recommenders.item_similarity import build_user_item
+        return build_user_item(train)
+    if model == 'popular':
+        from recommenders.popularity import build_tables
+        item_ids = train['movieId'].to_numpy()
+        values = train['rating'].to_numpy(dtype=np.float64)
+        tables = build_tables(movies, {
+            'item_counts': np.bincount(item_ids),
+            'item_sums': np.bincount(item_ids, values),
+            'global_mean': float(values.mean())})
+        return movies['movieId'].to_numpy()[tables['ranking']]
+    return None
+
+
+def recommend(model, state, seed_ids, ratings, k, catalogue):
+    """Top-k movie ids of one request."""
+    if model == 'content':
+        from recommenders.content_based import content_model
+        titles = catalogue['titles'][catalogue['id_index'].get_indexer(seed_ids)]
+        rows = [catalogue['title_rows'][title]
+                for title in content_model.__wrapped__(list(titles), k)]
+        return catalogue['movie_ids'][rows]
+    if model == 'collab':
+        from recommenders.topn import fuse, top_n
+        seeds = state['item_index'].get_indexer(seed_ids)
+        seeds = seeds[seeds >= 0]
+        if len(seeds) == 0:
+            return np.zeros(0, dtype=np.int64)
+        scores = fuse(state['unit_qi'][seeds] @ state['unit_qi'].T, 'max')
+        return state['item_ids'][top_n(scores, k, exclude=seeds)]
+    if model == 'pearson':
+        from recommenders.item_similarity import recommend_similar
+        return np.asarray(recommend_similar(state, list(zip(seed_ids, ratings)),
+                                            top_n=k), dtype=np.int64)
+    if model == 'popular':
+        head = state[:k + len(seed_ids)]
+        return head[~np.isin(head, seed_ids)][:k]
+    raise ValueError(f"Unknown model: {model}")
+
+
+def ranking_metrics(recommended, relevant_users, relevant_items, k):
+    """Precision, recall and NDCG at k of a batch of users.
+
+    Parameters
+    ----------
+    recommended : numpy.ndarray
+        (n_users, k) recommended movie ids, best first, -1 padded.
+    relevant_users, relevant_items : numpy.ndarray
+        User position and movie id of every relevant test rating.
+    k : int
+        Cut-off.
+
+    Returns
+    -------
+    dict
+        Mean `precision`, `recall` and `ndcg` over users with at least
+        one relevant movie, and that number of `users`.
+
+    """
+    n_users = len(recommended)
+    stride = int(max(recommended.max(initial=0),
+                     relevant_items.max(initial=0))) + 1
+    keys = np.arange(n_users)[:, None] * stride + recommended
+    hits = np.isin(keys, relevant_users * stride + relevant_items) \
+        & (recommended >= 0)
+    n_relevant = np.bincount(relevant_users, minlength=n_users)
+    scored = n_relevant > 0
+    discounts = 1 / np.log2(np.arange(k) + 2)
+    ideal = np.cumsum(discounts)[np.minimum(n_relevant, k) - 1]
+    n_hits = hits.sum(axis=1)
+    return {
+        'users': int(scored.sum()),
+        'precision': float((n_hits / k)[scored].mean()),
+        'recall': float((n_hits / np.maximum(n_relevant, 1))[scored].mean()),
+        'ndcg': float(((hits * discounts).sum(axis=1) / ideal)[scored].mean()),
+    }
+
+
+def evaluate_fold(task):
+    """Fit and evaluate one model on one fold (runs in a worker)."""
+    from utils.catalogue import get_catalogue
+    from utils.data_store import load_movies, load_ratings
+
+    model, fold, options = task
+    os.chdir(options['root'])
+    ratings = load_ratings()
+    train, test = split(ratings, fold, options['folds'], options['split'],
+                        options['holdout'], options['min_ratings'],
+                        options['users'], options['seed'])
+    catalogue = get_catalogue()
+    start = time.perf_counter()
+    state = fit(model, train, load_movies())
+    fit_s = time.perf_counter() - start
+
+    users = np.unique(test['userId'].to_numpy())
+    seeds = favourites(train, users)
+    k = options['k']
+    recommended = np.full((len(users), k), -1, dtype=np.int64)
+    latencies = []
+    for i, user in enumerate(users):
+        seed_ids, seed_ratings = seeds.get(user, (np.zeros(0, np.int64), []))
+        start = time.perf_counter()
+        top = recommend(model, state, seed_ids, seed_ratings, k, catalogue)
+        latencies.append(time.perf_counter() - start)
+        recommended[i, :len(top)] = top[:k]
+
+    relevant = test[test['rating'] >= options['threshold']]
+    metrics = ranking_metrics(recommended,
+                              np.searchsorted(users, relevant['userId'].to_numpy()),
+                              relevant['movieId'].to_numpy(dtype=np.int64), k)
+    shown = np.unique(recommended[recommended >= 0])
+    metrics.update({
+        'model': model, 'fold': fold, 'fit_s': fit_s,
+        'coverage': len(shown) / len(catalogue['movie_ids']),
+        'recommended_items': shown.tolist(),
+        'n_catalogue': len(catalogue['movie_ids']),
+    }, **latency_summary(latencies))
+    return metrics
+
+
+def summarise(results):
+    """Mean and standard deviation over folds, per model."""
+    summary = {}
+    for model in dict.fromkeys(r['model'] for r in results):
+        runs = [r for r in results if r['model'] == model]
+        row = {'folds': len(runs), 'users': sum(r['users'] for r in runs)}
+        for metric in ('precision', 'recall', 'ndcg', 'p50_ms', 'p95_ms',
+                       'fit_s'):
+            values = [r[metric] for r in runs]
+            row[metric] = float(np.mean(values))
+            row[metric + '_std'] = float(np.std(values))
+        # Coverage of the recommendations of all folds together
+        shown = set().union(*(r['recommended_items'] for r in runs))
+        row['coverage'] = len(shown) / runs[0]['n_catalogue']
+        summary[model] = row
+    return summary
+
+
+def run(models=MODELS, workers=None, **options):
+    """Evaluate models on every fold, in parallel.
+
+    Returns
+    -------
+    tuple (dict, list)
+        Per-model summary and per-fold results.
+
+    """
+    options.setdefault('root', os.getcwd())
+    tasks = [(model, fold, options) for fold in range(options['folds'])
+             for model in models]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(evaluate_fold, tasks))
+    return summarise(results), results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Offline ranking evaluation of the recommenders.')
+    parser.add_argument('--models', nargs='+', default=list(MODELS),
+                        choices=MODELS)
+    parser.add_argument('--split', choices=('time', 'random'), default='time')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--holdout', type=int, default=5,
+                        help='Test ratings per evaluated user')
+    parser.add_argument('--min-ratings', type=int, default=20)
+    parser.add_argument('--users', type=int, default=300,
+                        help='Evaluated users per fold')
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--threshold', type=float, default=4.0,
+                        help='Lowest rating of a relevant test movie')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Write the per-fold results here')
+    args = parser.parse_args()
+
+    start = time.time()
+    summary, results = run(
+        args.models, args.workers, split=args.split, folds=args.folds,
+        holdout=args.holdout, min_ratings=args.min_ratings, users=args.users,
+        k=args.k, threshold=args.threshold, seed=args.seed)
+    print(f"{'model':8s} {'users':>6s} {'P@k':>7s} {'R@k':>7s} {'NDCG@k':>7s} "
+          f"{'cover':>7s} {'p50':>8s} {'p95':>8s} {'fit':>7s}")
+    for model, row in summary.items():
+        print(f"{model:8s} {row['users']:6d} {row['precision']:7.4f} "
+              f"{row['recall']:7.4f} {row['ndcg']:7.4f} {row['coverage']:7.4f} "
+              f"{row['p50_ms']:6.2f}ms {row['p95_ms']:6.2f}ms "
+              f"{row['fit_s']:6.1f}s")
+    print(f"{args.folds} folds, k={args.k}, {args.split} split, "
+          f"{time.time() - start:.1f}s")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'options': vars(args), 'summary': summary,
+                       'folds': results}, f, indent=2)
@@ -31,35 +31,130 @@ import streamlit as st
 # Data handling dependencies
 import pandas as pd
 import numpy as np
+import json
 
 # Custom Libraries
-from utils.data_loader import load_movie_titles
 from recommenders.collaborative_based import collab_model
 from recommenders.content_based import content_model
+from utils.ingest import stream_user_item
+from recommenders.item_similarity import recommend_similar
+from utils.lazy import resource
+from utils.catalogue import get_catalogue, ids_to_rows, search_titles
+from recommenders.service import RecommendationService
+from recommenders.popularity import popularity_tables, top_up
+from utils import tracing
 
 # Data Loading
-title_list = load_movie_titles('resources/data/movies.csv')
-# title_list = title_list [14930:25255]
+# Nothing is loaded at import: each resource is built the first time a page
+# needs it, then kept for the lifetime of the process (across reruns)
 # train = pd.read_csv('resources/data/train.csv')
-movies = pd.read_csv('resources/data/movies.csv')
-ratings_df = pd.read_csv('resources/data/ratings.csv')
 
 # Data Modifying
-# tr = train.copy()
-# tr = tr.drop('timestamp', axis=1)
-ratings_df = ratings_df.drop('timestamp', axis = 1)
-
-merged = pd.merge(ratings_df,movies,on='movieId') # Merging the dataframes
-merge = merged.copy()
-merge = merged.drop('genres', axis=1)
-
-merge = merge[:500000] # Slicing the data so that there is less computational power required
-m = merge.pivot_table(index=['userId'],columns=['title'],values='rating') # piviting the table into a matrix
-
-# Creating a new list of the titles, to be the ones that are referenced in the model itself
-new_title_list = []
-for i in m:
-    new_title_list.append(i)
+@resource
+def user_item():
+    # Sparse user-item matrix over the full ratings file, used by the
+    # collaborative recommender to correlate only the chosen movies.
+    # Built from the ratings file in bounded-size chunks.
+    return stream_user_item()
+
+def pearson_model(movie_list, top_n=10):
+    catalogue = get_catalogue() # Hash lookups between titles and movie ids
+    rows = [catalogue['title_rows'][movie] for movie in movie_list if movie in catalogue['title_rows']] # Unknown titles are ignored
+    seeds = [(catalogue['movie_ids'][row], 5) for row in rows] # Chosen movies are rated 5
+    # Pearson correlation of the chosen movies against every movie with at least 10 ratings
+    recc_ids = recommend_similar(user_item(), seeds, top_n=top_n, method='pearson')
+    # Sparsely rated picks are made up for with popular movies resembling them
+    return catalogue['titles'][top_up(ids_to_rows(recc_ids), rows, top_n)].tolist()
+
+# Recommendation service
+@resource
+def recommendation_service():
+    # One worker pool per process, shared by every session: identical
+    # requests in flight are computed once, and a request that misses its
+    # deadline is answered with popular movies
+    service = RecommendationService(warm=[popularity_tables])
+    service.register('content', content_model)
+    service.register('collab', collab_model)
+    service.register('pearson', pearson_model)
+    return service
+
+def recommend(name, movie_list, top_n=10):
+    # The profiling options of the request trace are set on the
+    # diagnostics page
+    response = recommendation_service().recommend(
+        name, movie_list, top_n,
+        profile=st.session_state.get('trace_profile', False),
+        memory=st.session_state.get('trace_memory', False))
+    if response['fallback']:
+        st.warning("This is taking longer than usual, so here are our most popular movies instead.")
+    return response['titles']
+
+# Movie selection
+PAGE_SIZE = 20 # Titles sent to the browser per selector
+
+def turn_page(key, step):
+    st.session_state[key + '_page'] = max(0, st.session_state.get(key + '_page', 0) + step)
+
+def reset_page(key):
+    st.session_state[key + '_page'] = 0
+
+def title_page(query, page):
+    # One page of titles, plus one to tell whether a next page exists:
+    # matches of the typed query from the catalogue's prefix index, or
+    # the most popular movies before anything is typed
+    if query.strip():
+        return search_titles(query, PAGE_SIZE + 1, page * PAGE_SIZE)
+    ranking = popularity_tables()['ranking'][page * PAGE_SIZE:(page + 1) * PAGE_SIZE + 1]
+    return get_catalogue()['titles'][ranking].tolist()
+
+def title_picker(label, key, index=0):
+    # Searchable, paged movie selector: only the current page of titles is
+    # sent to the browser, never the whole catalogue
+    search, select, previous, following = st.columns([2, 3, 1, 1], vertical_alignment='bottom')
+    query = search.text_input(label, key=key + '_query', placeholder='Search titles',
+                              on_change=reset_page, args=(key,)) # back to the first page
+    page = st.session_state.get(key + '_page', 0)
+    titles = title_page(query, page)
+    options = titles[:PAGE_SIZE]
+    choice = select.selectbox(f'{label} (page {page + 1})', options, key=key,
+                              index=min(index, len(options) - 1) if options else None)
+    previous.button('Prev', key=key + '_prev', disabled=page == 0,
+                    on_click=turn_page, args=(key, -1))
+    following.button('Next', key=key + '_next', disabled=len(titles) <= PAGE_SIZE,
+                     on_click=turn_page, args=(key, 1))
+    return choice
+
+# Diagnostics
+
+def diagnostics_page():
+    # Hidden page, opened by adding `?diagnostics=1` to the app URL
+    st.title("Diagnostics")
+    enabled = st.checkbox("Enable tracing", value=tracing.is_enabled())
+    if enabled != tracing.is_enabled():
+        tracing.enable() if enabled else tracing.disable()
+    st.checkbox("Profile requests (cProfile)", key='trace_profile')
+    st.checkbox("Measure request memory (tracemalloc)", key='trace_memory')
+    if st.button("Reset metrics"):
+        tracing.reset()
+    snapshot = tracing.snapshot()
+    st.subheader("Stages")
+    if snapshot['stages']:
+        st.dataframe(pd.DataFrame(snapshot['stages']).T.round(3))
+    st.subheader("Counters, cache and resources")
+    st.json({'counters': snapshot['counters'], 'cache': snapshot['cache'],
+             'resources': snapshot['resources'],
+             'service': recommendation_service().stats()})
+    st.subheader("Recent requests")
+    for trace in reversed(snapshot['requests']):
+        with st.expander(f"{trace['name']}: {trace['total_ms']:.1f} ms"):
+            st.table(pd.DataFrame(trace['stages'], columns=['stage', 'ms']))
+            if 'memory_peak_kb' in trace:
+                st.write(f"Memory peak: {trace['memory_peak_kb']:.0f} KB")
+            if trace.get('profile'):
+                st.code(trace['profile'])
+    st.download_button("Download snapshot (JSON)",
+                       json.dumps(snapshot, indent=2, default=str),
+                       file_name='recommender_metrics.json')
 
 # App declaration
 def main():
@@ -102,16 +197,16 @@ def main():
         # Perform top-10 movie recommendation generation
         if sys == 'Content Based Filtering':
             # Content Based options
-            movie_1 = st.selectbox('First Option',title_list[14930:15200])
-            movie_2 = st.selectbox('Second Option',title_list[25055:25255])
-            movie_3 = st.selectbox('Third Option',title_list[21100:21200])
+            movie_1 = title_picker('First Option', 'content_1', index=0)
+            movie_2 = title_picker('Second Option', 'content_2', index=1)
+            movie_3 = title_picker('Third Option', 'content_3', index=2)
             fav_movies = [(movie_1),(movie_2),(movie_3)]
 
             if st.button("Recommend"):
                 try:
                     with st.spinner('Crunching the numbers...'):
-                        top_recommendations = content_model(movie_list=fav_movies,
-                                                            top_n=10)
+                        top_recommendations = recommend('content', fav_movies,
+                                                        top_n=10)
                     st.title("We think you'll like:")
                     for i,j in enumerate(top_recommendations):
                         st.subheader(str(i+1)+'. '+j)
@@ -122,27 +217,18 @@ def main():
 
         if sys == 'Collaborative Based Filtering':
             # Collaborative Based Options
-            movie_1_colab = st.selectbox('First Option',title_list[:1000])
-            movie_2_colab = st.selectbox('Second Option',title_list[1:1000])
-            movie_3_colab = st.selectbox('Third Option',title_list[2:1000])
-            fav_movies_colab = [(movie_1_colab,5),(movie_2_colab,5),(movie_3_colab,5)] # Added ratings, for more efficient use in the model
+            movie_1_colab = title_picker('First Option', 'collab_1', index=0)
+            movie_2_colab = title_picker('Second Option', 'collab_2', index=1)
+            movie_3_colab = title_picker('Third Option', 'collab_3', index=2)
+            fav_movies_colab = [(movie_1_colab),(movie_2_colab),(movie_3_colab)]
 
             if st.button("Recommend"):
                 # try:
                 with st.spinner('Crunching the numbers...'): # spinner just for something to happen during loading time
-                    userRatings = m.dropna(thresh=10, axis=1).fillna(0,axis=1) # dropping and filling NaN values
-                    corrMatrix = userRatings.corr(method='pearson') # creating a correlation Matrix
-                    def get_similar(movie_name,rating=5): # Function for retriving similar movies based off correlation
-                        similar_ratings = corrMatrix[movie_name]*(rating-2.5)
-                        similar_ratings = similar_ratings.sort_values(ascending=False)
-                        return similar_ratings
-                    similar_movies = pd.DataFrame() # creating an empty Dataframe
-                    for movie,rating in fav_movies_colab: # Filling the empty dataframe, and extracting from it
-                        similar_movies = similar_movies.append(get_similar(movie,rating),ignore_index = True)
-                    recc_movies = similar_movies.sum().sort_values(ascending=False).head(14)[3:13] #summing and sorting DF, also slicing for no repeats
+                    recc_movies = recommend('pearson', fav_movies_colab, top_n=10)
                     count = 1
                     st.markdown('## Top 10 Recommendations based on your movie picks:')
-                    for key, value in dict(recc_movies).items(): # Displaying the output
+                    for key in recc_movies: # Displaying the output
                         st.info(str(count) + '. ' + str(key))
                         count += 1
                 # except:
@@ -165,6 +251,7 @@ def main():
         st.markdown("Select the type of algorithm you want to use then select three farvorite movies from the drop down list, hit the recommend button and wait for the movie recommendations.")
         st.subheader("Model Performance Evaluation")
         st.markdown("Model evaluation aims to estimate the generalization accuracy of a model on future (unseen) data. Methods for evaluating a model's performance use a test set (i.e data not seen by the model) to evaluate model performance. This evaluation shows total efficiency as scores.")
+        st.markdown("Running `python -m benchmarks.evaluate` replays held-out MovieLens ratings against every algorithm and reports precision@10, recall@10, NDCG@10, catalogue coverage and response times side by side.")
         st.subheader("The Team:")
         st.markdown(" * Buhle Ntushelo ")
         st.markdown(" * Khanyisa Galela ")
@@ -228,5 +315,9 @@ def main():
         st.write("**Dendrogram**")
         st.image('resources/imgs/dendogram.PNG', width=400)
         st.info("This is another way to visualize the data to obtain the optimal amount of clusters similar to the * Elbow Method *, we use this to pick the clusters that will maximize our efficientcy in the modelling process.")
+
+    # Hidden diagnostics page: per-stage timings, cache and resource metrics
+    if st.query_params.get('diagnostics') == '1':
+        diagnostics_page()
 if __name__ == '__main__':
     main()
@@ -0,0 +1,258 @@
+"""
+
+    Approximate nearest-neighbour search over item factor vectors.
+
+    Author: Explore Data Science Academy.
+
+    Description: A pure-NumPy inverted-file (IVF) index. Item vectors are
+    L2-normalised and clustered with spherical k-means; a query is only
+    compared against the items of the `n_probe` clusters whose centroids
+    are closest to it. Two knobs trade recall for latency:
+
+      - `n_lists`: number of clusters built at index time. More lists
+        means smaller lists, so each probe is cheaper but a query's true
+        neighbours are spread over more lists.
+      - `n_probe`: number of lists scanned per query. Raising it raises
+        recall and latency; `n_probe == n_lists` is an exact search.
+
+    See `benchmarks/bench_ann.py` for a recall-vs-brute-force benchmark
+    used to choose these settings.
+
+"""
+
+# Script dependencies
+import os
+import numpy as np
+
+DEFAULT_N_PROBE = 8
+
+
+def normalize_rows(vectors):
+    """L2-normalise the rows of a matrix, leaving zero rows untouched.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        Matrix of shape (n, d).
+
+    Returns
+    -------
+    numpy.ndarray
+        float32 matrix with unit-length rows.
+
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _assign(vectors, centroids, block_size=65536):
+    """Assign each vector to its most similar centroid."""
+    labels = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], block_size):
+        sims = vectors[start:start + block_size] @ centroids.T
+        labels[start:start + block_size] = sims.argmax(axis=1)
+    return labels
+
+
+def _spherical_kmeans(vectors, n_lists, n_iter, rng):
+    """Cluster unit vectors by cosine similarity."""
+    centroids = vectors[rng.choice(vectors.shape[0], n_lists, replace=False)]
+    for _ in range(n_iter):
+        labels = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=n_lists)
+        # Re-seed empty clusters with random points
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(vectors.shape[0], empty.sum())]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def build_ivf(vectors, n_lists=None, n_iter=10, train_size=None, seed=42):
+    """Build an IVF index over a set of item vectors.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        Item vectors of shape (n_items, d), e.g. the SVD `qi` matrix.
+    n_lists : int, optional
+        Number of clusters. Defaults to roughly `sqrt(n_items)`.
+    n_iter : int
+        Number of k-means iterations.
+    train_size : int, optional
+        Number of vectors sampled to train the centroids. Defaults to
+        64 vectors per list; all vectors are assigned afterwards.
+    seed : int
+        Random seed, so rebuilds give the same index.
+
+    Returns
+    -------
+    dict
+        `centroids`, the item ids grouped by list (`list_items`), their
+        normalised vectors in the same order (`list_vectors`) and the
+        start of each list within them (`list_offsets`).
+
+    """
+    vectors = normalize_rows(vectors)
+    n_items = vectors.shape[0]
+    if n_lists is None:
+        n_lists = int(np.sqrt(n_items))
+    n_lists = max(1, min(n_lists, n_items))
+    if train_size is None:
+        train_size = 64 * n_lists
+    rng = np.random.default_rng(seed)
+    sample = vectors
+    if train_size < n_items:
+        sample = vectors[rng.choice(n_items, train_size, replace=False)]
+    centroids = _spherical_kmeans(sample, n_lists, n_iter, rng)
+
+    labels = _assign(vectors, centroids)
+    list_items = np.argsort(labels, kind='stable').astype(np.int32)
+    counts = np.bincount(labels, minlength=n_lists)
+    return {
+        'centroids': centroids,
+        'list_items': list_items,
+        'list_vectors': vectors[list_items],
+        'list_offsets': np.concatenate(([0], np.cumsum(counts))),
+    }
+
+
+def _top_k(scores, k):
+    """Indices of the k highest scores, best first."""
+    k = min(k, scores.shape[0])
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+def search(index, queries, k=10, n_probe=DEFAULT_N_PROBE):
+    """Find the approximate k most similar items to each query.
+
+    Parameters
+    ----------
+    index : dict
+        Index as returned by `build_ivf`.
+    queries : numpy.ndarray
+        Query vectors of shape (n_queries, d) (need not be normalised).
+    k : int
+        Number of neighbours to return per query.
+    n_probe : int
+        Number of lists to scan per query.
+
+    Returns
+    -------
+    list of tuple (numpy.ndarray, numpy.ndarray)
+        For each query, the item ids and cosine similarities of its
+        neighbours, best first.
+
+    """
+    queries = normalize_rows(np.atleast_2d(queries))
+    centroids = index['centroids']
+    offsets = index['list_offsets']
+    n_probe = min(n_probe, centroids.shape[0])
+    if n_probe == centroids.shape[0]:
+        # Exact search: every list is scanned, so no list is selected
+        scores = queries @ index['list_vectors'].T
+        tops = [_top_k(row, k) for row in scores]
+        return [(index['list_items'][top], row[top])
+                for row, top in zip(scores, tops)]
+    probes = np.argpartition(-(queries @ centroids.T), n_probe - 1,
+                             axis=1)[:, :n_probe]
+    results = []
+    for query, lists in zip(queries, probes):
+        rows = np.concatenate([np.arange(offsets[l], offsets[l + 1])
+                               for l in lists])
+        scores = index['list_vectors'][rows] @ query
+        top = _top_k(scores, k)
+        results.append((index['list_items'][rows[top]], scores[top]))
+    return results
+
+
+def brute_force(vectors, queries, k=10):
+    """Exact k most similar items by cosine similarity, for reference.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        Item vectors of shape (n_items, d).
+    queries : numpy.ndarray
+        Query vectors of shape (n_queries, d).
+    k : int
+        Number of neighbours per query.
+
+    Returns
+    -------
+    list of tuple (numpy.ndarray, numpy.ndarray)
+        Same layout as `search`.
+
+    """
+    vectors = normalize_rows(vectors)
+    results = []
+    for query in normalize_rows(np.atleast_2d(queries)):
+        scores = vectors @ query
+        top = _top_k(scores, k)
+        results.append((top.astype(np.int32), scores[top]))
+    return results
+
+
+def update_ivf(index, vectors, items):
+    """Re-assign changed or new items of an IVF index.
+
+    The centroids are kept, so updating a few items after an online
+    model update costs one assignment per item plus a regrouping of the
+    lists, instead of a new k-means.
+
+    Parameters
+    ----------
+    index : dict
+        Index as returned by `build_ivf`.
+    vectors : numpy.ndarray
+        Updated item vectors of shape (n_items, d). Items beyond those
+        of the index are new.
+    items : array-like of int
+        Items whose vectors changed, new items included.
+
+    Returns
+    -------
+    dict
+        A new index; `index` is left unchanged.
+
+    """
+    n_items = vectors.shape[0]
+    centroids = index['centroids']
+    sizes = np.diff(index['list_offsets'])
+    labels = np.empty(n_items, dtype=np.int32)
+    units = np.empty((n_items, centroids.shape[1]), dtype=np.float32)
+    labels[index['list_items']] = np.repeat(np.arange(len(sizes)), sizes)
+    units[index['list_items']] = index['list_vectors']
+    items = np.union1d(np.asarray(items, dtype=np.int64),
+                       np.arange(len(index['list_items']), n_items))
+    units[items] = normalize_rows(vectors[items])
+    labels[items] = _assign(units[items], centroids)
+
+    list_items = np.argsort(labels, kind='stable').astype(np.int32)
+    counts = np.bincount(labels, minlength=centroids.shape[0])
+    return {
+        'centroids': centroids,
+        'list_items': list_items,
+        'list_vectors': units[list_items],
+        'list_offsets': np.concatenate(([0], np.cumsum(counts))),
+    }
+
+
+def save_ivf(path, index):
+    """Write an IVF index to an `.npz` file, atomically."""
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **index)
+    os.replace(tmp_path, path)
+
+
+def load_ivf(path):
+    """Load an IVF index written by `save_ivf`."""
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
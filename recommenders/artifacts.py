@@ -0,0 +1,164 @@
+"""
+
+    Versioned directory of the serving artifacts.
+
+    Author: Explore Data Science Academy.
+
+    Description: Every artifact the app serves from (catalogue index, SVD
+    factors, their nearest-neighbour index, content features and
+    popularity tables) can be published together as one version
+    directory under `resources/models/published/`:
+
+      - a version is written to a hidden temporary directory, its files
+        are made read-only, and it is renamed into place;
+      - the `CURRENT` pointer file is then replaced with an atomic
+        rename, so app processes see either the old or the new version,
+        never a partial one;
+      - the newest `KEEP_VERSIONS` versions are kept, since processes
+        still serving an older version may be reading it.
+
+    Versions are produced by the build pipeline
+    (`python -m recommenders.pipeline`) and by the online SVD updater
+    (`recommenders.online`), which carries the other artifacts of the
+    current version over into the one it publishes.
+
+"""
+
+# Script dependencies
+import os
+import shutil
+import stat
+import time
+import uuid
+
+PUBLISH_DIR = 'resources/models/published'
+POINTER_NAME = 'CURRENT'
+KEEP_VERSIONS = 3
+FACTORS_NAME = 'svd_factors'
+ANN_NAME = 'ann_index.npz'
+FEATURES_NAME = 'content_features.npz'
+TABLES_NAME = 'popularity.npz'
+CATALOGUE_NAME = 'catalogue.npz'
+BUILD_MANIFEST = 'build.json'
+
+
+def current_version(publish_dir=PUBLISH_DIR):
+    """Name of the published version, or None if none was published."""
+    try:
+        with open(os.path.join(publish_dir, POINTER_NAME)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def published_path(name=FACTORS_NAME, publish_dir=PUBLISH_DIR):
+    """Path of an artifact of the published version, or None.
+
+    None is also returned when the published version has no such
+    artifact.
+
+    """
+    version = current_version(publish_dir)
+    if version is None:
+        return None
+    path = os.path.join(publish_dir, version, name)
+    return path if os.path.exists(path) else None
+
+
+def served_path(name, local_path):
+    """Path of the published artifact `name`, else of the local one."""
+    return published_path(name) or local_path
+
+
+def load_published(name, load, fallback):
+    """Load a published artifact, or else the local one.
+
+    Published artifacts are read-only, so one that is stale for the
+    current data is skipped rather than rebuilt in place.
+
+    Parameters
+    ----------
+    name : str
+        Artifact name within a version, e.g. `TABLES_NAME`.
+    load : callable
+        Function of the artifact's path, loading it; raises `ValueError`
+        or `KeyError` if the artifact is stale or incompatible.
+    fallback : callable
+        Function loading (or rebuilding) the local artifact.
+
+    """
+    published = published_path(name)
+    if published is not None:
+        try:
+            return load(published)
+        except (OSError, ValueError, KeyError):
+            pass
+    return fallback()
+
+
+def link_tree(src, dst):
+    """Hard-link a file or directory tree, copying across file systems."""
+    if os.path.isdir(src):
+        shutil.copytree(src, dst, copy_function=link_tree)
+        return dst
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+def _make_read_only(root):
+    read_only = ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    for folder, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(folder, name)
+            os.chmod(path, os.stat(path).st_mode & read_only)
+
+
+def publish(write, carry_over=True, publish_dir=PUBLISH_DIR):
+    """Publish a new version of the serving artifacts atomically.
+
+    Parameters
+    ----------
+    write : callable
+        Function of the temporary version directory, writing the new
+        artifacts into it.
+    carry_over : bool
+        Whether the artifacts of the current version that `write` did
+        not produce are linked into the new version.
+    publish_dir : str
+        Folder holding the versions and the `CURRENT` pointer.
+
+    Returns
+    -------
+    str
+        Name of the new version.
+
+    """
+    version = time.strftime('%Y%m%dT%H%M%S-') + uuid.uuid4().hex[:6]
+    os.makedirs(publish_dir, exist_ok=True)
+    tmp_dir = os.path.join(publish_dir, f'.{version}.tmp')
+    os.makedirs(tmp_dir)
+    write(tmp_dir)
+    current = current_version(publish_dir)
+    if carry_over and current is not None:
+        current_dir = os.path.join(publish_dir, current)
+        for name in os.listdir(current_dir):
+            if not os.path.exists(os.path.join(tmp_dir, name)):
+                link_tree(os.path.join(current_dir, name),
+                          os.path.join(tmp_dir, name))
+    _make_read_only(tmp_dir)
+    os.replace(tmp_dir, os.path.join(publish_dir, version))
+
+    pointer = os.path.join(publish_dir, POINTER_NAME)
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(version)
+    os.replace(pointer + '.tmp', pointer)
+
+    versions = sorted(name for name in os.listdir(publish_dir)
+                      if not name.startswith('.') and name != POINTER_NAME
+                      and os.path.isdir(os.path.join(publish_dir, name)))
+    for old in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(publish_dir, old), ignore_errors=True)
+    return version
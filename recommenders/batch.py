@@ -0,0 +1,416 @@
+"""
+
+    Batch recommendations for many users at once.
+
+    Author: Explore Data Science Academy.
+
+    Description: `content_model` and `collab_model` serve one app request
+    at a time. Nightly jobs instead need recommendations for every user
+    of the ratings file, or for large files of favourite-movie lists.
+    This module scores such requests in chunks with matrix operations
+    over the shared content features and SVD factors:
+
+      - `recommend_for_users`: top-N unrated movies of each MovieLens
+        user by predicted rating (`mu + bu + bi + pu . qi`);
+      - `recommend_for_favourites`: top-N movies for each list of
+        favourite titles, with the TF-IDF content features (same
+        results as `content_model`) or by exact cosine similarity
+        of the SVD item factors (`collab_model` uses an approximate
+        index for the same similarity). Lists without any movie that
+        has factors get the popularity fallback of `collab_model`.
+
+    Chunks are spread over a process pool. The model arrays are copied
+    once into shared memory and attached by every worker, instead of
+    being pickled per task. Results are appended to a CSV file
+    (`key,rank,movieId,score`) as chunks complete, in input order, so
+    memory use does not grow with the number of users.
+
+    Usage:
+
+        python -m recommenders.batch users --output user_recs.csv
+        python -m recommenders.batch favourites --input lists.jsonl \\
+            --model content --output favourite_recs.csv
+
+    where each line of `lists.jsonl` is a JSON list of titles.
+
+"""
+
+# Script dependencies
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from recommenders.ann import normalize_rows
+from recommenders.popularity import fallback_rows, top_up
+from recommenders.topn import merge_top_n, top_n_rows
+from utils.catalogue import get_catalogue
+from utils.data_store import load_ratings
+
+DEFAULT_CHUNK_SIZE = 1024
+
+# Model arrays of the current process (attached shared memory in workers)
+_arrays = {}
+_blocks = []
+
+
+def share_arrays(arrays):
+    """Copy arrays into shared memory.
+
+    Parameters
+    ----------
+    arrays : dict
+        Arrays to share, by name.
+
+    Returns
+    -------
+    tuple (list, dict)
+        The `SharedMemory` blocks (close and unlink them when done) and
+        the picklable spec passed to `attach_arrays`.
+
+    """
+    blocks, spec = [], {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True,
+                                           size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        spec[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, spec
+
+
+def attach_arrays(spec):
+    """Open arrays shared by `share_arrays`, without copying them."""
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype, buffer=block.buf)
+    return blocks, arrays
+
+
+def _init_worker(spec):
+    blocks, arrays = attach_arrays(spec)
+    _blocks.extend(blocks)
+    _arrays.update(arrays)
+
+
+def _execute(task, arrays, chunks, workers):
+    """Run `task` over chunks, yielding the results in input order."""
+    if workers <= 1:
+        _arrays.update(arrays)
+        try:
+            for chunk in chunks:
+                yield task(chunk)
+        finally:
+            _arrays.clear()
+        return
+    blocks, spec = share_arrays(arrays)
+    try:
+        with multiprocessing.Pool(workers, _init_worker, (spec,)) as pool:
+            yield from pool.imap(task, chunks)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def _score_users(args):
+    """Top-N unrated items of a chunk of (inner) users."""
+    users, top_n = args
+    a = _arrays
+    scores = a['pu'][users] @ a['qi'].T
+    scores += a['bi']
+    if 'rated_indptr' in a:
+        # Mask every item each user has already rated
+        starts, ends = a['rated_indptr'][users], a['rated_indptr'][users + 1]
+        lengths = ends - starts
+        rows = np.repeat(np.arange(len(users)), lengths)
+        positions = (np.arange(lengths.sum())
+                     + np.repeat(starts - np.cumsum(lengths) + lengths, lengths))
+        scores[rows, a['rated_indices'][positions]] = -np.inf
+    items, values = top_n_rows(scores, top_n)
+    low, high = a['rating_scale']
+    ratings = np.clip(values + a['bu'][users, None] + a['global_mean'],
+                      low, high)
+    ratings[~np.isfinite(values)] = np.nan
+    return a['item_ids'][items], ratings
+
+
+def _score_content(args):
+    """Top-N content-feature recommendations of a chunk of seed rows."""
+    seeds, top_n = args
+    a = _arrays
+    n_movies, n_tokens = len(a['f_indptr']) - 1, len(a['ft_indptr']) - 1
+    features = sp.csr_matrix((a['f_data'], a['f_indices'], a['f_indptr']),
+                             shape=(n_movies, n_tokens))
+    features_t = sp.csr_matrix((a['ft_data'], a['ft_indices'], a['ft_indptr']),
+                               shape=(n_tokens, n_movies))
+    # One sparse similarity row per seed of the chunk
+    sims = features[np.maximum(seeds, 0).ravel()] @ features_t
+    bounds = sims.indptr
+    rows = np.zeros((len(seeds), top_n), dtype=np.int64)
+    scores = np.full((len(seeds), top_n), -np.inf)
+    for i, chosen in enumerate(seeds):
+        lists = [(sims.indices[bounds[r]:bounds[r + 1]],
+                  sims.data[bounds[r]:bounds[r + 1]])
+                 for r in i * seeds.shape[1] + np.flatnonzero(chosen >= 0)]
+        # Keeping the best score per movie and removing chosen movies
+        top, values = merge_top_n(lists, top_n, fusion='max',
+                                  exclude=chosen[chosen >= 0])
+        rows[i, :len(top)], scores[i, :len(top)] = top, values
+        if len(top) < top_n:
+            # Completed with popular movies, as by `content_model`
+            extra = top_up(top, chosen[chosen >= 0].tolist(), top_n)[len(top):]
+            rows[i, len(top):len(top) + len(extra)] = extra
+            scores[i, len(top):len(top) + len(extra)] = 0.0
+    return a['movie_ids'][rows], scores
+
+
+def _score_collab(args):
+    """Top-N factor-similarity recommendations of a chunk of seed items."""
+    inputs, top_n = args
+    a = _arrays
+    # Inner item ids of the seeds, then their catalogue rows (-1: unknown)
+    seeds, seed_rows = np.split(inputs, 2, axis=1)
+    known = seeds >= 0
+    vectors = a['unit_qi'][np.maximum(seeds, 0)]
+    sims = vectors.reshape(-1, vectors.shape[2]) @ a['unit_qi'].T
+    sims = sims.reshape(seeds.shape[0], seeds.shape[1], -1)
+    sims[~known] = -np.inf
+    # Merging the seeds by their best similarity, then removing them
+    scores = sims.max(axis=1)
+    rows, columns = np.nonzero(known)
+    scores[rows, seeds[rows, columns]] = -np.inf
+    scores[:, ~a['in_catalogue']] = -np.inf
+    items, values = top_n_rows(scores, top_n)
+    movie_ids = np.zeros((len(seeds), top_n), dtype=np.int64)
+    movie_ids[:, :items.shape[1]] = a['item_ids'][items]
+    values = np.hstack([values, np.full((len(seeds), top_n - values.shape[1]),
+                                        -np.inf, dtype=values.dtype)])
+    for i in np.flatnonzero(~known.any(axis=1)):
+        # No seed has factors: popular movies resembling the chosen ones,
+        # as by `collab_model`
+        fallback = fallback_rows(seed_rows[i][seed_rows[i] >= 0].tolist(),
+                                 top_n)
+        movie_ids[i, :len(fallback)] = a['movie_ids'][fallback]
+        values[i, :len(fallback)] = 0.0
+        values[i, len(fallback):] = -np.inf
+    return movie_ids, values
+
+
+def _write_chunk(path, keys, movie_ids, scores):
+    """Append the recommendations of a chunk to the output CSV."""
+    ranks = np.broadcast_to(np.arange(1, movie_ids.shape[1] + 1),
+                            movie_ids.shape)
+    keep = np.isfinite(scores)
+    pd.DataFrame({
+        'key': np.broadcast_to(np.asarray(keys)[:, None], movie_ids.shape)[keep],
+        'rank': ranks[keep],
+        'movieId': movie_ids[keep],
+        'score': scores[keep].round(4),
+    }).to_csv(path, mode='a', header=False, index=False)
+    return int(keep.any(axis=1).sum())
+
+
+def _run(task, arrays, keys, inputs, output_path, top_n, workers, chunk_size):
+    """Score `inputs` in chunks and stream the results to `output_path`."""
+    workers = os.cpu_count() if workers is None else workers
+    start = time.perf_counter()
+    with open(output_path, 'w') as f:
+        f.write('key,rank,movieId,score\n')
+    chunks = [(inputs[i:i + chunk_size], top_n)
+              for i in range(0, len(inputs), chunk_size)]
+    written = 0
+    for i, (movie_ids, scores) in enumerate(_execute(task, arrays, chunks,
+                                                     workers)):
+        written += _write_chunk(output_path,
+                                keys[i * chunk_size:(i + 1) * chunk_size],
+                                movie_ids, scores)
+    seconds = time.perf_counter() - start
+    return {
+        'requests': len(keys),
+        'written': written,
+        'seconds': seconds,
+        'users_per_second': len(keys) / seconds if seconds else 0.0,
+        'workers': workers,
+        'output': output_path,
+    }
+
+
+def recommend_for_users(user_ids=None, output_path='user_recommendations.csv',
+                        top_n=10, exclude_rated=True, workers=None,
+                        chunk_size=DEFAULT_CHUNK_SIZE, factors=None):
+    """Recommend the highest predicted, unrated movies to many users.
+
+    Parameters
+    ----------
+    user_ids : list (int), optional
+        MovieLens user ids; every user known to the model by default.
+        Unknown users are skipped.
+    output_path : str
+        CSV file to write.
+    top_n : int
+        Number of movies per user.
+    exclude_rated : bool
+        Leave out the movies each user rated in the ratings file.
+    workers : int, optional
+        Number of worker processes, one per CPU by default; 0 or 1 scores
+        in the current process.
+    chunk_size : int
+        Number of users scored per task.
+    factors : dict, optional
+        SVD factors; those of the collaborative recommender by default.
+
+    Returns
+    -------
+    dict
+        Number of `requests` and users `written`, `seconds` taken and
+        `users_per_second`.
+
+    """
+    if factors is None:
+        from recommenders.collaborative_based import factors as model_factors
+        factors = model_factors()
+    if user_ids is None:
+        user_ids = factors['user_ids']
+    inner = factors['user_index'].get_indexer(np.asarray(user_ids))
+    known = inner >= 0
+    arrays = {
+        'pu': factors['pu'], 'qi': factors['qi'],
+        'bu': factors['bu'], 'bi': factors['bi'],
+        'global_mean': np.float32(factors['global_mean']),
+        'rating_scale': np.asarray(factors['rating_scale'], dtype=np.float32),
+        'item_ids': np.asarray(factors['item_ids']),
+    }
+    if exclude_rated:
+        ratings = load_ratings()
+        users = factors['user_index'].get_indexer(ratings['userId'])
+        items = factors['item_index'].get_indexer(ratings['movieId'])
+        rated = (users >= 0) & (items >= 0)
+        rated = sp.csr_matrix(
+            (np.ones(rated.sum(), dtype=np.int8), (users[rated], items[rated])),
+            shape=(len(factors['user_ids']), len(factors['item_ids'])))
+        arrays['rated_indptr'] = rated.indptr
+        arrays['rated_indices'] = rated.indices
+    summary = _run(_score_users, arrays, np.asarray(user_ids)[known],
+                   inner[known], output_path, top_n, workers, chunk_size)
+    summary['skipped'] = int((~known).sum())
+    return summary
+
+
+def recommend_for_favourites(movie_lists, output_path='favourite_recommendations.csv',
+                             model='content', top_n=10, workers=None,
+                             chunk_size=DEFAULT_CHUNK_SIZE, keys=None):
+    """Recommend movies for many lists of favourite titles.
+
+    Parameters
+    ----------
+    movie_lists : list of list (str)
+        Favourite titles of each request. Unknown titles are ignored.
+    output_path : str
+        CSV file to write.
+    model : str
+        `'content'` (TF-IDF content features) or `'collab'` (SVD item
+        factor similarity).
+    top_n : int
+        Number of movies per request.
+    workers : int, optional
+        Number of worker processes, one per CPU by default; 0 or 1 scores
+        in the current process.
+    chunk_size : int
+        Number of requests scored per task.
+    keys : list, optional
+        Identifier written for each request; its position by default.
+
+    Returns
+    -------
+    dict
+        Number of `requests` and users `written`, `seconds` taken and
+        `users_per_second`.
+
+    """
+    catalogue = get_catalogue()
+    width = max((len(movies) for movies in movie_lists), default=1)
+    seeds = np.full((len(movie_lists), width), -1, dtype=np.int64)
+    for i, movies in enumerate(movie_lists):
+        rows = [catalogue['title_rows'].get(title, -1) for title in movies]
+        seeds[i, :len(rows)] = rows
+    keys = np.arange(len(movie_lists)) if keys is None else np.asarray(keys)
+
+    if model == 'content':
+        from recommenders.content_based import content_features
+        index = content_features()
+        features, features_t = index['features'], index['features_t']
+        arrays = {'f_data': features.data, 'f_indices': features.indices,
+                  'f_indptr': features.indptr, 'ft_data': features_t.data,
+                  'ft_indices': features_t.indices,
+                  'ft_indptr': features_t.indptr,
+                  'movie_ids': catalogue['movie_ids']}
+        task = _score_content
+    elif model == 'collab':
+        from recommenders.collaborative_based import factors as model_factors
+        factors = model_factors()
+        # Seeds as inner item ids; movies without factors are ignored. The
+        # catalogue rows follow, for the popularity fallback
+        ids = np.where(seeds >= 0, catalogue['movie_ids'][seeds], -1)
+        inner = factors['item_index'].get_indexer(ids.ravel()).reshape(seeds.shape)
+        seeds = np.hstack([inner, seeds])
+        arrays = {
+            'unit_qi': normalize_rows(factors['qi']),
+            'item_ids': np.asarray(factors['item_ids']),
+            'in_catalogue': catalogue['id_index'].get_indexer(
+                factors['item_ids']) >= 0,
+            'movie_ids': catalogue['movie_ids'],
+        }
+        task = _score_collab
+    else:
+        raise ValueError(f"Unknown model: {model}")
+    return _run(task, arrays, keys, seeds, output_path, top_n, workers,
+                chunk_size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Batch recommendations for many users.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    users = commands.add_parser('users', help='Recommend to MovieLens users')
+    users.add_argument('--users', help='File with one userId per line '
+                       '(default: every user of the model)')
+    users.add_argument('--keep-rated', action='store_true',
+                       help='Do not exclude movies the user already rated')
+    favourites = commands.add_parser('favourites',
+                                     help='Recommend for favourite lists')
+    favourites.add_argument('--input', required=True,
+                            help='JSON lines file of title lists')
+    favourites.add_argument('--model', choices=('content', 'collab'),
+                            default='content')
+    for command in (users, favourites):
+        command.add_argument('--output', required=True)
+        command.add_argument('--top-n', type=int, default=10)
+        command.add_argument('--workers', type=int)
+        command.add_argument('--chunk-size', type=int,
+                             default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    if args.command == 'users':
+        user_ids = (np.loadtxt(args.users, dtype=np.int64, ndmin=1)
+                    if args.users else None)
+        summary = recommend_for_users(
+            user_ids, args.output, top_n=args.top_n,
+            exclude_rated=not args.keep_rated, workers=args.workers,
+            chunk_size=args.chunk_size)
+    else:
+        with open(args.input) as f:
+            movie_lists = [json.loads(line) for line in f if line.strip()]
+        summary = recommend_for_favourites(
+            movie_lists, args.output, model=args.model, top_n=args.top_n,
+            workers=args.workers, chunk_size=args.chunk_size)
+    print(f"{summary['requests']} requests in {summary['seconds']:.1f}s "
+          f"({summary['users_per_second']:.0f} users/s, "
+          f"{summary['workers']} workers). Saved to: {summary['output']}")
@@ -28,23 +28,133 @@
 """
 
 # Script dependencies
-import pandas as pd
+import os
+import threading
 import numpy as np
 import pickle
-import copy
-from surprise import Reader, Dataset
-from surprise import SVD, NormalPredictor, BaselineOnly, KNNBasic, NMF
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
+from recommenders.svd_factors import (extract_factors, load_factors,
+                                      top_users, version_file, FACTORS_PATH)
+from recommenders.ann import build_ivf, load_ivf, search
+from recommenders.artifacts import published_path, ANN_NAME
+from utils.data_store import MOVIES_PATH
+from utils.catalogue import get_catalogue, ids_to_rows
+from utils.cache import recommendation_cache, version_of
+from utils.lazy import resource
+from utils.tracing import stage, traced
+from recommenders.topn import merge_top_n
+from recommenders.popularity import fallback_rows, top_up, served_tables_path
+
+SVD_PATH = 'resources/models/SVD.pkl'
+# Catalogues with fewer items are searched exactly: on the served model
+# (9,066 items) scanning every list costs under 1 ms per request, while
+# 8 of its 95 lists only find half of the true 10 nearest neighbours.
+EXACT_SEARCH_ITEMS = 50000
+# Raise `N_PROBE` for higher recall of the nearest-neighbour search of
+# larger catalogues, lower it for lower latency.
+N_PROBE = 32
+# Popular movies considered when replacing a movie that has no factors
+PROXY_CANDIDATES = 50
 
 # Importing data
-movies_df = pd.read_csv('resources/data/movies.csv',sep = ',',delimiter=',')
-ratings_df = pd.read_csv('resources/data/ratings.csv')
-ratings_df.drop(['timestamp'], axis=1,inplace=True)
+# Data, model and index are loaded on the first recommendation request,
+# then kept for the lifetime of the process.
+def model_path():
+    # A model published by the build pipeline (`recommenders.pipeline`) or
+    # the online updater (`recommenders.online`) is preferred, then the
+    # compact artifact written by `train_colbased.py` (or exported with
+    # `python -m recommenders.svd_factors`), then unpickling a full
+    # surprise model.
+    published = published_path()
+    if published is not None:
+        return published
+    for path in (FACTORS_PATH, FACTORS_PATH + '.npz'):
+        if os.path.exists(path):
+            return path
+    return SVD_PATH
+
+@resource
+@traced('collab.load_model')
+def factors():
+    # We make use of an SVD model trained on a subset of the MovieLens 10k dataset.
+    # Latent factors and biases are loaded once, so requests can score all
+    # users with a matrix product rather than per-user `model.predict`.
+    # The compact artifact is memory-mapped, so app processes share its
+    # pages instead of each holding a copy.
+    path = model_path()
+    if not path.endswith('.pkl'):
+        loaded = load_factors(path)
+    else:
+        with open(path, 'rb') as f:
+            loaded = extract_factors(pickle.load(f))
+    loaded['path'] = path
+    return loaded
+
+@resource
+@traced('collab.build_ann')
+def item_index():
+    # Approximate nearest-neighbour index over the item factors, used to find
+    # the movies most similar to the ones chosen by the app user. Published
+    # models come with an index that was updated along with them.
+    f = factors()
+    ann_path = os.path.join(os.path.dirname(f['path']), ANN_NAME)
+    index = None
+    if os.path.exists(ann_path):
+        try:
+            index = load_ivf(ann_path)
+        except (OSError, ValueError):
+            pass
+    if index is None or len(index['list_items']) != len(f['item_ids']):
+        index = build_ivf(f['qi'])
+    # The factors it indexes, see `model`
+    index['factors'] = f
+    return index
+
+def model():
+    # Factors and ANN index of the same model version. A new version can be
+    # published (resetting both) while they are loaded: an index built from
+    # other factors than the current ones is dropped and rebuilt.
+    while True:
+        f = factors()
+        index = item_index()
+        if index['factors'] is f:
+            return f, index
+        if factors() is f:
+            item_index.reset()
 
-# We make use of an SVD model trained on a subset of the MovieLens 10k dataset.
-model=pickle.load(open('resources/models/SVD.pkl', 'rb'))
+_loaded = {'version': None}
+_loaded_lock = threading.Lock()
 
+def model_version():
+    # Cached results are only reused while the data and model are unchanged.
+    # Checked on every request (a stat of each file), so a newly published
+    # model replaces the loaded one without restarting the app.
+    version = version_of(MOVIES_PATH, version_file(model_path()),
+                         served_tables_path()) + f'-probe{N_PROBE}'
+    with _loaded_lock:
+        if _loaded['version'] != version:
+            if _loaded['version'] is not None:
+                factors.reset()
+                item_index.reset()
+            _loaded['version'] = version
+    return version
+
+def known_items(f, item_ids):
+    # Movies without factors would only be scored on the global mean and the
+    # user biases. They are replaced by the most popular movie of their
+    # genres and decade that has factors.
+    index = f['item_index']
+    item_ids = np.array(item_ids)
+    inner = index.get_indexer(item_ids)
+    for i in np.flatnonzero(inner < 0):
+        rows = ids_to_rows([item_ids[i]])
+        candidates = get_catalogue()['movie_ids'][
+            fallback_rows(rows[rows >= 0].tolist(), PROXY_CANDIDATES)]
+        candidates = candidates[index.get_indexer(candidates) >= 0]
+        if len(candidates):
+            item_ids[i] = candidates[0]
+    return item_ids
+
+@traced('collab.prediction_item')
 def prediction_item(item_id):
     """Map a given favourite movie to users within the
        MovieLens dataset with the same preference.
@@ -57,19 +167,15 @@ def prediction_item(item_id):
     Returns
     -------
     list
-        User IDs of users with similar high ratings for the given movie.
+        User IDs of the 10 users with the highest predicted rating
+        for the given movie.
 
     """
-    # Data preprosessing
-    reader = Reader(rating_scale=(0, 5))
-    load_df = Dataset.load_from_df(ratings_df,reader)
-    a_train = load_df.build_full_trainset()
-
-    predictions = []
-    for ui in a_train.all_users():
-        predictions.append(model.predict(iid=item_id,uid=ui, verbose = False))
-    return predictions
+    model_version()  # reload the model if a new version was published
+    f = factors()
+    return top_users(f, known_items(f, [item_id]), n=10)[0].tolist()
 
+@traced('collab.pred_movies')
 def pred_movies(movie_list):
     """Maps the given favourite movies selected within the app to corresponding
     users within the MovieLens dataset.
@@ -85,21 +191,18 @@ def pred_movies(movie_list):
         User-ID's of users with similar high ratings for each movie.
 
     """
-    # Store the id of users
-    id_store=[]
-    # For each movie selected by a user of the app,
-    # predict a corresponding user within the dataset with the highest rating
-    for i in movie_list:
-        predictions = prediction_item(item_id = i)
-        predictions.sort(key=lambda x: x.est, reverse=True)
-        # Take the top 10 user id's from each movie with highest rankings
-        for pred in predictions[:10]:
-            id_store.append(pred.uid)
+    # For each movie selected by a user of the app, predict the users
+    # within the dataset with the highest rating. All movies are scored
+    # against all users in a single matrix product.
+    model_version()  # reload the model if a new version was published
+    f = factors()
+    id_store = top_users(f, known_items(f, movie_list), n=10)
     # Return a list of user id's
-    return id_store
+    return id_store.ravel().tolist()
 
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
+@recommendation_cache.memoize('collab', model_version)
 def collab_model(movie_list,top_n=10):
     """Performs Collaborative filtering based upon a list of movies supplied
        by the app user.
@@ -118,31 +221,40 @@ def collab_model(movie_list,top_n=10):
 
     """
 
-    indices = pd.Series(movies_df['title'])
-    movie_ids = pred_movies(movie_list)
-    df_init_users = ratings_df[ratings_df['userId']==movie_ids[0]]
-    for i in movie_ids :
-        df_init_users=df_init_users.append(ratings_df[ratings_df['userId']==i])
-    # Getting the cosine similarity matrix
-    cosine_sim = cosine_similarity(np.array(df_init_users), np.array(df_init_users))
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-    # Creating a Series with the similarity scores in descending order
-    rank_1 = cosine_sim[idx_1]
-    rank_2 = cosine_sim[idx_2]
-    rank_3 = cosine_sim[idx_3]
-    # Calculating the scores
-    score_series_1 = pd.Series(rank_1).sort_values(ascending = False)
-    score_series_2 = pd.Series(rank_2).sort_values(ascending = False)
-    score_series_3 = pd.Series(rank_3).sort_values(ascending = False)
-     # Appending the names of movies
-    listings = score_series_1.append(score_series_1).append(score_series_3).sort_values(ascending = False)
-    recommended_movies = []
-    # Choose top 50
-    top_50_indexes = list(listings.iloc[1:50].index)
-    # Removing chosen movies
-    top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-    for i in top_indexes[:top_n]:
-        recommended_movies.append(list(movies_df['title'])[i])
+    # A model published during the request replaces the loaded one: its
+    # factors and index are read once, so they come from the same version
+    f, index = model()
+    with stage('collab.lookup'):
+        catalogue = get_catalogue()
+        # Titles missing from the catalogue are ignored
+        seed_rows = [catalogue['title_rows'][title] for title in movie_list
+                     if title in catalogue['title_rows']]
+        seed_ids = catalogue['movie_ids'][seed_rows]
+        # Only movies rated in the training data have item factors
+        seed_inner = f['item_index'].get_indexer(seed_ids)
+        seed_inner = seed_inner[seed_inner >= 0]
+    if len(seed_inner) == 0:
+        # Nothing to search from: popular movies resembling the chosen ones
+        with stage('collab.fallback'):
+            return catalogue['titles'][fallback_rows(seed_rows, top_n)].tolist()
+    with stage('collab.search'):
+        # Finding the movies whose factors are closest to each chosen movie
+        n_probe = N_PROBE
+        if len(index['list_items']) < EXACT_SEARCH_ITEMS:
+            n_probe = len(index['centroids'])
+        neighbours = search(index, f['qi'][seed_inner],
+                            k=2 * top_n + len(seed_inner), n_probe=n_probe)
+    with stage('collab.rank'):
+        # Movies missing from the catalogue are excluded with the chosen
+        # movies, before the cut-off
+        candidates = np.concatenate([items for items, _ in neighbours])
+        missing = candidates[ids_to_rows(f['item_ids'][candidates],
+                                         catalogue) < 0]
+        # Merging the neighbour lists, keeping the best score per movie
+        top_inner, _ = merge_top_n(neighbours, top_n, fusion='max',
+                                   exclude=np.concatenate([seed_inner, missing]))
+    with stage('collab.titles'):
+        top_rows = ids_to_rows(f['item_ids'][top_inner], catalogue)
+        top_rows = top_up(top_rows, seed_rows, top_n)
+        recommended_movies = catalogue['titles'][top_rows].tolist()
     return recommended_movies
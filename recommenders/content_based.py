@@ -28,16 +28,35 @@
 """
 
 # Script dependencies
-import os
-import pandas as pd
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
+from recommenders.content_features import (load_served, served_features_path,
+                                           similarity)
+from utils.data_store import load_movies, MOVIES_PATH
+from utils.catalogue import get_catalogue
+from utils.cache import recommendation_cache, version_of
+from utils.lazy import resource
+from utils.tracing import stage, traced
+from recommenders.topn import merge_top_n
+from recommenders.popularity import top_up, served_tables_path
 
 # Importing data
-movies = pd.read_csv('resources/data/movies.csv', sep = ',',delimiter=',')
-ratings = pd.read_csv('resources/data/ratings.csv')
-movies.dropna(inplace=True)
+# Data and features are loaded on the first recommendation request, then
+# kept for the lifetime of the process.
+@resource
+def movies():
+    return load_movies().dropna()
+
+@resource
+@traced('content.load_features')
+def content_features():
+    # Sparse TF-IDF genre, title and year features of every movie, built
+    # offline by `python -m recommenders.pipeline` (or
+    # `python -m recommenders.content_features`).
+    return load_served()
+
+@resource
+def model_version():
+    # Cached results are only reused while the data and features are unchanged
+    return version_of(MOVIES_PATH, served_features_path(), served_tables_path())
 
 def data_preprocessing(subset_size):
     """Prepare data for use within Content filtering algorithm.
@@ -54,13 +73,13 @@ def data_preprocessing(subset_size):
 
     """
     # Split genre data into individual words.
-    movies['keyWords'] = movies['genres'].str.replace('|', ' ')
-    # Subset of the data
-    movies_subset = movies[:subset_size]
+    movies_subset = movies()[:subset_size].assign(
+        keyWords=movies()['genres'].str.replace('|', ' ', regex=False))
     return movies_subset
 
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
+@recommendation_cache.memoize('content', model_version)
 def content_model(movie_list,top_n=10):
     """Performs Content filtering based upon a list of movies supplied
        by the app user.
@@ -78,35 +97,29 @@ def content_model(movie_list,top_n=10):
         Titles of the top-n movie recommendations to the user.
 
     """
-    # Initializing the empty list of recommended movies
-    recommended_movies = []
-    data = data_preprocessing(27000)
-    # Instantiating and generating the count matrix
-    count_vec = CountVectorizer()
-    count_matrix = count_vec.fit_transform(data['keyWords'])
-    indices = pd.Series(data['title'])
-    cosine_sim = cosine_similarity(count_matrix, count_matrix)
-    # Getting the index of the movie that matches the title
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-    # Creating a Series with the similarity scores in descending order
-    rank_1 = cosine_sim[idx_1]
-    rank_2 = cosine_sim[idx_2]
-    rank_3 = cosine_sim[idx_3]
-    # Calculating the scores
-    score_series_1 = pd.Series(rank_1).sort_values(ascending = False)
-    score_series_2 = pd.Series(rank_2).sort_values(ascending = False)
-    score_series_3 = pd.Series(rank_3).sort_values(ascending = False)
-    # Getting the indexes of the 10 most similar movies
-    listings = score_series_1.append(score_series_1).append(score_series_3).sort_values(ascending = False)
-
-    # Store movie names
-    recommended_movies = []
-    # Appending the names of movies
-    top_50_indexes = list(listings.iloc[1:50].index)
-    # Removing chosen movies
-    top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-    for i in top_indexes[:top_n]:
-        recommended_movies.append(list(movies['title'])[i])
+    with stage('content.lookup'):
+        catalogue = get_catalogue()
+        # Getting the index of the movie that matches the title; titles
+        # missing from the catalogue are ignored
+        seeds = [catalogue['title_rows'][title] for title in movie_list
+                 if title in catalogue['title_rows']]
+    with stage('content.similarity'):
+        # Scoring the whole catalogue against each chosen movie; only movies
+        # sharing a feature with it are non-zero
+        neighbours = []
+        if seeds:
+            sims = similarity(content_features(), seeds)
+            neighbours = [(sims.indices[start:end], sims.data[start:end])
+                          for start, end in zip(sims.indptr[:-1], sims.indptr[1:])]
+    with stage('content.rank'):
+        # Merging the neighbour lists, keeping the best score per movie and
+        # removing chosen movies
+        top_indexes, _ = merge_top_n(neighbours, top_n, fusion='max',
+                                     exclude=seeds)
+        # Popular movies resembling the chosen ones make up for unknown
+        # titles and movies without similar features
+        top_indexes = top_up(top_indexes, seeds, top_n)
+    with stage('content.titles'):
+        # Store movie names
+        recommended_movies = catalogue['titles'][top_indexes].tolist()
     return recommended_movies
@@ -0,0 +1,261 @@
+"""
+
+    Sparse TF-IDF content features of the movie catalogue.
+
+    Author: Explore Data Science Academy.
+
+    Description: Describes every movie by three blocks of tokens, each
+    weighted by TF-IDF and L2-normalised on its own:
+
+      - its genres (`Comedy`, `Sci-Fi`, ...);
+      - the words of its title (normalised as for title search, minus
+        common stop words), so sequels and series share features;
+      - its release year and decade, so movies of the same era score
+        higher than otherwise identical ones.
+
+    The blocks are combined with the weights of `BLOCK_WEIGHTS` into one
+    L2-normalised sparse row per movie, so the dot product of two rows is
+    a weighted cosine similarity. The matrix is built once per version of
+    `movies.csv` and persisted as a compressed `.npz`.
+
+    `similarity` scores a few seed movies against the full catalogue
+    with a sparse-times-sparse product against the transposed feature
+    matrix: only movies sharing at least one token with a seed are
+    touched, and nothing is densified.
+
+    The app serves the features of the published build
+    (`python -m recommenders.pipeline`) when they match `movies.csv`.
+
+    Usage (rebuild the features after `movies.csv` changes):
+
+        python -m recommenders.content_features \\
+            --movies resources/data/movies.csv \\
+            --output resources/models/content_features.npz
+
+"""
+
+# Script dependencies
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from recommenders.artifacts import load_published, served_path, FEATURES_NAME
+from utils.catalogue import normalize_title, NO_GENRES, TITLE_YEAR
+from utils.data_store import file_digest, load_movies, MOVIES_PATH
+
+FEATURES_PATH = 'resources/models/content_features.npz'
+FEATURES_VERSION = 1
+
+# Share of each block in the squared norm of a movie's feature row
+BLOCK_WEIGHTS = {'genre': 0.6, 'title': 0.25, 'year': 0.15}
+STOP_WORDS = frozenset(
+    'a an and at by de des du el for from in into is it la le les of on or '
+    'the to with'.split())
+
+
+def movie_tokens(movies):
+    """Token lists of every movie, by feature block.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movie records with `title` and `genres` columns.
+
+    Returns
+    -------
+    dict
+        Block name -> list (one entry per movie) of token lists.
+
+    """
+    titles = movies['title'].fillna('').tolist()
+    genres = [[g for g in value.split('|') if g != NO_GENRES]
+              for value in movies['genres'].fillna('').tolist()]
+    words, years = [], []
+    for title in titles:
+        match = TITLE_YEAR.search(title)
+        year = match.group(1) if match else None
+        tokens = normalize_title(title).split()
+        if year and tokens and tokens[-1] == year:
+            tokens = tokens[:-1]
+        words.append([w for w in dict.fromkeys(tokens)
+                      if len(w) > 1 and w not in STOP_WORDS])
+        years.append([year, year[:3] + '0s'] if year else [])
+    return {'genre': genres, 'title': words, 'year': years}
+
+
+def _tfidf_block(token_lists):
+    """Binary TF-IDF matrix of one block, rows L2-normalised."""
+    lengths = np.fromiter((len(t) for t in token_lists), dtype=np.int64,
+                          count=len(token_lists))
+    flat = [token for tokens in token_lists for token in tokens]
+    columns, vocabulary = pd.factorize(pd.Series(flat, dtype=object))
+    rows = np.repeat(np.arange(len(token_lists)), lengths)
+    matrix = sp.csr_matrix(
+        (np.ones(len(flat), dtype=np.float32), (rows, columns)),
+        shape=(len(token_lists), len(vocabulary)))
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    n_docs = len(token_lists)
+    df = np.bincount(matrix.indices, minlength=len(vocabulary))
+    idf = np.log((1 + n_docs) / (1 + df)) + 1
+    matrix = matrix @ sp.diags(idf.astype(np.float32))
+    return _normalize(matrix.tocsr()), np.asarray(vocabulary, dtype=object)
+
+
+def _normalize(matrix):
+    """L2-normalise the rows of a CSR matrix (empty rows stay empty)."""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1))).ravel()
+    norms[norms == 0] = 1
+    return (sp.diags((1 / norms).astype(np.float32)) @ matrix).tocsr()
+
+
+def build_features(movies):
+    """Build the sparse content feature matrix of a catalogue.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movie records with `title` and `genres` columns.
+
+    Returns
+    -------
+    tuple (scipy.sparse.csr_matrix, numpy.ndarray)
+        float32 feature matrix (one L2-normalised row per movie, in
+        catalogue order) and the token of each column, prefixed by its
+        block (`'genre:Drama'`).
+
+    """
+    blocks, vocabularies = [], []
+    for name, token_lists in movie_tokens(movies).items():
+        matrix, vocabulary = _tfidf_block(token_lists)
+        blocks.append(matrix * np.float32(np.sqrt(BLOCK_WEIGHTS[name])))
+        vocabularies.append(np.array([f'{name}:{token}' for token in vocabulary],
+                                     dtype=object))
+    features = _normalize(sp.hstack(blocks, format='csr', dtype=np.float32))
+    features.sort_indices()
+    return features, np.concatenate(vocabularies)
+
+
+def save_features(path, features, vocabulary, movie_ids, source_digest):
+    """Persist a feature matrix as a compressed `.npz`, atomically."""
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(tmp_path,
+                        version=np.int32(FEATURES_VERSION),
+                        data=features.data, indices=features.indices,
+                        indptr=features.indptr,
+                        shape=np.array(features.shape, dtype=np.int64),
+                        vocabulary=vocabulary.astype(str),
+                        movie_ids=np.asarray(movie_ids, dtype=np.int32),
+                        source_digest=np.array(source_digest))
+    os.replace(tmp_path, path)
+
+
+def load_features(path=FEATURES_PATH, movies_path=None):
+    """Load persisted content features.
+
+    Parameters
+    ----------
+    path : str
+        Path to the `.npz` features.
+    movies_path : str, optional
+        If given, features built from a different version of this movie
+        file are rejected.
+
+    Returns
+    -------
+    dict
+        `features` (CSR, movies x tokens), its transpose `features_t`
+        (CSR, tokens x movies), `vocabulary` and `movie_ids`.
+
+    Raises
+    ------
+    FileNotFoundError
+        If no features exist at `path`.
+    ValueError
+        If the features are from an incompatible version or are stale.
+
+    """
+    with np.load(path) as data:
+        if int(data['version']) != FEATURES_VERSION:
+            raise ValueError(f"Unsupported content features version in {path}")
+        if movies_path is not None and \
+                str(data['source_digest']) != file_digest(movies_path):
+            raise ValueError(f"Content features {path} are stale for {movies_path}")
+        features = sp.csr_matrix(
+            (data['data'], data['indices'], data['indptr']),
+            shape=tuple(data['shape']))
+        return _with_transpose(features, data['vocabulary'], data['movie_ids'])
+
+
+def _with_transpose(features, vocabulary, movie_ids):
+    features_t = features.T.tocsr()
+    features_t.sort_indices()
+    return {'features': features, 'features_t': features_t,
+            'vocabulary': vocabulary, 'movie_ids': movie_ids}
+
+
+def build_from_csv(movies_path=MOVIES_PATH, output_path=FEATURES_PATH):
+    """Build the features of a movie file and save them."""
+    movies = load_movies(movies_path)
+    features, vocabulary = build_features(movies)
+    save_features(output_path, features, vocabulary, movies['movieId'].values,
+                  file_digest(movies_path))
+    return _with_transpose(features, vocabulary,
+                           movies['movieId'].values.astype(np.int32))
+
+
+def load_or_build(movies_path=MOVIES_PATH, features_path=FEATURES_PATH):
+    """Load the content features, rebuilding them if missing or stale."""
+    try:
+        return load_features(features_path, movies_path=movies_path)
+    except (FileNotFoundError, ValueError, KeyError):
+        return build_from_csv(movies_path, features_path)
+
+
+def load_served(movies_path=MOVIES_PATH, features_path=FEATURES_PATH):
+    """Published content features of `movies_path`, else the local ones."""
+    return load_published(
+        FEATURES_NAME,
+        lambda path: load_features(path, movies_path=movies_path),
+        lambda: load_or_build(movies_path, features_path))
+
+
+def served_features_path(features_path=FEATURES_PATH):
+    """Path of the features `load_served` prefers."""
+    return served_path(FEATURES_NAME, features_path)
+
+
+def similarity(index, rows):
+    """Similarity of some movies to every movie of the catalogue.
+
+    Parameters
+    ----------
+    index : dict
+        Features as returned by `load_features`.
+    rows : list (int)
+        Catalogue rows of the seed movies.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        (len(rows), n_movies) weighted cosine similarities; movies sharing
+        no token with a seed are absent from its row. Column indices
+        within a row are not sorted.
+
+    """
+    return index['features'][np.asarray(rows)] @ index['features_t']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build the sparse TF-IDF content features.')
+    parser.add_argument('--movies', default=MOVIES_PATH)
+    parser.add_argument('--output', default=FEATURES_PATH)
+    args = parser.parse_args()
+    start = time.time()
+    index = build_from_csv(args.movies, args.output)
+    print(f"Built {index['features'].shape[0]} x {index['features'].shape[1]} "
+          f"features ({index['features'].nnz} non-zeros) in "
+          f"{time.time() - start:.1f}s. Saved to: {args.output}")
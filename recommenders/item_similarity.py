@@ -0,0 +1,148 @@
+"""
+
+    Sparse user-item store and item-item similarity engine.
+
+    Author: Explore Data Science Academy.
+
+    Description: Replaces the dense userId x title pivot table of the
+    Recommender page. Ratings are held in a compressed sparse column
+    (CSC) matrix with per-item sums, so the Pearson (or cosine)
+    similarity between a handful of chosen movies and every other movie
+    can be computed from the few users who rated the chosen movies,
+    without materialising a full correlation matrix.
+
+    As in the original `pivot.fillna(0).corr()` approach, Pearson
+    correlation is taken over all users with missing ratings counted as
+    zero, which allows it to be expanded into sparse dot products:
+
+        corr(a, b) = (x_a . x_b / n - mean_a * mean_b) / (std_a * std_b)
+
+"""
+
+# Script dependencies
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from utils.tracing import stage, traced
+from recommenders.topn import fuse, top_n as select_top_n
+
+MIN_RATINGS = 10
+
+
+@traced('pearson.build_user_item')
+def build_user_item(ratings):
+    """Build the sparse user-item rating store.
+
+    Parameters
+    ----------
+    ratings : Pandas Dataframe
+        Rating records with `userId`, `movieId` and `rating` columns.
+
+    Returns
+    -------
+    dict
+        `matrix` (float32 CSC, users x items), `user_ids`, `item_ids`
+        (sorted raw ids of the rows and columns), `item_index` (raw
+        movie id to column), and per-item `counts`, `sums` and `sumsq`.
+
+    """
+    ratings = ratings.drop_duplicates(['userId', 'movieId'], keep='last')
+    user_ids, rows = np.unique(ratings['userId'].values, return_inverse=True)
+    item_ids, cols = np.unique(ratings['movieId'].values, return_inverse=True)
+    values = ratings['rating'].values.astype(np.float32)
+    matrix = sp.csc_matrix((values, (rows, cols)),
+                           shape=(len(user_ids), len(item_ids)))
+    return {
+        'matrix': matrix,
+        'user_ids': user_ids,
+        'item_ids': item_ids,
+        'item_index': pd.Index(item_ids),
+        'counts': np.diff(matrix.indptr),
+        'sums': np.asarray(matrix.sum(axis=0)).ravel().astype(np.float64),
+        'sumsq': np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel()
+                   .astype(np.float64),
+    }
+
+
+def similarity_columns(store, columns, method='pearson'):
+    """Similarity of a few items to every item in the store.
+
+    Parameters
+    ----------
+    store : dict
+        User-item store as returned by `build_user_item`.
+    columns : list (int)
+        Column positions of the seed items.
+    method : str
+        `'pearson'` or `'cosine'`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Matrix of shape (len(columns), n_items).
+
+    """
+    matrix = store['matrix']
+    # Only the users who rated a seed contribute to its dot products
+    dots = (matrix[:, columns].T @ matrix).toarray()
+    if method == 'cosine':
+        norms = np.sqrt(store['sumsq'])
+        denom = norms[columns][:, None] * norms[None, :]
+    elif method == 'pearson':
+        n_users = matrix.shape[0]
+        means = store['sums'] / n_users
+        stds = np.sqrt(np.maximum(store['sumsq'] / n_users - means ** 2, 0))
+        dots = dots / n_users - means[columns][:, None] * means[None, :]
+        denom = stds[columns][:, None] * stds[None, :]
+    else:
+        raise ValueError(f"Unknown similarity method: {method}")
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sims = dots / denom
+    sims[~np.isfinite(sims)] = 0
+    return sims
+
+
+def recommend_similar(store, seeds, top_n=10, method='pearson',
+                      min_ratings=MIN_RATINGS):
+    """Recommend the items most similar to a set of rated seed items.
+
+    Each seed's similarity column is weighted by how much the user liked
+    it (`rating - 2.5`) and the columns are summed.
+
+    Parameters
+    ----------
+    store : dict
+        User-item store as returned by `build_user_item`.
+    seeds : list of tuple (int, float)
+        (movieId, rating) pairs chosen by the app user. Seeds unknown to
+        the store, or with fewer than `min_ratings` ratings, are ignored.
+    top_n : int
+        Number of movies to recommend.
+    method : str
+        `'pearson'` or `'cosine'`.
+    min_ratings : int
+        Items with fewer ratings are neither seeds nor candidates.
+
+    Returns
+    -------
+    list (int)
+        MovieLens ids of the recommended movies, best first.
+
+    """
+    ids = [movie_id for movie_id, _ in seeds]
+    weights = np.array([rating - 2.5 for _, rating in seeds], dtype=np.float64)
+    columns = store['item_index'].get_indexer(ids)
+    eligible = store['counts'] >= min_ratings
+    known = columns >= 0
+    known[known] = eligible[columns[known]]
+    if not known.any():
+        return []
+    columns, weights = columns[known], weights[known]
+
+    with stage('pearson.similarity'):
+        scores = fuse(similarity_columns(store, columns, method=method),
+                      'weighted', weights)
+    with stage('pearson.rank'):
+        scores[~eligible] = -np.inf
+        top = select_top_n(scores, top_n, exclude=columns)
+    return store['item_ids'][top].tolist()
@@ -0,0 +1,172 @@
+"""
+
+    Incremental SVD updates from new ratings.
+
+    Author: Explore Data Science Academy.
+
+    Description: Retraining the SVD from scratch with
+    `resources/models/train_colbased.py` takes minutes. New ratings can
+    instead be folded into the served model:
+
+      - `fold_in` runs a few epochs of SGD (`recommenders.sgd`, shared with
+        the trainer) over the new ratings only, so only the factors and
+        biases of the users and movies they involve change. Users and
+        movies unknown to the model get freshly initialised factors.
+      - The approximate nearest-neighbour index over the item factors is
+        updated in place of a rebuild: changed and new movies are
+        re-assigned to the existing clusters (`ann.update_ivf`).
+      - `publish` writes the factors and the index into a new version
+        directory under `resources/models/published/` and then swaps
+        the `CURRENT` pointer file with an atomic rename (see
+        `recommenders.artifacts`); the other artifacts of the current
+        version are carried over. Running app processes check the
+        pointer on each request and reload the model when it changes,
+        without a restart.
+
+    Usage:
+
+        python -m recommenders.online --delta new_ratings.csv --epochs 10
+
+    where `new_ratings.csv` has `userId,movieId,rating` columns.
+
+"""
+
+# Script dependencies
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from recommenders import artifacts
+from recommenders.ann import build_ivf, save_ivf, update_ivf
+from recommenders.artifacts import ANN_NAME, FACTORS_NAME, PUBLISH_DIR
+from recommenders.sgd import sgd_epoch, INIT_STD
+from recommenders.svd_factors import make_factors, save_factors
+
+
+def _extend(ids, new_ids, matrix, bias, rng):
+    """Append freshly initialised rows for new users or items."""
+    rows = rng.normal(0, INIT_STD, (len(new_ids), matrix.shape[1]))
+    return (np.concatenate([ids, new_ids.astype(ids.dtype)]),
+            np.concatenate([matrix, rows.astype(np.float32)]),
+            np.concatenate([bias, np.zeros(len(new_ids), dtype=np.float32)]))
+
+
+def fold_in(factors, delta, n_epochs=10, lr=0.005, reg=0.02, seed=0):
+    """Fold new ratings into trained SVD factors.
+
+    Parameters
+    ----------
+    factors : dict
+        Current factors (see `recommenders.svd_factors`); not modified.
+    delta : Pandas Dataframe
+        New `userId`, `movieId`, `rating` records.
+    n_epochs : int
+        Number of SGD passes over the new ratings.
+    lr, reg : float
+        Learning rate and regularisation, as used for training.
+    seed : int
+        Random seed of the initialisation and shuffling.
+
+    Returns
+    -------
+    tuple (dict, numpy.ndarray)
+        Updated factors, and the inner ids of the items whose factors
+        changed (new items included).
+
+    """
+    rng = np.random.default_rng(seed)
+    user_ids, pu, bu = _extend(
+        factors['user_ids'],
+        np.setdiff1d(delta['userId'].to_numpy(), factors['user_ids']),
+        factors['pu'], factors['bu'], rng)
+    item_ids, qi, bi = _extend(
+        factors['item_ids'],
+        np.setdiff1d(delta['movieId'].to_numpy(), factors['item_ids']),
+        factors['qi'], factors['bi'], rng)
+    updated = make_factors(pu, qi, bu, bi, factors['global_mean'],
+                           factors['rating_scale'], user_ids, item_ids)
+
+    users = updated['user_index'].get_indexer(delta['userId']).astype(np.int32)
+    items = updated['item_index'].get_indexer(delta['movieId']).astype(np.int32)
+    values = delta['rating'].to_numpy(dtype=np.float32)
+    for epoch in range(n_epochs):
+        sgd_epoch(updated, users, items, values, updated['global_mean'],
+                   lr, reg, np.random.default_rng([seed, epoch]))
+    return updated, np.unique(items)
+
+
+def publish(factors, ann_index, metadata=None, publish_dir=PUBLISH_DIR):
+    """Publish a model version atomically.
+
+    The factors and index replace those of the current version; its
+    other artifacts (content features, popularity tables) are kept.
+
+    Returns
+    -------
+    str
+        Name of the new version.
+
+    """
+    def write(version_dir):
+        save_factors(factors, os.path.join(version_dir, FACTORS_NAME), metadata)
+        save_ivf(os.path.join(version_dir, ANN_NAME), ann_index)
+
+    return artifacts.publish(write, carry_over=True, publish_dir=publish_dir)
+
+
+def update(delta, n_epochs=10, lr=0.005, reg=0.02, publish_dir=PUBLISH_DIR):
+    """Fold new ratings into the served model and publish the result.
+
+    Parameters
+    ----------
+    delta : Pandas Dataframe
+        New `userId`, `movieId`, `rating` records.
+
+    Returns
+    -------
+    dict
+        New `version`, number of `ratings`, `new_users`, `new_items`
+        and `changed_items`, and the `seconds` taken.
+
+    """
+    from recommenders import collaborative_based
+
+    start = time.perf_counter()
+    factors, index = collaborative_based.model()
+    updated, changed = fold_in(factors, delta, n_epochs, lr, reg)
+    try:
+        index = update_ivf(index, updated['qi'], changed)
+    except ValueError:
+        index = build_ivf(updated['qi'])
+    summary = {
+        'ratings': len(delta),
+        'new_users': len(updated['user_ids']) - len(factors['user_ids']),
+        'new_items': len(updated['item_ids']) - len(factors['item_ids']),
+        'changed_items': len(changed),
+    }
+    metadata = dict(factors.get('metadata', {}))
+    metadata.setdefault('updates', [])
+    metadata['updates'] = metadata['updates'] + [
+        dict(summary, n_epochs=n_epochs, lr=lr, reg=reg,
+             time=time.strftime('%Y-%m-%dT%H:%M:%S'))]
+    summary['version'] = publish(updated, index, metadata, publish_dir)
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Fold new ratings into the served SVD model.')
+    parser.add_argument('--delta', required=True,
+                        help='CSV of new userId,movieId,rating rows')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--lr', type=float, default=0.005)
+    parser.add_argument('--reg', type=float, default=0.02)
+    parser.add_argument('--publish-dir', default=PUBLISH_DIR)
+    args = parser.parse_args()
+
+    delta = pd.read_csv(args.delta, usecols=['userId', 'movieId', 'rating'])
+    summary = update(delta, args.epochs, args.lr, args.reg, args.publish_dir)
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,358 @@
+"""
+
+    Build pipeline of every serving artifact.
+
+    Author: Explore Data Science Academy.
+
+    Description: Produces all the artifacts the app serves from, starting
+    from the CSVs, in one command:
+
+      - `catalogue`: the title/id lookups and title search index
+        (`utils.catalogue`), after refreshing the binary column cache of
+        `movies.csv` and `ratings.csv` (`utils.data_store`) that every
+        other stage reads from;
+      - `content_features`: the sparse TF-IDF similarity features
+        (`recommenders.content_features`);
+      - `popularity`: the cold-start popularity tables
+        (`recommenders.popularity`);
+      - `factors`: the memory-mapped SVD factors, exported from a trained
+        model (`--model`) or trained from the ratings with
+        `resources/models/train_colbased.py` (`--train`);
+      - `ann`: the nearest-neighbour index over the item factors
+        (`recommenders.ann`).
+
+    Every stage is identified by a content hash of its input files, its
+    parameters, the format version of its output and the hashes of the
+    stages it depends on. Outputs are kept in
+    `resources/models/build_cache/<stage>-<hash>/`, so a stage whose
+    inputs did not change is skipped. Independent stages run in parallel
+    across a process pool, each as soon as the stages it depends on are
+    done.
+
+    The outputs are then hard-linked into a new read-only version of
+    `resources/models/published/` (see `recommenders.artifacts`), with a
+    `build.json` manifest of the stage hashes and input digests. Nothing
+    is published when the current version was built from the same
+    hashes. App processes load the published artifacts and never write
+    to them; a newly published SVD model is picked up without a restart,
+    the other artifacts on the next start.
+
+    Usage:
+
+        python -m recommenders.pipeline
+        python -m recommenders.pipeline --train --factors 100 --epochs 20
+
+"""
+
+# Script dependencies
+import argparse
+import concurrent.futures
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import time
+from recommenders import artifacts
+from recommenders.artifacts import (ANN_NAME, BUILD_MANIFEST, CATALOGUE_NAME,
+                                    FACTORS_NAME, FEATURES_NAME, PUBLISH_DIR,
+                                    TABLES_NAME)
+from recommenders.collaborative_based import SVD_PATH
+from recommenders.svd_factors import FACTORS_PATH
+from utils.data_store import file_digest, MOVIES_PATH, RATINGS_PATH
+
+BUILD_DIR = 'resources/models/build_cache'
+TRAINER_PATH = 'resources/models/train_colbased.py'
+TRAIN_CONFIG = {'n_factors': 200, 'lr': 0.005, 'reg': 0.02, 'n_epochs': 40,
+                'holdout': 0.0}
+
+
+def _build_catalogue(sources, out_dir, deps, params):
+    from utils.catalogue import build_from_csv
+    from utils.data_store import build_cache, is_fresh
+
+    # Warming the column caches, which live next to each CSV and check
+    # their own freshness, before the other stages read them
+    for kind in ('movies', 'ratings'):
+        if not is_fresh(sources[kind]):
+            build_cache(sources[kind], kind)
+    build_from_csv(sources['movies'], os.path.join(out_dir, CATALOGUE_NAME))
+
+
+def _build_content_features(sources, out_dir, deps, params):
+    from recommenders.content_features import build_from_csv
+
+    build_from_csv(sources['movies'], os.path.join(out_dir, FEATURES_NAME))
+
+
+def _build_popularity(sources, out_dir, deps, params):
+    from recommenders.popularity import build_from_csv
+
+    build_from_csv(sources['movies'], sources['ratings'],
+                   os.path.join(out_dir, TABLES_NAME))
+
+
+def _build_factors(sources, out_dir, deps, params):
+    from recommenders.svd_factors import export
+
+    output = os.path.join(out_dir, FACTORS_NAME)
+    if 'model' in sources:
+        export(sources['model'], output)
+        return
+    # The trainer is a script, not a module of a package
+    spec = importlib.util.spec_from_file_location('train_colbased',
+                                                  TRAINER_PATH)
+    trainer = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = trainer  # so its pool workers can find it
+    spec.loader.exec_module(trainer)
+    config = {name: params[name]
+              for name in ('n_factors', 'lr', 'reg', 'n_epochs')}
+    data = trainer.prepare_data(trainer.load_ratings(sources['ratings']),
+                                holdout=params['holdout'])
+    results = trainer.run_grid([config], data, workers=1)
+    trainer.export_best(results[0], data, output)
+
+
+def _build_ann(sources, out_dir, deps, params):
+    from recommenders.ann import build_ivf, save_ivf
+    from recommenders.svd_factors import load_factors
+
+    factors = load_factors(os.path.join(deps['factors'], FACTORS_NAME))
+    save_ivf(os.path.join(out_dir, ANN_NAME), build_ivf(factors['qi']))
+
+
+# Stages in dependency order: the input files each one reads, the stages
+# it runs after, the artifacts it publishes and the format version of
+# its output (bumped to invalidate cached outputs).
+STAGES = {
+    'catalogue': {'inputs': ('movies',), 'after': (),
+                  'outputs': (CATALOGUE_NAME,), 'version': 1,
+                  'build': _build_catalogue},
+    'content_features': {'inputs': ('movies',), 'after': ('catalogue',),
+                         'outputs': (FEATURES_NAME,), 'version': 1,
+                         'build': _build_content_features},
+    'popularity': {'inputs': ('movies', 'ratings'), 'after': ('catalogue',),
+                   'outputs': (TABLES_NAME,), 'version': 1,
+                   'build': _build_popularity},
+    'factors': {'inputs': ('model',), 'after': (),
+                'outputs': (FACTORS_NAME,), 'version': 1,
+                'build': _build_factors},
+    'ann': {'inputs': (), 'after': ('factors',), 'outputs': (ANN_NAME,),
+            'version': 1, 'build': _build_ann},
+}
+
+
+def default_model():
+    """Trained model to export, or None if the factors must be trained."""
+    for path in (FACTORS_PATH, FACTORS_PATH + '.npz', SVD_PATH):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def digest(path):
+    """md5 digest of a file, or of every file of a directory."""
+    if not os.path.isdir(path):
+        return file_digest(path)
+    md5 = hashlib.md5()
+    for folder, dirs, files in sorted(os.walk(path)):
+        dirs.sort()
+        for name in sorted(files):
+            full = os.path.join(folder, name)
+            md5.update(os.path.relpath(full, path).encode())
+            md5.update(file_digest(full).encode())
+    return md5.hexdigest()
+
+
+def plan(sources, train=TRAIN_CONFIG, build_dir=BUILD_DIR):
+    """Hash every stage of a build.
+
+    Parameters
+    ----------
+    sources : dict
+        Input files: `movies`, `ratings`, and the `model` to export (if
+        absent, the factors are trained from the ratings).
+    train : dict
+        Training configuration, used without a `model`.
+    build_dir : str
+        Folder of the cached stage outputs.
+
+    Returns
+    -------
+    dict
+        Stage name -> `key` (content hash), `dir` (cached output, None
+        for stages without artifacts), `inputs` (digest of each input
+        file) and `params`.
+
+    """
+    digests = {name: digest(path) for name, path in sources.items()}
+    stages = {}
+    for name, spec in STAGES.items():
+        inputs, params = spec['inputs'], {}
+        if name == 'factors' and 'model' not in sources:
+            inputs, params = ('ratings',), dict(train)
+        payload = {
+            'stage': name, 'version': spec['version'], 'params': params,
+            'inputs': {i: digests[i] for i in inputs},
+            # Stages without artifacts only order the build
+            'after': {d: stages[d]['key'] for d in spec['after']
+                      if STAGES[d]['outputs']},
+        }
+        key = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()
+                           ).hexdigest()[:16]
+        stages[name] = {
+            'key': key, 'inputs': payload['inputs'], 'params': params,
+            'dir': (os.path.join(build_dir, f'{name}-{key}')
+                    if spec['outputs'] else None),
+        }
+    return stages
+
+
+def _run_stage(name, sources, out_dir, deps, params):
+    start = time.perf_counter()
+    if out_dir is None:
+        STAGES[name]['build'](sources, None, deps, params)
+        return time.perf_counter() - start
+    # Written aside and renamed, so an interrupted stage is rebuilt
+    tmp_dir = out_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    STAGES[name]['build'](sources, tmp_dir, deps, params)
+    os.replace(tmp_dir, out_dir)
+    return time.perf_counter() - start
+
+
+def _prune(stages, build_dir):
+    """Remove the cached outputs of every stage but the current ones."""
+    keep = {os.path.basename(stage['dir']) for stage in stages.values()
+            if stage['dir']}
+    for name in os.listdir(build_dir):
+        if name not in keep and name.split('-')[0] in STAGES:
+            shutil.rmtree(os.path.join(build_dir, name), ignore_errors=True)
+
+
+def build(sources, train=TRAIN_CONFIG, workers=None, force=False,
+          build_dir=BUILD_DIR, publish_dir=PUBLISH_DIR):
+    """Build every serving artifact and publish them as a new version.
+
+    Parameters
+    ----------
+    sources : dict
+        Input files (see `plan`).
+    train : dict
+        Training configuration, used without a `model`.
+    workers : int, optional
+        Number of stages run at once; defaults to the number of CPUs.
+    force : bool
+        Rebuild every stage and publish even if nothing changed.
+    build_dir : str
+        Folder of the cached stage outputs.
+    publish_dir : str
+        Folder of the published versions.
+
+    Returns
+    -------
+    dict
+        Published `version`, whether it is `new`, per-stage `stages`
+        (`key`, `status` of 'built', 'cached' or 'checked' for stages
+        without artifacts, `seconds`) and the total
+        `seconds`.
+
+    """
+    start = time.perf_counter()
+    stages = plan(sources, train, build_dir)
+    os.makedirs(build_dir, exist_ok=True)
+    report, running = {}, {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        while len(report) < len(stages):
+            # Stages are in dependency order, so one pass starts (or
+            # skips) everything whose dependencies are done
+            for name, stage in stages.items():
+                ready = all(d in report for d in STAGES[name]['after'])
+                if name in report or name in running.values() or not ready:
+                    continue
+                if stage['dir'] and os.path.isdir(stage['dir']) and not force:
+                    report[name] = {'key': stage['key'], 'status': 'cached',
+                                    'seconds': 0.0}
+                    continue
+                deps = {d: stages[d]['dir'] for d in STAGES[name]['after']}
+                future = pool.submit(_run_stage, name, sources, stage['dir'],
+                                     deps, stage['params'])
+                running[future] = name
+            if not running:
+                continue
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                status = 'built' if stages[name]['dir'] else 'checked'
+                report[name] = {'key': stages[name]['key'], 'status': status,
+                                'seconds': future.result()}
+
+    manifest = {
+        'stages': {name: stage['key'] for name, stage in stages.items()},
+        'inputs': {name: {'path': sources[name], 'digest': value}
+                   for stage in stages.values()
+                   for name, value in stage['inputs'].items()},
+        'built': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    current = artifacts.published_path(BUILD_MANIFEST, publish_dir)
+    new = True
+    if current is not None and not force:
+        with open(current) as f:
+            new = json.load(f)['stages'] != manifest['stages']
+    if new:
+        def write(version_dir):
+            for name, stage in stages.items():
+                for output in STAGES[name]['outputs']:
+                    artifacts.link_tree(os.path.join(stage['dir'], output),
+                                        os.path.join(version_dir, output))
+            with open(os.path.join(version_dir, BUILD_MANIFEST), 'w') as f:
+                json.dump(manifest, f, indent=2)
+
+        version = artifacts.publish(write, carry_over=False,
+                                    publish_dir=publish_dir)
+    else:
+        version = artifacts.current_version(publish_dir)
+    _prune(stages, build_dir)
+    return {'version': version, 'new': new, 'stages': report,
+            'seconds': time.perf_counter() - start}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build and publish every serving artifact.')
+    parser.add_argument('--movies', default=MOVIES_PATH)
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    parser.add_argument('--model', default=default_model(),
+                        help='Pickled SVD model or factors artifact to '
+                             'export (default: the first one found)')
+    parser.add_argument('--train', action='store_true',
+                        help='Train the factors from the ratings instead')
+    parser.add_argument('--factors', type=int,
+                        default=TRAIN_CONFIG['n_factors'])
+    parser.add_argument('--lr', type=float, default=TRAIN_CONFIG['lr'])
+    parser.add_argument('--reg', type=float, default=TRAIN_CONFIG['reg'])
+    parser.add_argument('--epochs', type=int,
+                        default=TRAIN_CONFIG['n_epochs'])
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild every stage and publish a new version')
+    parser.add_argument('--build-dir', default=BUILD_DIR)
+    parser.add_argument('--publish-dir', default=PUBLISH_DIR)
+    args = parser.parse_args()
+
+    sources = {'movies': args.movies, 'ratings': args.ratings}
+    if args.model and not args.train:
+        sources['model'] = args.model
+    train = {'n_factors': args.factors, 'lr': args.lr, 'reg': args.reg,
+             'n_epochs': args.epochs, 'holdout': 0.0}
+    summary = build(sources, train, args.workers, args.force,
+                    args.build_dir, args.publish_dir)
+    for name, stage in summary['stages'].items():
+        print(f"{name:18s} {stage['status']:7s} {stage['seconds']:7.1f}s "
+              f"{stage['key']}")
+    state = 'Published' if summary['new'] else 'Up to date:'
+    print(f"{state} version {summary['version']} in "
+          f"{summary['seconds']:.1f}s. Saved to: {args.publish_dir}")
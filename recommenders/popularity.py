@@ -0,0 +1,344 @@
+"""
+
+    Popularity tables for cold-start and unknown-seed fallbacks.
+
+    Author: Explore Data Science Academy.
+
+    Description: When the chosen movies tell a recommender nothing (titles
+    missing from the catalogue, movies nobody rated, movies without
+    factors or content features) it serves popular movies instead of
+    raising or ranking meaningless scores. The tables are built in one
+    streaming pass over `ratings.csv`, persisted next to the models, and
+    answer every lookup in constant time:
+
+      - the Bayesian-average rating of every movie,
+        `(C * mean + sum) / (C + count)`, which shrinks movies with few
+        ratings towards the global mean (`C` is the average number of
+        ratings per rated movie);
+      - the catalogue ranked by Bayesian average;
+      - the `TOP_K` best movies of every genre and of every release
+        decade.
+
+    `fallback_rows` sums the Bayesian averages of a movie over the genre
+    and decade lists of the chosen movies it appears on, so a fallback
+    still resembles the user's picks; without usable seeds it returns
+    the overall ranking.
+
+    The app serves the tables of the published build
+    (`python -m recommenders.pipeline`) when they match the CSVs.
+
+    Usage (rebuild the tables after the data changes):
+
+        python -m recommenders.popularity
+
+"""
+
+# Script dependencies
+import argparse
+import os
+import time
+import numpy as np
+from recommenders.artifacts import load_published, served_path, TABLES_NAME
+from recommenders.topn import merge_top_n
+from utils.catalogue import get_catalogue, NO_GENRES, TITLE_YEAR
+from utils.data_store import file_digest, load_movies, MOVIES_PATH
+from utils.ingest import rating_aggregates, RATINGS_PATH
+from utils.lazy import resource
+from utils.tracing import count, traced
+
+TABLES_PATH = 'resources/models/popularity.npz'
+TABLES_VERSION = 1
+TOP_K = 200
+
+
+def _top_lists(labels, rows, scores, n_labels, top_k):
+    """Best `top_k` rows of each label, as CSR-style (indptr, rows)."""
+    order = np.lexsort((rows, -scores[rows], labels))
+    labels, rows = labels[order], rows[order]
+    counts = np.bincount(labels, minlength=n_labels)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.arange(len(rows)) - np.repeat(starts, counts)
+    indptr = np.concatenate([[0], np.cumsum(np.minimum(counts, top_k))])
+    return indptr.astype(np.int64), rows[rank < top_k].astype(np.int32)
+
+
+def build_tables(movies, aggregates, top_k=TOP_K):
+    """Build the popularity tables of a catalogue.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movie records with `movieId`, `title` and `genres` columns.
+    aggregates : dict
+        Rating statistics as returned by `utils.ingest.rating_aggregates`.
+    top_k : int
+        Length of the per-genre and per-decade lists.
+
+    Returns
+    -------
+    dict
+        Per catalogue row: `counts`, `bayes` (Bayesian average),
+        `row_genres_indptr` / `row_genres` and `row_decade`; the `ranking`
+        of rated rows; `genres` and `decades` with their top lists
+        (`genre_indptr` / `genre_rows`, `decade_indptr` / `decade_rows`).
+
+    """
+    movie_ids = movies['movieId'].to_numpy(dtype=np.int64)
+    in_range = movie_ids < len(aggregates['item_counts'])
+    counts = np.zeros(len(movies), dtype=np.int64)
+    sums = np.zeros(len(movies), dtype=np.float64)
+    counts[in_range] = aggregates['item_counts'][movie_ids[in_range]]
+    sums[in_range] = aggregates['item_sums'][movie_ids[in_range]]
+    rated = np.flatnonzero(counts)
+    prior = counts[rated].mean() if len(rated) else 0.0
+    mean = aggregates['global_mean']
+    bayes = ((prior * mean + sums) / np.maximum(prior + counts, 1e-12)
+             ).astype(np.float32)
+    ranking = rated[np.lexsort((rated, -bayes[rated]))].astype(np.int32)
+
+    # Genres of each row
+    genre_lists = [[g for g in value.split('|') if g and g != NO_GENRES]
+                   for value in movies['genres'].fillna('').tolist()]
+    genres = np.array(sorted({g for gs in genre_lists for g in gs}), dtype=str)
+    genre_code = {g: i for i, g in enumerate(genres)}
+    row_genres = np.array([genre_code[g] for gs in genre_lists for g in gs],
+                          dtype=np.int32)
+    row_genres_indptr = np.concatenate(
+        [[0], np.cumsum([len(gs) for gs in genre_lists])]).astype(np.int64)
+    # Release decade of each row, from the year at the end of its title
+    years = movies['title'].fillna('').str.extract(TITLE_YEAR, expand=False)
+    decade_of_row = (years.astype(float) // 10 * 10).to_numpy()
+    decades = np.unique(decade_of_row[~np.isnan(decade_of_row)]).astype(np.int32)
+    row_decade = np.full(len(movies), -1, dtype=np.int32)
+    dated = ~np.isnan(decade_of_row)
+    row_decade[dated] = np.searchsorted(decades, decade_of_row[dated])
+
+    # Top lists, over rated movies only
+    genre_rows_all = np.repeat(np.arange(len(movies)), np.diff(row_genres_indptr))
+    rated_genre = counts[genre_rows_all] > 0
+    genre_indptr, genre_rows = _top_lists(
+        row_genres[rated_genre], genre_rows_all[rated_genre], bayes,
+        len(genres), top_k)
+    rated_dated = np.flatnonzero((counts > 0) & (row_decade >= 0))
+    decade_indptr, decade_rows = _top_lists(
+        row_decade[rated_dated], rated_dated, bayes, len(decades), top_k)
+    return {
+        'counts': counts, 'bayes': bayes, 'ranking': ranking,
+        'row_genres_indptr': row_genres_indptr, 'row_genres': row_genres,
+        'row_decade': row_decade,
+        'genres': genres, 'genre_indptr': genre_indptr,
+        'genre_rows': genre_rows,
+        'decades': decades, 'decade_indptr': decade_indptr,
+        'decade_rows': decade_rows,
+    }
+
+
+def save_tables(path, tables, source_digest):
+    """Persist popularity tables as a compressed `.npz`, atomically."""
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(tmp_path, version=np.int32(TABLES_VERSION),
+                        source_digest=np.array(source_digest), **tables)
+    os.replace(tmp_path, path)
+
+
+def _digest(movies_path, ratings_path):
+    return file_digest(movies_path) + ':' + file_digest(ratings_path)
+
+
+def load_tables(path=TABLES_PATH, movies_path=None, ratings_path=None):
+    """Load persisted popularity tables.
+
+    Parameters
+    ----------
+    path : str
+        Path to the `.npz` tables.
+    movies_path, ratings_path : str, optional
+        If both are given, tables built from other versions of these
+        files are rejected.
+
+    Raises
+    ------
+    FileNotFoundError
+        If no tables exist at `path`.
+    ValueError
+        If the tables are from an incompatible version or are stale.
+
+    """
+    with np.load(path) as data:
+        if int(data['version']) != TABLES_VERSION:
+            raise ValueError(f"Unsupported popularity tables version in {path}")
+        if movies_path is not None and ratings_path is not None and \
+                str(data['source_digest']) != _digest(movies_path, ratings_path):
+            raise ValueError(f"Popularity tables {path} are stale")
+        return {name: data[name] for name in data.files
+                if name not in ('version', 'source_digest')}
+
+
+def build_from_csv(movies_path=MOVIES_PATH, ratings_path=RATINGS_PATH,
+                   output_path=TABLES_PATH):
+    """Build the tables of a movie and a rating file and save them."""
+    tables = build_tables(load_movies(movies_path),
+                          rating_aggregates(ratings_path))
+    save_tables(output_path, tables, _digest(movies_path, ratings_path))
+    return tables
+
+
+def load_or_build(movies_path=MOVIES_PATH, ratings_path=RATINGS_PATH,
+                  tables_path=TABLES_PATH):
+    """Load the popularity tables, rebuilding them if missing or stale."""
+    try:
+        return load_tables(tables_path, movies_path, ratings_path)
+    except (FileNotFoundError, ValueError, KeyError):
+        return build_from_csv(movies_path, ratings_path, tables_path)
+
+
+def load_served(movies_path=MOVIES_PATH, ratings_path=RATINGS_PATH,
+                tables_path=TABLES_PATH):
+    """Published popularity tables of the CSVs, else the local ones."""
+    return load_published(
+        TABLES_NAME,
+        lambda path: load_tables(path, movies_path, ratings_path),
+        lambda: load_or_build(movies_path, ratings_path, tables_path))
+
+
+def served_tables_path(tables_path=TABLES_PATH):
+    """Path of the tables `load_served` prefers."""
+    return served_path(TABLES_NAME, tables_path)
+
+
+@resource
+@traced('popularity.load_tables')
+def popularity_tables():
+    # Built offline by `python -m recommenders.pipeline` (or
+    # `python -m recommenders.popularity`)
+    return load_served()
+
+
+def seed_lists(rows, tables):
+    """Genre and decade top lists of some catalogue rows.
+
+    Parameters
+    ----------
+    rows : list (int)
+        Catalogue rows of the seeds.
+    tables : dict
+        Popularity tables.
+
+    Returns
+    -------
+    list of numpy.ndarray
+        Rows of each distinct genre and decade list of the seeds, best
+        first.
+
+    """
+    genre_indptr, decade_indptr = tables['genre_indptr'], tables['decade_indptr']
+    genres, decades = set(), set()
+    for row in rows:
+        start, end = tables['row_genres_indptr'][row:row + 2]
+        genres.update(tables['row_genres'][start:end].tolist())
+        if tables['row_decade'][row] >= 0:
+            decades.add(int(tables['row_decade'][row]))
+    lists = [tables['genre_rows'][genre_indptr[g]:genre_indptr[g + 1]]
+             for g in sorted(genres)]
+    lists += [tables['decade_rows'][decade_indptr[d]:decade_indptr[d + 1]]
+              for d in sorted(decades)]
+    return lists
+
+
+def fallback_rows(seed_rows=(), n=10, exclude=()):
+    """Popular movies resembling the chosen ones.
+
+    Parameters
+    ----------
+    seed_rows : list (int)
+        Catalogue rows of the chosen movies; may be empty.
+    n : int
+        Number of rows to return.
+    exclude : list (int)
+        Rows that must not be returned (the seeds are always excluded).
+
+    Returns
+    -------
+    numpy.ndarray
+        Catalogue rows: the best of the seeds' genre and decade lists,
+        then the best overall.
+
+    """
+    count('popularity.fallbacks')
+    tables = popularity_tables()
+    exclude = np.union1d(np.asarray(seed_rows, dtype=np.int64),
+                         np.asarray(exclude, dtype=np.int64))
+    lists = [(rows, tables['bayes'][rows])
+             for rows in seed_lists(seed_rows, tables)]
+    # Movies on several of the lists (e.g. a seed's genre and its decade)
+    # come first, then by Bayesian average
+    top, _ = merge_top_n(lists, n, fusion='sum', exclude=exclude)
+    if len(top) < n:
+        # Not enough similar movies: topping up with the overall ranking
+        overall = tables['ranking'][:n + len(exclude) + len(top)]
+        overall = overall[~np.isin(overall, np.union1d(exclude, top))]
+        top = np.concatenate([top, overall[:n - len(top)]])
+    return top.astype(np.int64)
+
+
+def top_up(rows, seed_rows, n):
+    """Complete a ranking shorter than `n` with `fallback_rows`.
+
+    Parameters
+    ----------
+    rows : array-like of int
+        Catalogue rows ranked by a recommender.
+    seed_rows : list (int)
+        Catalogue rows of the chosen movies.
+    n : int
+        Number of rows wanted.
+
+    Returns
+    -------
+    numpy.ndarray
+        `rows`, followed by popular movies resembling the seeds.
+
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    if len(rows) >= n:
+        return rows
+    return np.concatenate([rows, fallback_rows(seed_rows, n - len(rows),
+                                               exclude=rows)])
+
+
+def popular_titles(top_n=10, movie_list=()):
+    """Titles of popular movies resembling a list of chosen titles.
+
+    Titles missing from the catalogue are ignored.
+
+    Parameters
+    ----------
+    top_n : int
+        Number of titles to return.
+    movie_list : list (str)
+        Titles chosen by the app user.
+
+    Returns
+    -------
+    list (str)
+        Recommended titles, best first.
+
+    """
+    catalogue = get_catalogue()
+    rows = [catalogue['title_rows'][title] for title in movie_list
+            if title in catalogue['title_rows']]
+    return catalogue['titles'][fallback_rows(rows, top_n)].tolist()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build the popularity fallback tables.')
+    parser.add_argument('--movies', default=MOVIES_PATH)
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    parser.add_argument('--output', default=TABLES_PATH)
+    args = parser.parse_args()
+    start = time.time()
+    built = build_from_csv(args.movies, args.ratings, args.output)
+    print(f"Built popularity tables of {len(built['ranking'])} rated movies, "
+          f"{len(built['genres'])} genres and {len(built['decades'])} decades "
+          f"in {time.time() - start:.1f}s. Saved to: {args.output}")
@@ -0,0 +1,185 @@
+"""
+
+    Recommendation service shared by all app sessions.
+
+    Author: Explore Data Science Academy.
+
+    Description: Streamlit runs each session's script in its own thread,
+    so a slow recommendation computed inline keeps that session waiting
+    and competes with every other session for the same data. Pages
+    instead submit their requests to one `RecommendationService` per
+    process:
+
+      - requests run on a bounded pool of worker threads. Threads (not
+        processes) share the lazily loaded models and data of the
+        process; the heavy numpy/scipy kernels release the GIL;
+      - identical requests in flight (same model, same set of titles,
+        same `top_n`) are coalesced: later callers wait on the first
+        caller's computation instead of starting their own;
+      - every request has a deadline. When it passes, the caller gets
+        popular movies resembling its picks instead
+        (`recommenders.popularity`; `fallback` is set in the response)
+        and the computation carries on in the background, so its result
+        still lands in the recommendation cache for the next request.
+
+    Recommenders are registered by name as `(movie_list, top_n)`
+    functions. The pool size and default deadline can be set with the
+    `RECOMMENDER_WORKERS` and `RECOMMENDER_TIMEOUT` (seconds)
+    environment variables.
+
+"""
+
+# Script dependencies
+import collections
+import concurrent.futures
+import os
+import threading
+import time
+from recommenders.popularity import popular_titles
+from utils.cache import make_key
+from utils import tracing
+
+DEFAULT_WORKERS = int(os.environ.get('RECOMMENDER_WORKERS',
+                                     min(4, os.cpu_count() or 1)))
+DEFAULT_TIMEOUT = float(os.environ.get('RECOMMENDER_TIMEOUT', 10))
+
+
+class RecommendationService:
+    """Thread pool running recommendation requests with coalescing and
+    deadlines.
+
+    Parameters
+    ----------
+    workers : int
+        Number of worker threads.
+    timeout : float
+        Default deadline of a request, in seconds from its submission.
+    fallback : callable
+        `(top_n, movie_list)` function returning the titles served when
+        a deadline passes.
+    warm : iterable of callable
+        Zero-argument functions run on the pool at start, e.g. to load
+        the fallback data before it is needed.
+
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT,
+                 fallback=popular_titles, warm=()):
+        self.timeout = timeout
+        self.fallback = fallback
+        self._models = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='recommender')
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._stats = collections.Counter()
+        for func in warm:
+            self._executor.submit(func)
+
+    def register(self, name, func):
+        """Make a `(movie_list, top_n)` recommender available as `name`."""
+        self._models[name] = func
+
+    def _run(self, name, movie_list, top_n, profile, memory):
+        # Stages recorded on this worker thread are grouped as one request
+        with tracing.request(name, profile=profile, memory=memory):
+            return self._models[name](movie_list, top_n)
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+            self._stats['failed' if future.exception() else 'completed'] += 1
+
+    def submit(self, name, movie_list, top_n=10, profile=False, memory=False):
+        """Start a request, or join the identical one already in flight.
+
+        Parameters
+        ----------
+        name : str
+            Registered recommender.
+        movie_list : list (str)
+            Chosen titles; their order does not matter.
+        top_n : int
+            Number of recommendations.
+        profile, memory : bool
+            Tracing options of the request (see `utils.tracing.request`).
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future of the recommended titles.
+
+        Raises
+        ------
+        KeyError
+            If no recommender is registered as `name`.
+
+        """
+        if name not in self._models:
+            raise KeyError(f"Unknown recommender: {name}")
+        key = make_key(name, movie_list, top_n, '')
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._stats['coalesced'] += 1
+                tracing.count('service.coalesced')
+                return future
+            future = self._executor.submit(self._run, name, list(movie_list),
+                                           top_n, profile, memory)
+            self._in_flight[key] = future
+            self._stats['submitted'] += 1
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def recommend(self, name, movie_list, top_n=10, timeout=None,
+                  profile=False, memory=False):
+        """Recommend movies, falling back to popular ones past the deadline.
+
+        Parameters
+        ----------
+        name : str
+            Registered recommender.
+        movie_list : list (str)
+            Chosen titles.
+        top_n : int
+            Number of recommendations.
+        timeout : float, optional
+            Deadline in seconds; the service default if None.
+        profile, memory : bool
+            Tracing options of the request.
+
+        Returns
+        -------
+        dict
+            Recommended `titles`, whether they are the `fallback`, and
+            the `seconds` the caller waited.
+
+        Raises
+        ------
+        Exception
+            Any error raised by the recommender before the deadline.
+
+        """
+        start = time.perf_counter()
+        future = self.submit(name, movie_list, top_n, profile, memory)
+        try:
+            titles = future.result(self.timeout if timeout is None else timeout)
+            fallback = False
+        except concurrent.futures.TimeoutError:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            tracing.count('service.timeouts')
+            titles = self.fallback(top_n, movie_list)
+            fallback = True
+        return {'titles': list(titles), 'fallback': fallback,
+                'seconds': time.perf_counter() - start}
+
+    def stats(self):
+        """Request counters and the number of requests in flight."""
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._in_flight))
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads once the queued requests are done."""
+        self._executor.shutdown(wait=wait)
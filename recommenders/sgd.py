@@ -0,0 +1,59 @@
+"""
+
+    SGD update rule of the biased SVD model.
+
+    Author: Explore Data Science Academy.
+
+    Description: The mini-batch SGD epoch shared by the offline trainer
+    (`resources/models/train_colbased.py`) and the online updater
+    (`recommenders.online`), so a model folded in online follows the
+    same update rules as the one it was trained from (those of
+    `surprise.SVD`):
+
+        err = r - (mean + bu + bi + pu . qi)
+        bu += lr * (err - reg * bu)
+        bi += lr * (err - reg * bi)
+        pu += lr * (err * qi - reg * pu)
+        qi += lr * (err * pu - reg * qi)
+
+"""
+
+# Script dependencies
+import numpy as np
+
+BATCH_SIZE = 1024
+# Standard deviation of the initial factors of new users and items
+INIT_STD = 0.05
+
+
+def sgd_epoch(params, users, items, values, global_mean, lr, reg, rng):
+    """One epoch of mini-batch SGD over shuffled ratings.
+
+    Parameters
+    ----------
+    params : dict
+        `pu`, `qi`, `bu` and `bi` arrays, updated in place.
+    users, items : numpy.ndarray
+        Inner user and item ids of the ratings.
+    values : numpy.ndarray
+        Rating values.
+    global_mean : float
+        Mean rating of the training data.
+    lr, reg : float
+        Learning rate and regularisation.
+    rng : numpy.random.Generator
+        Random generator of the shuffling.
+
+    """
+    pu, qi, bu, bi = params['pu'], params['qi'], params['bu'], params['bi']
+    order = rng.permutation(len(values))
+    for start in range(0, len(order), BATCH_SIZE):
+        batch = order[start:start + BATCH_SIZE]
+        u, i = users[batch], items[batch]
+        p, q = pu[u], qi[i]
+        err = values[batch] - (global_mean + bu[u] + bi[i]
+                               + np.einsum('ij,ij->i', p, q))
+        np.add.at(bu, u, lr * (err - reg * bu[u]))
+        np.add.at(bi, i, lr * (err - reg * bi[i]))
+        np.add.at(pu, u, lr * (err[:, None] * q - reg * p))
+        np.add.at(qi, i, lr * (err[:, None] * p - reg * q))
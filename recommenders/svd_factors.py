@@ -0,0 +1,333 @@
+"""
+
+    Vectorised scoring with the latent factors of a trained SVD model.
+
+    Author: Explore Data Science Academy.
+
+    Description: Helpers to pull the factor matrices out of a trained
+    `surprise` SVD model once, and to score every user against a set of
+    items with a single matrix product instead of one `model.predict`
+    call per (user, item) pair.
+
+    Factors are served from a compact artifact instead of the pickled
+    `surprise` model (which also carries its whole trainset): a directory
+    holding one raw file per array (float32 factors and biases, raw user
+    and item ids in inner-id order) and a `manifest.json` of their
+    dtypes and shapes. Loading memory-maps the files read-only, so
+    startup does not read the factors, and every app process on a host
+    shares the same pages through the OS cache instead of holding its
+    own copy. `benchmarks/bench_model_load.py` measures startup time and
+    per-process memory of each format.
+
+    The single-file `.npz` artifact of earlier versions can still be
+    read and written (paths ending in `.npz`).
+
+    Usage (export a pickled model or an `.npz` artifact):
+
+        python -m recommenders.svd_factors --input resources/models/SVD.pkl \
+            --output resources/models/svd_factors
+
+"""
+
+# Script dependencies
+import argparse
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+import numpy as np
+import pandas as pd
+from recommenders.topn import top_n_rows
+
+FACTORS_PATH = 'resources/models/svd_factors'
+MANIFEST_NAME = 'manifest.json'
+FORMAT_VERSION = 2
+NPZ_FORMAT_VERSION = 1
+_ARRAYS = ('pu', 'qi', 'bu', 'bi', 'user_ids', 'item_ids')
+
+
+def make_factors(pu, qi, bu, bi, global_mean, rating_scale, user_ids,
+                 item_ids):
+    """Assemble a factors dict from its arrays.
+
+    Parameters
+    ----------
+    pu, qi : numpy.ndarray
+        User and item factor matrices, rows in inner-id order.
+    bu, bi : numpy.ndarray
+        User and item biases.
+    global_mean : float
+        Mean rating of the training data.
+    rating_scale : tuple (float, float)
+        Lowest and highest possible rating.
+    user_ids, item_ids : numpy.ndarray
+        Raw ids of the users and items, in inner-id order.
+
+    Returns
+    -------
+    dict
+        Factors in the layout returned by `extract_factors`.
+
+    """
+    user_ids = np.asarray(user_ids)
+    item_ids = np.asarray(item_ids)
+    return {
+        'pu': np.ascontiguousarray(pu, dtype=np.float32),
+        'qi': np.ascontiguousarray(qi, dtype=np.float32),
+        'bu': np.asarray(bu, dtype=np.float32),
+        'bi': np.asarray(bi, dtype=np.float32),
+        'global_mean': float(global_mean),
+        'rating_scale': tuple(float(r) for r in rating_scale),
+        'user_ids': user_ids,
+        'item_ids': item_ids,
+        'user_index': pd.Index(user_ids),
+        'item_index': pd.Index(item_ids),
+    }
+
+
+def extract_factors(model):
+    """Extract the latent factors and biases of a trained SVD model.
+
+    Parameters
+    ----------
+    model : surprise.SVD
+        Fitted SVD model (with its trainset attached).
+
+    Returns
+    -------
+    dict
+        `pu`, `qi` (float32 factor matrices), `bu`, `bi` (float32 biases),
+        `global_mean`, `rating_scale`, and the raw ids of the users and
+        items in inner-id order (`user_ids`, `item_ids`) with `pd.Index`
+        lookups from raw id to inner id (`user_index`, `item_index`).
+
+    """
+    trainset = model.trainset
+    user_ids = np.array([trainset.to_raw_uid(u) for u in trainset.all_users()])
+    item_ids = np.array([trainset.to_raw_iid(i) for i in trainset.all_items()])
+    return make_factors(model.pu, model.qi, model.bu, model.bi,
+                        trainset.global_mean, trainset.rating_scale,
+                        user_ids, item_ids)
+
+
+def save_factors(factors, path=FACTORS_PATH, metadata=None):
+    """Write factors to a compact versioned artifact.
+
+    Parameters
+    ----------
+    factors : dict
+        Factors as returned by `make_factors` / `extract_factors`.
+    path : str
+        Output directory, or a file if it ends in `.npz`; replaced as a
+        whole once fully written.
+    metadata : dict, optional
+        JSON-serialisable training details (hyper-parameters, RMSE...).
+
+    Raises
+    ------
+    ValueError
+        If the raw ids are not numeric.
+
+    """
+    if path.endswith('.npz'):
+        return _save_npz(factors, path, metadata)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_dir = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+    os.makedirs(tmp_dir)
+    files = {}
+    for name in _ARRAYS:
+        array = np.ascontiguousarray(factors[name])
+        if array.dtype.kind not in 'iuf':
+            raise ValueError(f"Cannot store {name} of dtype {array.dtype}")
+        array.tofile(os.path.join(tmp_dir, name + '.bin'))
+        files[name] = {'dtype': array.dtype.str, 'shape': list(array.shape)}
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), 'w') as f:
+        json.dump({
+            'format_version': FORMAT_VERSION,
+            'global_mean': float(factors['global_mean']),
+            'rating_scale': [float(r) for r in factors['rating_scale']],
+            'files': files,
+            'metadata': metadata or {},
+        }, f, indent=2)
+    old_dir = f'{path}.old-{os.getpid()}-{threading.get_ident()}'
+    if os.path.exists(path):
+        os.replace(path, old_dir)
+    os.replace(tmp_dir, path)
+    # Processes still mapping the old files keep them until they exit
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def _save_npz(factors, path, metadata):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path,
+             format_version=np.int32(NPZ_FORMAT_VERSION),
+             pu=factors['pu'], qi=factors['qi'],
+             bu=factors['bu'], bi=factors['bi'],
+             global_mean=np.float64(factors['global_mean']),
+             rating_scale=np.array(factors['rating_scale'], dtype=np.float32),
+             user_ids=factors['user_ids'], item_ids=factors['item_ids'],
+             metadata=np.array(json.dumps(metadata or {})))
+    os.replace(tmp_path, path)
+
+
+def _map_array(path, dtype, shape, mmap):
+    """Read-only memory map of a raw array file (a copy if not `mmap`)."""
+    if not mmap or int(np.prod(shape)) == 0:
+        # mmap cannot map an empty file
+        return np.fromfile(path, dtype=dtype).reshape(shape)
+    return np.memmap(path, dtype=dtype, mode='r', shape=tuple(shape))
+
+
+def load_factors(path=FACTORS_PATH, mmap=True):
+    """Load factors saved by `save_factors`.
+
+    Parameters
+    ----------
+    path : str
+        Artifact directory, or an `.npz` file.
+    mmap : bool
+        Memory-map the arrays of a directory artifact rather than reading
+        them into process memory.
+
+    Returns
+    -------
+    dict
+        Factors in the layout returned by `extract_factors`, plus the
+        training `metadata`.
+
+    Raises
+    ------
+    ValueError
+        If the artifact was written in an unsupported format version.
+
+    """
+    if not os.path.isdir(path):
+        return _load_npz(path)
+    with open(os.path.join(path, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported factors format in {path}")
+    arrays = {name: _map_array(os.path.join(path, name + '.bin'),
+                               np.dtype(spec['dtype']), spec['shape'], mmap)
+              for name, spec in manifest['files'].items()}
+    factors = make_factors(arrays['pu'], arrays['qi'], arrays['bu'],
+                           arrays['bi'], manifest['global_mean'],
+                           manifest['rating_scale'], arrays['user_ids'],
+                           arrays['item_ids'])
+    factors['metadata'] = manifest['metadata']
+    return factors
+
+
+def _load_npz(path):
+    with np.load(path) as data:
+        if int(data['format_version']) != NPZ_FORMAT_VERSION:
+            raise ValueError(f"Unsupported factors format in {path}")
+        factors = make_factors(data['pu'], data['qi'], data['bu'], data['bi'],
+                               data['global_mean'], data['rating_scale'],
+                               data['user_ids'], data['item_ids'])
+        factors['metadata'] = json.loads(str(data['metadata']))
+    return factors
+
+
+def version_file(path):
+    """File whose stat changes whenever the artifact at `path` is replaced."""
+    return os.path.join(path, MANIFEST_NAME) if os.path.isdir(path) else path
+
+
+def export(input_path, output_path=FACTORS_PATH):
+    """Convert a pickled `surprise` model or an `.npz` artifact.
+
+    Parameters
+    ----------
+    input_path : str
+        Pickled SVD model (e.g. `resources/models/SVD.pkl`) or factors
+        artifact.
+    output_path : str
+        Artifact to write.
+
+    Returns
+    -------
+    dict
+        The exported factors.
+
+    """
+    if input_path.endswith('.npz') or os.path.isdir(input_path):
+        factors = load_factors(input_path, mmap=False)
+        metadata = factors['metadata']
+    else:
+        with open(input_path, 'rb') as f:
+            factors = extract_factors(pickle.load(f))
+        metadata = {'source': os.path.basename(input_path)}
+    save_factors(factors, output_path, metadata)
+    return factors
+
+
+def score_items(factors, item_ids):
+    """Predict the rating of every user for each of the given items.
+
+    Mirrors `surprise.SVD.estimate`: items unknown to the model
+    contribute no bias or factor term, so their scores reduce to the
+    global mean plus the user bias. Scores are not clipped to the rating
+    scale, which keeps the ranking of users free of artificial ties.
+
+    Parameters
+    ----------
+    factors : dict
+        Factors as returned by `extract_factors`.
+    item_ids : list
+        Raw (MovieLens) item ids to score.
+
+    Returns
+    -------
+    numpy.ndarray
+        float32 matrix of shape (len(item_ids), n_users).
+
+    """
+    inner = factors['item_index'].get_indexer(list(item_ids))
+    known = inner >= 0
+    qi = np.zeros((len(inner), factors['qi'].shape[1]), dtype=np.float32)
+    bi = np.zeros(len(inner), dtype=np.float32)
+    qi[known] = factors['qi'][inner[known]]
+    bi[known] = factors['bi'][inner[known]]
+    scores = qi @ factors['pu'].T
+    scores += factors['bu'][None, :]
+    scores += (bi + factors['global_mean'])[:, None]
+    return scores
+
+
+def top_users(factors, item_ids, n=10):
+    """Find the users with the highest predicted rating for each item.
+
+    Parameters
+    ----------
+    factors : dict
+        Factors as returned by `extract_factors`.
+    item_ids : list
+        Raw item ids to score.
+    n : int
+        Number of users to return per item.
+
+    Returns
+    -------
+    numpy.ndarray
+        Raw user ids, shape (len(item_ids), n), best first.
+
+    """
+    top, _ = top_n_rows(score_items(factors, item_ids), n)
+    return factors['user_ids'][top]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export SVD factors to the memory-mappable artifact.')
+    parser.add_argument('--input', default='resources/models/SVD.pkl')
+    parser.add_argument('--output', default=FACTORS_PATH)
+    args = parser.parse_args()
+    start = time.time()
+    factors = export(args.input, args.output)
+    print(f"Exported {len(factors['user_ids'])} users and "
+          f"{len(factors['item_ids'])} items in {time.time() - start:.1f}s. "
+          f"Saved to: {args.output}")
@@ -0,0 +1,198 @@
+"""
+
+    Top-N selection and fusion of per-seed scores.
+
+    Author: Explore Data Science Academy.
+
+    Description: Every recommender ends the same way: one score vector
+    (or neighbour list) per chosen movie is fused into a single ranking,
+    the chosen movies are removed and the best N items are kept. This
+    module does that without sorting or concatenating full-length
+    vectors:
+
+      - `top_n` / `top_n_rows`: partial selection with `argpartition`
+        (O(N)), then a sort of the N selected items only;
+      - `fuse`: `'sum'`, `'max'` or `'weighted'` fusion of dense score
+        vectors, one per seed;
+      - `merge_top_n`: fusion of sparse (ids, scores) neighbour lists.
+        With `'max'` fusion the lists are merged lazily with a k-way
+        heap that stops once N distinct items are found: long lists
+        (e.g. a seed's similarity to the whole catalogue) are first cut
+        to their best N + len(exclude) entries with a partition, only
+        those are sorted, and O(N) items are popped instead of sorting
+        every candidate.
+
+    Rankings are deterministic: equal scores are ordered by ascending
+    item id (or position).
+
+"""
+
+# Script dependencies
+import heapq
+import numpy as np
+
+FUSIONS = ('sum', 'max', 'weighted')
+
+
+def top_n(scores, n, exclude=None):
+    """Positions of the `n` largest finite scores, best first.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray
+        1-d scores. `-inf` and NaN entries are never selected.
+    n : int
+        Number of positions to return (fewer if not enough are finite).
+    exclude : array-like of int, optional
+        Positions that must not be selected.
+
+    Returns
+    -------
+    numpy.ndarray
+        Selected positions, by descending score then ascending position.
+
+    """
+    scores = np.asarray(scores)
+    if exclude is not None and len(exclude):
+        scores = scores.copy()
+        scores[np.asarray(exclude)] = -np.inf
+    finite = np.isfinite(scores)
+    n = min(n, int(finite.sum()))
+    if n <= 0:
+        return np.zeros(0, dtype=np.intp)
+    # Non-finite scores rank last
+    keyed = np.where(finite, scores, -np.inf)
+    top = np.argpartition(-keyed, n - 1)[:n]
+    # Ties at the partition boundary are resolved towards lower positions
+    threshold = keyed[top].min()
+    top = np.union1d(top[keyed[top] > threshold],
+                     np.flatnonzero(keyed == threshold))
+    top = top[np.lexsort((top, -keyed[top]))]
+    return top[:n]
+
+
+def top_n_rows(scores, n):
+    """Columns and values of the `n` largest scores of each row.
+
+    Vectorised over the rows of a (batch, items) matrix; equal scores
+    are ordered by ascending column, but which of several items tied at
+    the cut-off is kept is unspecified.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        (batch, n) columns and values, best first.
+
+    """
+    n = min(n, scores.shape[1])
+    if n <= 0:
+        empty = np.zeros((scores.shape[0], 0), dtype=np.intp)
+        return empty, np.take_along_axis(scores, empty, axis=1)
+    top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    values = np.take_along_axis(scores, top, axis=1)
+    order = np.lexsort((top, -values), axis=-1)
+    return (np.take_along_axis(top, order, axis=1),
+            np.take_along_axis(values, order, axis=1))
+
+
+def fuse(vectors, fusion='sum', weights=None):
+    """Fuse one dense score vector per seed into a single vector.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        (n_seeds, n_items) scores.
+    fusion : str
+        `'sum'`, `'max'` or `'weighted'` (weighted sum).
+    weights : array-like, optional
+        Weight of each seed, required by `'weighted'`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Fused scores of shape (n_items,).
+
+    """
+    if fusion == 'sum':
+        return vectors.sum(axis=0)
+    if fusion == 'max':
+        return vectors.max(axis=0)
+    if fusion == 'weighted':
+        return np.asarray(weights) @ vectors
+    raise ValueError(f"Unknown fusion: {fusion}")
+
+
+def _heap_merge(lists, n, exclude):
+    """Best-first merge of neighbour lists, keeping each item's best score."""
+    if n <= 0:
+        return [], []
+    runs = []
+    # An item beyond the first `depth` entries of a list is outranked in
+    # that list alone by n items that are not excluded
+    depth = n + len(exclude)
+    for ids, scores in lists:
+        ids, scores = np.asarray(ids), np.asarray(scores)
+        keep = np.isfinite(scores)
+        if keep.sum() > depth:
+            # Keeping ties at the cut-off, which are then ordered by id
+            keep &= scores >= -np.partition(-scores[keep], depth - 1)[depth - 1]
+        ids, scores = ids[keep], scores[keep]
+        # Each run is sorted like the merged output: best score, then id
+        order = np.lexsort((ids, -scores))
+        runs.append(zip((-scores[order]).tolist(), ids[order].tolist()))
+    seen = set(exclude)
+    top_ids, top_scores = [], []
+    for neg_score, item in heapq.merge(*runs):
+        if item in seen:
+            continue
+        seen.add(item)
+        top_ids.append(item)
+        top_scores.append(-neg_score)
+        if len(top_ids) == n:
+            break
+    return top_ids, top_scores
+
+
+def merge_top_n(lists, n, fusion='max', weights=None, exclude=()):
+    """Fuse sparse per-seed neighbour lists and keep the best `n` items.
+
+    Parameters
+    ----------
+    lists : iterable of tuple (array-like, array-like)
+        (item ids, scores) of each seed's neighbours.
+    n : int
+        Number of items to return.
+    fusion : str
+        `'max'` (best score of an item over the seeds), `'sum'` or
+        `'weighted'` (weighted sum of its scores; missing entries count
+        as 0).
+    weights : array-like, optional
+        Weight of each list, required by `'weighted'`.
+    exclude : iterable of int
+        Items that must not be returned, e.g. the seeds themselves.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        Item ids and fused scores, by descending score then ascending id.
+
+    """
+    lists = list(lists)
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    if fusion == 'max':
+        ids, scores = _heap_merge(lists, n, np.asarray(exclude).tolist())
+        return np.asarray(ids, dtype=np.int64), np.asarray(scores)
+    if fusion == 'sum':
+        weights = np.ones(len(lists))
+    elif fusion != 'weighted':
+        raise ValueError(f"Unknown fusion: {fusion}")
+    if not lists:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    ids = np.concatenate([np.asarray(i) for i, _ in lists])
+    scores = np.concatenate([np.asarray(s, dtype=np.float64) * w
+                             for (_, s), w in zip(lists, weights)])
+    items, inverse = np.unique(ids, return_inverse=True)
+    fused = np.bincount(inverse, weights=scores, minlength=len(items))
+    top = top_n(fused, n, exclude=np.flatnonzero(np.isin(items, exclude)))
+    return items[top].astype(np.int64), fused[top]
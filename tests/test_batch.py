@@ -0,0 +1,49 @@
+"""
+
+    Tests of the batch collaborative scoring.
+
+    Author: Explore Data Science Academy.
+
+    Run from the repository root with `python -m pytest`.
+
+"""
+
+import numpy as np
+from recommenders import batch
+from recommenders.ann import normalize_rows
+from recommenders.popularity import fallback_rows
+from utils.catalogue import get_catalogue
+
+
+def _score(inputs, top_n, unit_qi, movie_ids):
+    batch._arrays.update({
+        'unit_qi': normalize_rows(unit_qi),
+        'item_ids': np.arange(100, 100 + len(unit_qi)),
+        'in_catalogue': np.ones(len(unit_qi), dtype=bool),
+        'movie_ids': movie_ids,
+    })
+    try:
+        return batch._score_collab((np.asarray(inputs), top_n))
+    finally:
+        batch._arrays.clear()
+
+
+def test_unknown_seeds_do_not_exclude_the_last_item():
+    # Item 3 (the last one) is the closest to the only known seed
+    unit_qi = np.array([[1, 0], [0, 1], [-1, 0], [1, 0.1]], dtype=np.float32)
+    movie_ids, scores = _score([[0, -1, 7, -1]], 2, unit_qi,
+                               get_catalogue()['movie_ids'])
+    assert movie_ids[0].tolist() == [103, 101]
+    assert np.isfinite(scores).all()
+
+
+def test_seeds_without_factors_get_the_popularity_fallback():
+    catalogue = get_catalogue()
+    unit_qi = np.eye(3, dtype=np.float32)
+    movie_ids, scores = _score([[-1, -1, 5, 9], [-1, -1, -1, -1]], 5, unit_qi,
+                               catalogue['movie_ids'])
+    assert movie_ids[0].tolist() == \
+        catalogue['movie_ids'][fallback_rows([5, 9], 5)].tolist()
+    assert movie_ids[1].tolist() == \
+        catalogue['movie_ids'][fallback_rows([], 5)].tolist()
+    assert (scores == 0).all()
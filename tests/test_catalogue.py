@@ -0,0 +1,35 @@
+"""
+
+    Tests of the catalogue title search.
+
+    Author: Explore Data Science Academy.
+
+    Run from the repository root with `python -m pytest`.
+
+"""
+
+import pandas as pd
+from utils.catalogue import build_catalogue, search_titles
+
+MOVIES = pd.DataFrame({
+    'movieId': [1, 2, 3, 4, 5],
+    'title': ['Matrix, The (1999)', 'Toy Story (1995)', 'Matilda (1996)',
+              'Matrix Reloaded, The (2003)', 'Mad Max (1979)'],
+})
+
+
+def test_typo_falls_back_to_fuzzy_matches():
+    catalogue = build_catalogue(MOVIES)
+    assert search_titles('matirx', catalogue=catalogue) == [
+        'Matrix, The (1999)', 'Matrix Reloaded, The (2003)']
+    assert search_titles('toy stroy', catalogue=catalogue) == ['Toy Story (1995)']
+
+
+def test_only_misspelt_words_are_corrected():
+    catalogue = build_catalogue(MOVIES)
+    # `mati` matches `matilda`, so it is not read as a typo of `matr`
+    assert search_titles('mati', catalogue=catalogue) == ['Matilda (1996)']
+    assert search_titles('matirx', limit=1, offset=1, catalogue=catalogue) == [
+        'Matrix Reloaded, The (2003)']
+    # Short words are not corrected
+    assert search_titles('mab', catalogue=catalogue) == []
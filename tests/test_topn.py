@@ -0,0 +1,50 @@
+"""
+
+    Tests of the shared top-N selection and fusion.
+
+    Author: Explore Data Science Academy.
+
+    Run from the repository root with `python -m pytest`.
+
+"""
+
+import numpy as np
+import pytest
+from recommenders.topn import merge_top_n, top_n, top_n_rows
+
+
+def test_top_n_orders_ties_by_position():
+    scores = np.array([1.0, 3.0, 3.0, 2.0, 3.0, np.nan, -np.inf])
+    assert top_n(scores, 2).tolist() == [1, 2]
+    assert top_n(scores, 4).tolist() == [1, 2, 4, 3]
+    assert top_n(scores, 3, exclude=[2]).tolist() == [1, 4, 3]
+    # Non-finite scores are never selected
+    assert top_n(scores, 10).tolist() == [1, 2, 4, 3, 0]
+    assert top_n(scores, 0).tolist() == []
+
+
+def test_top_n_rows_orders_ties_by_column():
+    scores = np.array([[2.0, 5.0, 5.0, 1.0],
+                       [0.0, 0.0, 1.0, 0.0]])
+    columns, values = top_n_rows(scores, 3)
+    assert columns.tolist() == [[1, 2, 0], [2, 0, 1]]
+    assert values.tolist() == [[5.0, 5.0, 2.0], [1.0, 0.0, 0.0]]
+    columns, values = top_n_rows(scores, 0)
+    assert columns.shape == values.shape == (2, 0)
+
+
+@pytest.mark.parametrize('fusion', ['max', 'sum', 'weighted'])
+def test_merge_top_n_orders_ties_by_id(fusion):
+    lists = [(np.array([7, 3, 5]), np.array([0.9, 0.5, 0.5])),
+             (np.array([4, 1]), np.array([0.9, 0.5]))]
+    ids, scores = merge_top_n(lists, 4, fusion=fusion, weights=[1.0, 1.0],
+                              exclude=[5])
+    assert ids.tolist() == [4, 7, 1, 3]
+    assert scores.tolist() == [0.9, 0.9, 0.5, 0.5]
+
+
+@pytest.mark.parametrize('fusion', ['max', 'sum', 'weighted'])
+def test_merge_top_n_returns_nothing_for_no_items(fusion):
+    lists = [(np.array([1, 2]), np.array([0.9, 0.5]))]
+    ids, scores = merge_top_n(lists, 0, fusion=fusion, weights=[1.0])
+    assert ids.tolist() == [] and scores.tolist() == []
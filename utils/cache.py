@@ -0,0 +1,283 @@
+"""
+
+    Memoized recommendation results.
+
+    Author: Explore Data Science Academy.
+
+    Description: The same favourite-movie triples are submitted over and
+    over from the app. `RecommendationCache` sits in front of the
+    recommender functions and remembers their results, keyed on the
+    order-insensitive set of chosen titles, `top_n` and a model/data
+    version string. It has two tiers:
+
+      - an in-process LRU with a bounded number of entries and a TTL;
+      - an optional SQLite file, shared by all processes on the host and
+        surviving app restarts. It is enabled by setting the
+        `RECOMMENDATION_CACHE_DB` environment variable to a file path.
+
+    Hit, miss and eviction counters are available from `stats()`.
+
+"""
+
+# Script dependencies
+import collections
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_DISK_ENTRIES = 100000
+
+
+def version_of(*paths):
+    """Version string for a set of data/model files.
+
+    Based on file size and modification time, so it is cheap enough to
+    compute at import and changes whenever a file is replaced.
+
+    Parameters
+    ----------
+    paths : str
+        Files the cached results depend on.
+
+    Returns
+    -------
+    str
+        Short hex digest.
+
+    """
+    sha = hashlib.sha1()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            sha.update(f'{path}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+        except OSError:
+            sha.update(f'{path}:missing;'.encode())
+    return sha.hexdigest()[:16]
+
+
+def make_key(model, movie_list, top_n, version):
+    """Cache key of a recommendation request.
+
+    Parameters
+    ----------
+    model : str
+        Name of the recommender.
+    movie_list : list (str)
+        Chosen titles; their order and repetitions do not matter.
+    top_n : int
+        Number of recommendations requested.
+    version : str
+        Model/data version the result was computed with.
+
+    Returns
+    -------
+    str
+        sha1 hex digest identifying the request.
+
+    """
+    payload = json.dumps([model, version, int(top_n),
+                          sorted(set(map(str, movie_list)))])
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class RecommendationCache:
+    """Two-tier (memory LRU + optional SQLite) cache of recommendations.
+
+    Parameters
+    ----------
+    max_entries : int
+        Capacity of the in-memory tier.
+    ttl : float
+        Seconds after which an entry expires, in both tiers.
+    db_path : str, optional
+        SQLite file for the shared on-disk tier. Disabled if None.
+    max_disk_entries : int
+        Capacity of the on-disk tier; least recently used rows are
+        pruned beyond it.
+
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL,
+                 db_path=None, max_disk_entries=DEFAULT_MAX_DISK_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.max_disk_entries = max_disk_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = collections.Counter()
+        if db_path:
+            self._init_db()
+
+    # -- on-disk tier -------------------------------------------------
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)),
+                    exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS recommendations ('
+                         'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                         'created REAL NOT NULL, accessed REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS recommendations_accessed '
+                         'ON recommendations (accessed)')
+
+    def _disk_get(self, key, now):
+        try:
+            with self._connect() as conn:
+                row = conn.execute('SELECT value, created FROM recommendations '
+                                   'WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    return None
+                if now - row[1] > self.ttl:
+                    conn.execute('DELETE FROM recommendations WHERE key = ?',
+                                 (key,))
+                    return None
+                conn.execute('UPDATE recommendations SET accessed = ? '
+                             'WHERE key = ?', (now, key))
+                return json.loads(row[0]), row[1]
+        except sqlite3.Error:
+            self._counters['disk_errors'] += 1
+            return None
+
+    def _disk_put(self, key, value, now):
+        try:
+            with self._connect() as conn:
+                conn.execute('INSERT OR REPLACE INTO recommendations '
+                             'VALUES (?, ?, ?, ?)',
+                             (key, json.dumps(value), now, now))
+                self._counters['disk_writes'] += 1
+                if self._counters['disk_writes'] % 1000 == 0:
+                    self._prune(conn, now)
+        except sqlite3.Error:
+            self._counters['disk_errors'] += 1
+
+    def _prune(self, conn, now):
+        """Drop expired rows and the least recently used overflow."""
+        conn.execute('DELETE FROM recommendations WHERE created < ?',
+                     (now - self.ttl,))
+        conn.execute('DELETE FROM recommendations WHERE key IN ('
+                     'SELECT key FROM recommendations ORDER BY accessed DESC '
+                     'LIMIT -1 OFFSET ?)', (self.max_disk_entries,))
+
+    # -- public interface ---------------------------------------------
+
+    def get(self, key):
+        """Look up a cached result.
+
+        Returns
+        -------
+        list or None
+            A copy of the cached recommendations, or None on a miss.
+
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    return list(value)
+                del self._entries[key]
+                self._counters['expirations'] += 1
+        if self.db_path:
+            found = self._disk_get(key, now)
+            if found is not None:
+                value, created = found
+                self._remember(key, value, created)
+                with self._lock:
+                    self._counters['disk_hits'] += 1
+                return list(value)
+        with self._lock:
+            self._counters['misses'] += 1
+        return None
+
+    def _remember(self, key, value, created):
+        with self._lock:
+            self._entries[key] = (tuple(value), created)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def put(self, key, value):
+        """Store a result in every tier."""
+        now = time.time()
+        self._remember(key, value, now)
+        if self.db_path:
+            self._disk_put(key, list(value), now)
+
+    def clear(self):
+        """Empty the in-memory tier and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+    def stats(self):
+        """Snapshot of the cache counters.
+
+        Returns
+        -------
+        dict
+            `hits`, `disk_hits`, `misses`, `evictions`, `expirations`,
+            `size` and the overall `hit_rate`.
+
+        """
+        with self._lock:
+            stats = {name: self._counters[name]
+                     for name in ('hits', 'disk_hits', 'misses', 'evictions',
+                                  'expirations', 'disk_errors')}
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = ((stats['hits'] + stats['disk_hits']) / lookups
+                             if lookups else 0.0)
+        return stats
+
+    def memoize(self, model, version):
+        """Decorate a `(movie_list, top_n=10)` recommender with this cache.
+
+        Parameters
+        ----------
+        model : str
+            Name of the recommender, part of the cache key.
+        version : str or callable
+            Model/data version, part of the cache key. A zero-argument
+            callable is evaluated on each call, so the version can be
+            loaded lazily.
+
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(movie_list, top_n=10):
+                key = make_key(model, movie_list, top_n,
+                               version() if callable(version) else version)
+                result = self.get(key)
+                if result is None:
+                    result = func(movie_list, top_n)
+                    self.put(key, result)
+                return result
+            wrapper.cache = self
+            return wrapper
+        return decorator
+
+
+# Cache shared by the recommenders of this process
+recommendation_cache = RecommendationCache(
+    db_path=os.environ.get('RECOMMENDATION_CACHE_DB'))
@@ -0,0 +1,501 @@
+"""
+
+    Shared movie catalogue index.
+
+    Author: Explore Data Science Academy.
+
+    Description: Hash lookups between movie titles, MovieLens ids and
+    row numbers of `movies.csv`, built once per process and shared by the
+    recommenders, `load_movie_titles` and the app. This replaces linear
+    scans such as `indices[indices == title].index[0]` and rebuilding
+    `list(movies['title'])` per recommended item.
+
+    Rows are the positions of movies within `movies.csv`, which is also
+    the row order of the content features.
+
+    Some titles occur more than once in the catalogue (remakes sharing a
+    title and year). A title always resolves to its first row, so
+    lookups are deterministic; `rows_for_title` returns every row.
+
+    Titles can also be searched by prefix, either of the whole title or
+    of any word in it. Queries and titles are normalised first: case,
+    accents and punctuation are ignored, and MovieLens' trailing article
+    ("Matrix, The (1999)") is moved to the front ("the matrix 1999").
+    Two sorted indexes answer a query with binary searches:
+
+      - the normalised titles, sorted, for whole-title prefixes;
+      - an inverted index of title words: the sorted vocabulary, and the
+        rows holding each word (CSR-style), so all words starting with a
+        prefix are one contiguous slice of rows. The words of each row
+        are kept too, to filter a few candidate rows without scanning
+        that slice.
+
+    When these find fewer titles than the requested pages, titles
+    matching the query with one typo per word follow: each word of at
+    least `MIN_FUZZY_LENGTH` characters that matches no title is
+    replaced by the vocabulary words one deletion, transposition,
+    substitution or insertion away from it, looked up with the same
+    binary searches.
+
+    Results are paged, and a query only reads as many rows as the pages
+    it returns. `benchmarks/bench_search.py` measures query latency on
+    catalogues of up to millions of titles.
+
+    The index is built by the build pipeline (`python -m
+    recommenders.pipeline`) and published with the other serving
+    artifacts; processes load it instead of normalising every title, as
+    long as it was built from the same `movies.csv`.
+
+"""
+
+# Data handling dependencies
+import re
+import threading
+import unicodedata
+import os
+import numpy as np
+import pandas as pd
+from recommenders.artifacts import load_published, CATALOGUE_NAME
+from utils.data_store import file_digest, load_movies, MOVIES_PATH
+from utils.tracing import traced
+
+CATALOGUE_VERSION = 1
+# Arrays persisted by `save_catalogue`; the other lookups derive from them
+_SAVED = ('titles', 'movie_ids', 'keys', 'title_key_rows', 'words',
+          'word_indptr', 'word_rows', 'row_word_indptr', 'row_words')
+_STRINGS = ('titles', 'keys', 'words')
+
+_ARTICLE = re.compile(r'^(?P<title>.*), (?P<article>the|a|an|les|la|le|il|el|der|die|das)'
+                      r'(?P<rest> \(\d{4}\))?$', re.IGNORECASE)
+_NON_WORD = re.compile(r'[^\w]+')
+_COMBINING = re.compile(r'[\u0300-\u036f]+')
+# Release year at the end of a MovieLens title, and the `genres` value of
+# movies without genres
+TITLE_YEAR = re.compile(r'\((\d{4})\)\s*$')
+NO_GENRES = '(no genres listed)'
+# Shorter words only match exactly: most of the vocabulary is one edit
+# away from them
+MIN_FUZZY_LENGTH = 4
+_FUZZY_ALPHABET = 'abcdefghijklmnopqrstuvwxyz0123456789'
+
+_lock = threading.Lock()
+_catalogues = {}
+
+
+def normalize_title(title):
+    """Normalise a title or query for searching.
+
+    Parameters
+    ----------
+    title : str
+        Raw title, e.g. `'Matrix, The (1999)'`.
+
+    Returns
+    -------
+    str
+        Lower-case, accent- and punctuation-free title with its article
+        in front, e.g. `'the matrix 1999'`.
+
+    """
+    match = _ARTICLE.match(title.strip())
+    if match:
+        title = f"{match['article']} {match['title']}{match['rest'] or ''}"
+    title = _COMBINING.sub('', unicodedata.normalize('NFKD', title))
+    return _NON_WORD.sub(' ', title.casefold()).strip()
+
+
+@traced('catalogue.build')
+def build_catalogue(movies):
+    """Build the lookup tables of a movie catalogue.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movie records with `movieId` and `title` columns.
+
+    Returns
+    -------
+    dict
+        `titles` and `movie_ids` (row -> value arrays), `title_rows`
+        (title -> first row), `id_index` (`pd.Index` of movie ids, for
+        vectorised id -> row lookups), the normalised title of each row
+        (`keys`), the sorted normalised titles (`title_keys`, with their
+        `title_key_rows`) and the word index: sorted `words`, the rows of
+        word `i` in `word_rows[word_indptr[i]:word_indptr[i + 1]]`
+        (ascending) and the words of row `r` in
+        `row_words[row_word_indptr[r]:row_word_indptr[r + 1]]`.
+
+    """
+    titles = np.asarray(movies['title'].fillna(''), dtype=object)
+    movie_ids = movies['movieId'].to_numpy(dtype=np.int64)
+
+    # Sorted keys for prefix search over whole titles; equal keys keep
+    # catalogue order
+    keys = np.array([normalize_title(title) for title in titles], dtype=object)
+    title_order = np.argsort(keys, kind='stable')
+
+    # Inverted index of the distinct words of each title
+    words = pd.Series(keys).str.split().explode().dropna()
+    words = words[~pd.MultiIndex.from_arrays([words.index, words]).duplicated()]
+    codes, vocabulary = pd.factorize(words, sort=True)
+    word_rows = words.index.to_numpy(dtype=np.int32)
+    order = np.lexsort((word_rows, codes))
+    word_indptr = np.concatenate(
+        [[0], np.cumsum(np.bincount(codes, minlength=len(vocabulary)))])
+    # `words` is in row order, so its codes already form the forward index
+    row_word_indptr = np.concatenate(
+        [[0], np.cumsum(np.bincount(word_rows, minlength=len(keys)))])
+    return _with_lookups({
+        'titles': titles,
+        'movie_ids': movie_ids,
+        'keys': keys,
+        'title_key_rows': title_order.astype(np.int32),
+        'words': np.asarray(vocabulary, dtype=object),
+        'word_indptr': word_indptr.astype(np.int64),
+        'word_rows': word_rows[order],
+        'row_word_indptr': row_word_indptr.astype(np.int64),
+        'row_words': codes.astype(np.int32),
+    })
+
+
+def _with_lookups(catalogue):
+    titles = catalogue['titles']
+    # Iterating backwards leaves duplicate titles mapped to their first row
+    catalogue['title_rows'] = dict(zip(titles[::-1],
+                                       range(len(titles) - 1, -1, -1)))
+    catalogue['id_index'] = pd.Index(catalogue['movie_ids'])
+    catalogue['title_keys'] = catalogue['keys'][catalogue['title_key_rows']]
+    return catalogue
+
+
+def save_catalogue(path, catalogue, source_digest):
+    """Persist a catalogue index as a compressed `.npz`, atomically."""
+    arrays = {name: catalogue[name].astype(str) if name in _STRINGS
+              else catalogue[name] for name in _SAVED}
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(tmp_path, version=np.int32(CATALOGUE_VERSION),
+                        source_digest=np.array(source_digest), **arrays)
+    os.replace(tmp_path, path)
+
+
+@traced('catalogue.load')
+def load_catalogue(path, movies_path=None):
+    """Load a persisted catalogue index.
+
+    Parameters
+    ----------
+    path : str
+        Path to the `.npz` index.
+    movies_path : str, optional
+        If given, an index built from a different version of this movie
+        file is rejected.
+
+    Returns
+    -------
+    dict
+        Lookup tables as returned by `build_catalogue`.
+
+    Raises
+    ------
+    FileNotFoundError
+        If no index exists at `path`.
+    ValueError
+        If the index is from an incompatible version or is stale.
+
+    """
+    with np.load(path) as data:
+        if int(data['version']) != CATALOGUE_VERSION:
+            raise ValueError(f"Unsupported catalogue version in {path}")
+        if movies_path is not None and \
+                str(data['source_digest']) != file_digest(movies_path):
+            raise ValueError(f"Catalogue {path} is stale for {movies_path}")
+        return _with_lookups({
+            name: data[name].astype(object) if name in _STRINGS
+            else data[name] for name in _SAVED})
+
+
+def build_from_csv(movies_path=MOVIES_PATH, output_path=None):
+    """Build the catalogue index of a movie file, saving it if asked."""
+    catalogue = build_catalogue(load_movies(movies_path))
+    if output_path is not None:
+        save_catalogue(output_path, catalogue, file_digest(movies_path))
+    return catalogue
+
+
+def _load_served(path):
+    # The published index is used when it was built from this movie file
+    return load_published(
+        CATALOGUE_NAME, lambda published: load_catalogue(published, movies_path=path),
+        lambda: build_catalogue(load_movies(path)))
+
+
+def get_catalogue(path=MOVIES_PATH):
+    """Catalogue of a movie file, loaded or built once per process.
+
+    Parameters
+    ----------
+    path : str
+        Path to `movies.csv`.
+
+    Returns
+    -------
+    dict
+        Lookup tables as returned by `build_catalogue`.
+
+    """
+    with _lock:
+        catalogue = _catalogues.get(path)
+    if catalogue is None:
+        catalogue = _load_served(path)
+        with _lock:
+            catalogue = _catalogues.setdefault(path, catalogue)
+    return catalogue
+
+
+def title_to_row(title, catalogue=None):
+    """Row of a movie title.
+
+    Raises
+    ------
+    KeyError
+        If the title is not in the catalogue.
+
+    """
+    catalogue = catalogue or get_catalogue()
+    try:
+        return catalogue['title_rows'][title]
+    except KeyError:
+        raise KeyError(f"Unknown movie title: {title!r}") from None
+
+
+def titles_to_rows(titles, catalogue=None):
+    """Rows of several movie titles, in order."""
+    catalogue = catalogue or get_catalogue()
+    return [title_to_row(title, catalogue) for title in titles]
+
+
+def rows_for_title(title, catalogue=None):
+    """Every row sharing a title (duplicates included)."""
+    catalogue = catalogue or get_catalogue()
+    first = title_to_row(title, catalogue)
+    return [first] + [row for row in np.flatnonzero(catalogue['titles'] == title)
+                      if row != first]
+
+
+def ids_to_rows(movie_ids, catalogue=None):
+    """Rows of MovieLens ids; -1 for ids missing from the catalogue."""
+    catalogue = catalogue or get_catalogue()
+    return catalogue['id_index'].get_indexer(np.asarray(movie_ids))
+
+
+def _prefix_range(keys, prefix):
+    """Bounds of the sorted keys starting with `prefix`."""
+    return (np.searchsorted(keys, prefix, side='left'),
+            np.searchsorted(keys, prefix + '\U0010ffff', side='left'))
+
+
+def _word_rows(catalogue, word):
+    """Rows (ascending) of the titles containing a whole word."""
+    words = catalogue['words']
+    i = np.searchsorted(words, word)
+    if i == len(words) or words[i] != word:
+        return np.zeros(0, dtype=np.int32)
+    indptr = catalogue['word_indptr']
+    return catalogue['word_rows'][indptr[i]:indptr[i + 1]]
+
+
+def _contains(sorted_rows, rows):
+    """Mask of the `rows` found in an ascending array."""
+    if len(sorted_rows) == 0:
+        return np.zeros(len(rows), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_rows, rows),
+                           len(sorted_rows) - 1)
+    return sorted_rows[positions] == rows
+
+
+def _scan_prefix(catalogue, lo, hi, required, skip, n, budget=None,
+                 chunk_size=256):
+    """Scan `word_rows[lo:hi]` for the first `n` rows holding the
+    `required` words; None if `budget` rows were read without finding
+    them all."""
+    found, seen = [], set(skip)
+    for chunk_start in range(lo, hi, chunk_size):
+        if budget is not None and chunk_start - lo >= budget:
+            return None
+        rows = catalogue['word_rows'][chunk_start:min(chunk_start + chunk_size, hi)]
+        for required_rows in required:
+            rows = rows[_contains(required_rows, rows)]
+        for row in rows.tolist():
+            # A title with several words starting with the prefix is
+            # listed under the first of them
+            if row not in seen:
+                seen.add(row)
+                found.append(row)
+                if len(found) >= n:
+                    return found
+    return found
+
+
+def _filter_candidates(catalogue, start, end, required, skip, n):
+    """Rows holding the `required` words and one of the words
+    `start:end`, ranked as by `_scan_prefix`."""
+    candidates = required[0]
+    for rows in required[1:]:
+        candidates = candidates[_contains(rows, candidates)]
+    codes, counts = _row_word_codes(catalogue, candidates)
+    owners = np.repeat(candidates, counts)
+    hit = (codes >= start) & (codes < end) & ~np.isin(owners, list(skip))
+    codes, owners = codes[hit], owners[hit]
+    order = np.lexsort((owners, codes))
+    _, first = np.unique(owners[order], return_index=True)
+    return owners[order[np.sort(first)]][:n].tolist()
+
+
+def _word_matches(catalogue, words, skip, n):
+    """First `n` rows containing `words[:-1]` and a word starting with
+    `words[-1]`, by that word then by row; rows in `skip` are left out."""
+    start, end = _prefix_range(catalogue['words'], words[-1])
+    # Rows of all words starting with the prefix, by word then by row
+    lo, hi = catalogue['word_indptr'][start], catalogue['word_indptr'][end]
+    required = sorted((_word_rows(catalogue, w) for w in set(words[:-1])),
+                      key=len)
+    if not required:
+        return _scan_prefix(catalogue, lo, hi, required, skip, n)
+    # Matches are usually dense enough among the prefix's rows for a
+    # short scan. Past the cost of filtering the titles holding the whole
+    # words on the words they hold, the latter is done instead.
+    budget = len(required[0]) * len(catalogue['row_words']) // len(catalogue['keys'])
+    found = _scan_prefix(catalogue, lo, hi, required, skip, n, budget)
+    if found is None:
+        found = _filter_candidates(catalogue, start, end, required, skip, n)
+    return found
+
+
+def _edits(word):
+    """`word` and the strings one edit away from it, sorted."""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    edits = {word}
+    edits.update(a + b[1:] for a, b in splits if b)
+    edits.update(a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1)
+    edits.update(a + c + b[1:] for a, b in splits if b for c in _FUZZY_ALPHABET)
+    edits.update(a + c + b for a, b in splits for c in _FUZZY_ALPHABET)
+    return sorted(edits)
+
+
+def _match_ranges(catalogue, word, prefix):
+    """Ranges of word codes matching `word` (words starting with it if
+    `prefix`), else of those one edit away from it.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray, bool)
+        Starts and ends of the ranges, and whether the word was
+        corrected.
+
+    """
+    words = catalogue['words']
+
+    def ranges(variants):
+        variants = np.array(variants, dtype=object)
+        starts = np.searchsorted(words, variants, side='left')
+        if prefix:
+            ends = np.searchsorted(words, variants + '\U0010ffff', side='left')
+        else:
+            ends = np.searchsorted(words, variants, side='right')
+        keep = ends > starts
+        return starts[keep], ends[keep]
+
+    starts, ends = ranges([word])
+    if len(starts) or len(word) < MIN_FUZZY_LENGTH:
+        return starts, ends, False
+    return (*ranges(_edits(word)), True)
+
+
+def _row_word_codes(catalogue, rows):
+    """Word codes of each of `rows`, concatenated, and their counts."""
+    row_indptr = catalogue['row_word_indptr']
+    counts = row_indptr[rows + 1] - row_indptr[rows]
+    positions = (np.arange(counts.sum())
+                 + np.repeat(row_indptr[rows] - np.cumsum(counts) + counts,
+                             counts))
+    return catalogue['row_words'][positions], counts
+
+
+def _fuzzy_matches(catalogue, words, skip, n):
+    """First `n` rows holding `words[:-1]` and a word starting with
+    `words[-1]`, where words matching no title are replaced by those one
+    edit away from them, in catalogue order; rows in `skip` are left
+    out."""
+    last = len(words) - 1
+    ranges = [_match_ranges(catalogue, word, i == last)
+              for i, word in enumerate(words)]
+    if not any(corrected for _, _, corrected in ranges):
+        # Nothing to correct: the exact matches are all there is
+        return []
+    indptr = catalogue['word_indptr']
+    sizes = [(indptr[ends] - indptr[starts]).sum() for starts, ends, _ in ranges]
+    smallest = int(np.argmin(sizes))
+    if sizes[smallest] == 0:
+        return []
+    # Only the rows of the most selective word are listed; the other
+    # words are checked against the words of those rows
+    starts, ends, _ = ranges[smallest]
+    rows = np.unique(np.concatenate([catalogue['word_rows'][indptr[a]:indptr[b]]
+                                     for a, b in zip(starts, ends)]))
+    rows = rows[~np.isin(rows, list(skip))]
+    for i, (starts, ends, _) in enumerate(ranges):
+        if i == smallest or len(rows) == 0:
+            continue
+        matching = np.zeros(len(catalogue['words']) + 1, dtype=np.int8)
+        np.add.at(matching, starts, 1)
+        np.add.at(matching, ends, -1)
+        matching = np.cumsum(matching[:-1]) > 0
+        codes, counts = _row_word_codes(catalogue, rows)
+        hits = np.bincount(np.repeat(np.arange(len(rows)), counts),
+                           weights=matching[codes], minlength=len(rows))
+        rows = rows[hits > 0]
+    return rows[:n].tolist()
+
+
+@traced('catalogue.search')
+def search_titles(query, limit=20, offset=0, catalogue=None):
+    """Find titles matching a typed query.
+
+    Titles starting with the query come first (alphabetically), followed
+    by titles containing a word starting with the query's last word and
+    containing all its other words (by that word, then in catalogue
+    order). If these are fewer than `offset + limit`, titles matching
+    the query once its misspelt words are corrected (one typo per word)
+    follow, in catalogue order.
+
+    Parameters
+    ----------
+    query : str
+        Text typed by the user.
+    limit : int
+        Maximum number of titles to return.
+    offset : int
+        Number of matches to skip, for paging through the results.
+
+    Returns
+    -------
+    list (str)
+        Matching titles, best first.
+
+    """
+    catalogue = catalogue or get_catalogue()
+    query = normalize_title(query)
+    if not query or limit <= 0:
+        return []
+    n = offset + limit
+    start, end = _prefix_range(catalogue['title_keys'], query)
+    rows = catalogue['title_key_rows'][start:min(end, start + n)].tolist()
+    if len(rows) < n:
+        # Every whole-title match is already in `rows`
+        rows += _word_matches(catalogue, query.split(), set(rows),
+                              n - len(rows))
+    if len(rows) < n:
+        # Every exact match is already in `rows`
+        rows += _fuzzy_matches(catalogue, query.split(), set(rows),
+                               n - len(rows))
+    return [catalogue['titles'][row] for row in rows[offset:n]]
@@ -6,8 +6,7 @@
 
 """
 # Data handling dependencies
-import pandas as pd
-import numpy as np
+from utils.catalogue import get_catalogue
 
 def load_movie_titles(path_to_movies):
     """Load movie titles from database records.
@@ -24,7 +23,5 @@ def load_movie_titles(path_to_movies):
         Movie titles.
 
     """
-    df = pd.read_csv(path_to_movies)
-    df = df.dropna()
-    movie_list = df['title'].to_list()
+    movie_list = get_catalogue(path_to_movies)['titles'].tolist()
     return movie_list
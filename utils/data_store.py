@@ -0,0 +1,349 @@
+"""
+
+    Binary cache of the movie and rating data.
+
+    Author: Explore Data Science Academy.
+
+    Description: Parsing `movies.csv` and `ratings.csv` with
+    `pd.read_csv` is the slowest part of starting the app. This module
+    converts each CSV once into a columnar binary cache stored next to
+    it (`resources/data/.cache/<name>/`):
+
+      - numeric columns as raw arrays (`<column>.bin`), opened
+        memory-mapped;
+      - string columns as an int64 offsets array plus a uint8 blob of
+        utf-8 bytes.
+
+    The cache is written chunk by chunk, so converting a file needs
+    memory for one chunk only, whatever the size of the CSV. The dtype
+    of every file is recorded in `manifest.json`.
+
+    A cache is reused as long as the size and modification time of its
+    source CSV are unchanged (or, if only the mtime changed, its md5
+    digest still matches), and is rebuilt otherwise. Within a process
+    every module shares the same arrays and data frames, so they must be
+    treated as read-only.
+
+"""
+
+# Data handling dependencies
+import hashlib
+import json
+import os
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+from utils.tracing import count, traced
+
+MOVIES_PATH = 'resources/data/movies.csv'
+RATINGS_PATH = 'resources/data/ratings.csv'
+CACHE_VERSION = 2
+DEFAULT_CHUNK_ROWS = 1000000
+
+# Column layout of each cached table; `str` columns are stored as
+# offsets + bytes.
+SCHEMAS = {
+    'movies': {'movieId': np.int32, 'title': str, 'genres': str},
+    'ratings': {'userId': np.int32, 'movieId': np.int32,
+                'rating': np.float32, 'timestamp': np.int64},
+}
+
+_lock = threading.Lock()
+_tables = {}
+_frames = {}
+
+
+def file_digest(path):
+    """md5 hex digest of a file, used to detect stale caches and artifacts."""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def cache_dir_for(csv_path):
+    """Directory holding the binary cache of a CSV file."""
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(os.path.dirname(csv_path), '.cache', stem)
+
+
+def encode_strings(values):
+    """Pack strings into an offsets array and a utf-8 byte blob.
+
+    Parameters
+    ----------
+    values : iterable of str
+        Strings to pack. Missing values are stored as empty strings.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        int64 offsets of length n + 1 and the uint8 blob.
+
+    """
+    encoded = [v.encode('utf-8') if isinstance(v, str) else b''
+               for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return offsets, blob
+
+
+def decode_strings(offsets, blob):
+    """Unpack strings packed by `encode_strings`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Object array of Python strings.
+
+    """
+    raw = blob.tobytes()
+    return np.array([raw[a:b].decode('utf-8')
+                     for a, b in zip(offsets[:-1].tolist(), offsets[1:].tolist())],
+                    dtype=object)
+
+
+def _read_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(cache_dir, manifest):
+    tmp_path = os.path.join(cache_dir, 'manifest.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(cache_dir, 'manifest.json'))
+
+
+def is_fresh(csv_path, cache_dir=None):
+    """Check whether the cache of a CSV still matches its source.
+
+    Parameters
+    ----------
+    csv_path : str
+        Source CSV file.
+    cache_dir : str, optional
+        Cache location, defaults to `cache_dir_for(csv_path)`.
+
+    Returns
+    -------
+    bool
+        True if the cache can be used as is.
+
+    """
+    cache_dir = cache_dir or cache_dir_for(csv_path)
+    manifest = _read_manifest(cache_dir)
+    if manifest is None or manifest.get('version') != CACHE_VERSION:
+        return False
+    stat = os.stat(csv_path)
+    source = manifest['source']
+    if stat.st_size != source['size']:
+        return False
+    if stat.st_mtime_ns == source['mtime_ns']:
+        return True
+    # Touched but possibly unchanged: fall back to the content hash
+    if file_digest(csv_path) != source['md5']:
+        return False
+    source['mtime_ns'] = stat.st_mtime_ns
+    try:
+        _write_manifest(cache_dir, manifest)
+    except OSError:
+        pass
+    return True
+
+
+def _frame_to_columns(df, schema):
+    """Convert a parsed table into the cached column arrays."""
+    columns = {}
+    for name, dtype in schema.items():
+        if dtype is str:
+            offsets, blob = encode_strings(df[name].tolist())
+            columns[name + '.offsets'] = offsets
+            columns[name + '.bytes'] = blob
+        else:
+            columns[name] = df[name].to_numpy(dtype=dtype)
+    return columns
+
+
+def _column_files(schema):
+    """Cache file names of each column of a schema, with their dtypes."""
+    files = {}
+    for name, dtype in schema.items():
+        if dtype is str:
+            files[name + '.offsets'] = np.dtype(np.int64)
+            files[name + '.bytes'] = np.dtype(np.uint8)
+        else:
+            files[name] = np.dtype(dtype)
+    return files
+
+
+@traced('data.build_cache')
+def build_cache(csv_path, kind, cache_dir=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Convert a CSV file into its binary cache.
+
+    The CSV is parsed `chunk_rows` rows at a time and each chunk is
+    appended to the column files, so memory use is bounded by the chunk
+    size rather than by the size of the file.
+
+    Parameters
+    ----------
+    csv_path : str
+        Source CSV file.
+    kind : str
+        Table schema to use, one of `SCHEMAS`.
+    cache_dir : str, optional
+        Cache location, defaults to `cache_dir_for(csv_path)`.
+    chunk_rows : int
+        Number of CSV rows parsed at a time.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+
+    """
+    cache_dir = cache_dir or cache_dir_for(csv_path)
+    schema = SCHEMAS[kind]
+    files = _column_files(schema)
+    stat = os.stat(csv_path)
+
+    # Write into a private directory and swap it in, so concurrent
+    # readers never see a half-written cache.
+    tmp_dir = f'{cache_dir}.tmp-{os.getpid()}-{threading.get_ident()}'
+    os.makedirs(tmp_dir, exist_ok=True)
+    handles = {name: open(os.path.join(tmp_dir, name + '.bin'), 'wb')
+               for name in files}
+    try:
+        rows = 0
+        # Running end of each string column's byte blob
+        string_ends = {name: 0 for name, dtype in schema.items()
+                       if dtype is str}
+        for name in string_ends:
+            handles[name + '.offsets'].write(np.zeros(1, np.int64).tobytes())
+        reader = pd.read_csv(csv_path, usecols=list(schema),
+                             chunksize=chunk_rows)
+        for chunk in reader:
+            for name, values in _frame_to_columns(chunk, schema).items():
+                if name.endswith('.offsets'):
+                    column = name[:-len('.offsets')]
+                    values = values[1:] + string_ends[column]
+                    if len(values):
+                        string_ends[column] = int(values[-1])
+                handles[name].write(
+                    np.ascontiguousarray(values, files[name]).tobytes())
+            rows += len(chunk)
+    finally:
+        for handle in handles.values():
+            handle.close()
+    _write_manifest(tmp_dir, {
+        'version': CACHE_VERSION,
+        'kind': kind,
+        'rows': rows,
+        'files': {name: dtype.str for name, dtype in files.items()},
+        'source': {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                   'md5': file_digest(csv_path)},
+    })
+    old_dir = f'{cache_dir}.old-{os.getpid()}-{threading.get_ident()}'
+    if os.path.exists(cache_dir):
+        os.replace(cache_dir, old_dir)
+    os.replace(tmp_dir, cache_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return rows
+
+
+def _open_cache(cache_dir, schema):
+    """Memory-map the column files of a cache directory."""
+    columns = {}
+    for name, dtype in _column_files(schema).items():
+        path = os.path.join(cache_dir, name + '.bin')
+        if os.path.getsize(path) == 0:
+            # mmap cannot map an empty file
+            columns[name] = np.zeros(0, dtype=dtype)
+        else:
+            columns[name] = np.memmap(path, dtype=dtype, mode='r')
+    return columns
+
+
+@traced('data.load_table')
+def load_table(csv_path, kind):
+    """Get the column arrays of a CSV, building its cache if needed.
+
+    The arrays are opened once per process and shared by all callers.
+    If the cache cannot be written (e.g. a read-only checkout) the CSV
+    is parsed into memory instead.
+
+    Parameters
+    ----------
+    csv_path : str
+        Source CSV file.
+    kind : str
+        Table schema to use, one of `SCHEMAS`.
+
+    Returns
+    -------
+    dict
+        Read-only column arrays keyed by column name (numeric columns)
+        or `<column>.offsets` / `<column>.bytes` (string columns).
+
+    """
+    key = (os.path.abspath(csv_path), kind)
+    with _lock:
+        if key not in _tables:
+            cache_dir = cache_dir_for(csv_path)
+            try:
+                if not is_fresh(csv_path, cache_dir):
+                    count('data.cache_rebuilds')
+                    build_cache(csv_path, kind, cache_dir)
+                _tables[key] = _open_cache(cache_dir, SCHEMAS[kind])
+            except OSError:
+                count('data.csv_fallbacks')
+                df = pd.read_csv(csv_path, usecols=list(SCHEMAS[kind]))
+                _tables[key] = _frame_to_columns(df, SCHEMAS[kind])
+        return _tables[key]
+
+
+@traced('data.load_frame')
+def load_frame(csv_path, kind):
+    """Get a CSV as a data frame backed by the shared binary cache.
+
+    Numeric columns are zero-copy views of the memory-mapped arrays;
+    string columns are decoded once per process.
+
+    Returns
+    -------
+    Pandas Dataframe
+        Shared, read-only data frame. Use non-inplace operations only.
+
+    """
+    key = (os.path.abspath(csv_path), kind)
+    with _lock:
+        frame = _frames.get(key)
+    if frame is not None:
+        return frame
+    columns = load_table(csv_path, kind)
+    data = {}
+    for name, dtype in SCHEMAS[kind].items():
+        if dtype is str:
+            data[name] = decode_strings(columns[name + '.offsets'],
+                                        columns[name + '.bytes'])
+        else:
+            data[name] = columns[name]
+    frame = pd.DataFrame(data, copy=False)
+    with _lock:
+        return _frames.setdefault(key, frame)
+
+
+def load_movies(path=MOVIES_PATH):
+    """Movie records (`movieId`, `title`, `genres`)."""
+    return load_frame(path, 'movies')
+
+
+def load_ratings(path=RATINGS_PATH):
+    """Rating records (`userId`, `movieId`, `rating`, `timestamp`)."""
+    return load_frame(path, 'ratings')
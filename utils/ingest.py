@@ -0,0 +1,205 @@
+"""
+
+    Streaming, chunked ingestion of rating files.
+
+    Author: Explore Data Science Academy.
+
+    Description: Full MovieLens-scale rating files (25M+ rows) do not
+    need to fit in memory as a DataFrame. Ratings are read in chunks of
+    `chunk_rows` rows with compact dtypes (int32 ids, uint8 half-star
+    ratings), and the structures the recommenders need are built
+    incrementally from the chunks:
+
+      - `rating_aggregates`: per-user and per-item counts, sums and sums
+        of squares (one pass);
+      - `stream_user_item`: the sparse CSC user-item matrix used by
+        `recommenders.item_similarity` (two passes: the first counts
+        ratings per item so the second can fill the final arrays in
+        place, with no intermediate copies).
+
+    Peak memory ceiling of `stream_user_item`, for `nnz` ratings:
+
+        8 * nnz bytes                  CSC row indices (int32) + data (float32)
+      + ~60 * chunk_rows bytes         one parsed CSV chunk
+      + ~40 * (max_user_id + max_movie_id) bytes   id maps and aggregates
+
+    i.e. about 200MB for MovieLens 25M with the default 1M-row chunks,
+    against several GB for `pd.read_csv` followed by a pivot.
+    `benchmarks/bench_ingest.py` measures peak RSS against file size.
+
+    Ratings are assumed to be unique per (user, movie) pair, as in the
+    MovieLens files; duplicates would be summed.
+
+"""
+
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from utils.tracing import traced
+
+RATINGS_PATH = 'resources/data/ratings.csv'
+DEFAULT_CHUNK_ROWS = 1000000
+
+
+def iter_rating_chunks(path=RATINGS_PATH, chunk_rows=DEFAULT_CHUNK_ROWS,
+                       timestamps=False):
+    """Read a rating file in bounded-size chunks with compact dtypes.
+
+    Parameters
+    ----------
+    path : str
+        Path to a MovieLens `ratings.csv`.
+    chunk_rows : int
+        Number of rows per chunk.
+    timestamps : bool
+        Also read the `timestamp` column (int64).
+
+    Yields
+    ------
+    dict
+        `userId`, `movieId` (int32) and `half_stars` (uint8 rating x 2)
+        arrays, plus `timestamp` if requested.
+
+    """
+    columns = ['userId', 'movieId', 'rating']
+    dtypes = {'userId': np.int32, 'movieId': np.int32, 'rating': np.float32}
+    if timestamps:
+        columns.append('timestamp')
+        dtypes['timestamp'] = np.int64
+    reader = pd.read_csv(path, usecols=columns, dtype=dtypes,
+                         chunksize=chunk_rows)
+    for chunk in reader:
+        out = {
+            'userId': chunk['userId'].to_numpy(),
+            'movieId': chunk['movieId'].to_numpy(),
+            'half_stars': np.rint(chunk['rating'].to_numpy() * 2)
+                            .astype(np.uint8),
+        }
+        if timestamps:
+            out['timestamp'] = chunk['timestamp'].to_numpy()
+        yield out
+
+
+def _grow(array, size):
+    """Zero-extend a 1-d array to at least `size` entries."""
+    if len(array) >= size:
+        return array
+    grown = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def rating_aggregates(path=RATINGS_PATH, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Per-user and per-item rating statistics in a single pass.
+
+    Parameters
+    ----------
+    path : str
+        Path to `ratings.csv`.
+    chunk_rows : int
+        Number of rows per chunk.
+
+    Returns
+    -------
+    dict
+        `user_counts`, `item_counts` (int64), `item_sums`, `item_sumsq`
+        (float64), indexed by raw id (arrays sized to the largest id),
+        and the overall `n_ratings` and `global_mean`.
+
+    """
+    user_counts = np.zeros(0, dtype=np.int64)
+    item_counts = np.zeros(0, dtype=np.int64)
+    item_sums = np.zeros(0, dtype=np.float64)
+    item_sumsq = np.zeros(0, dtype=np.float64)
+    n_ratings, total = 0, 0.0
+    for chunk in iter_rating_chunks(path, chunk_rows):
+        users, items = chunk['userId'], chunk['movieId']
+        ratings = chunk['half_stars'] / 2.0
+        n_users, n_items = users.max() + 1, items.max() + 1
+        user_counts = _grow(user_counts, n_users)
+        item_counts = _grow(item_counts, n_items)
+        item_sums = _grow(item_sums, n_items)
+        item_sumsq = _grow(item_sumsq, n_items)
+        user_counts[:n_users] += np.bincount(users, minlength=n_users)
+        item_counts[:n_items] += np.bincount(items, minlength=n_items)
+        item_sums[:n_items] += np.bincount(items, ratings, minlength=n_items)
+        item_sumsq[:n_items] += np.bincount(items, ratings ** 2,
+                                            minlength=n_items)
+        n_ratings += len(ratings)
+        total += float(ratings.sum())
+    n_users = int(np.flatnonzero(user_counts)[-1]) + 1 if n_ratings else 0
+    n_items = int(np.flatnonzero(item_counts)[-1]) + 1 if n_ratings else 0
+    return {
+        'user_counts': user_counts[:n_users],
+        'item_counts': item_counts[:n_items],
+        'item_sums': item_sums[:n_items],
+        'item_sumsq': item_sumsq[:n_items],
+        'n_ratings': n_ratings,
+        'global_mean': total / n_ratings if n_ratings else 0.0,
+    }
+
+
+@traced('ingest.stream_user_item')
+def stream_user_item(path=RATINGS_PATH, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Build the sparse user-item store without loading the whole file.
+
+    Produces the same structure as `item_similarity.build_user_item`
+    (users and items in ascending raw-id order).
+
+    Parameters
+    ----------
+    path : str
+        Path to `ratings.csv`.
+    chunk_rows : int
+        Number of rows per chunk.
+
+    Returns
+    -------
+    dict
+        User-item store, see `recommenders.item_similarity`.
+
+    """
+    # Pass 1: which ids exist, and how many ratings each item has
+    aggregates = rating_aggregates(path, chunk_rows)
+    user_ids = np.flatnonzero(aggregates['user_counts'])
+    item_ids = np.flatnonzero(aggregates['item_counts'])
+    user_rows = np.full(len(aggregates['user_counts']), -1, dtype=np.int32)
+    user_rows[user_ids] = np.arange(len(user_ids), dtype=np.int32)
+    item_cols = np.full(len(aggregates['item_counts']), -1, dtype=np.int32)
+    item_cols[item_ids] = np.arange(len(item_ids), dtype=np.int32)
+    counts = aggregates['item_counts'][item_ids]
+    nnz = int(counts.sum())
+    # scipy keeps int32 indices as long as they can address every rating
+    index_dtype = np.int32 if nnz < np.iinfo(np.int32).max else np.int64
+    indptr = np.zeros(len(item_ids) + 1, dtype=index_dtype)
+    np.cumsum(counts, out=indptr[1:])
+
+    # Pass 2: scatter each chunk straight into the final CSC arrays
+    indices = np.empty(nnz, dtype=index_dtype)
+    data = np.empty(nnz, dtype=np.float32)
+    fill = indptr[:-1].copy()
+    for chunk in iter_rating_chunks(path, chunk_rows):
+        cols = item_cols[chunk['movieId']]
+        order = np.argsort(cols, kind='stable')
+        cols = cols[order]
+        # Position of each rating within its column's run in this chunk
+        starts = np.searchsorted(cols, cols, side='left')
+        positions = fill[cols] + (np.arange(len(cols)) - starts)
+        indices[positions] = user_rows[chunk['userId'][order]]
+        data[positions] = chunk['half_stars'][order] / np.float32(2)
+        fill += np.bincount(cols, minlength=len(item_ids))
+
+    matrix = sp.csc_matrix((data, indices, indptr),
+                           shape=(len(user_ids), len(item_ids)))
+    matrix.has_sorted_indices = False
+    matrix.sort_indices()
+    return {
+        'matrix': matrix,
+        'user_ids': user_ids,
+        'item_ids': item_ids,
+        'item_index': pd.Index(item_ids),
+        'counts': counts,
+        'sums': aggregates['item_sums'][item_ids],
+        'sumsq': aggregates['item_sumsq'][item_ids],
+    }
@@ -0,0 +1,96 @@
+"""
+
+    Lazily built, process-wide resources.
+
+    Author: Explore Data Science Academy.
+
+    Description: Data frames, models and similarity structures are
+    expensive to build, and most pages of the app never need them.
+    Decorating a zero-argument builder with `@resource` turns it into an
+    accessor that builds the value on first call and returns the same
+    object for the lifetime of the process.
+
+    Resources are registered by module and function name. Streamlit
+    re-executes the app script on every interaction, which re-runs its
+    `@resource` definitions; those re-definitions return the accessor
+    registered by the first run, so nothing is rebuilt.
+
+"""
+
+# Script dependencies
+import functools
+import threading
+import time
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def resource(builder):
+    """Build a value on first use and keep it for the process lifetime.
+
+    Parameters
+    ----------
+    builder : callable
+        Zero-argument function creating the resource.
+
+    Returns
+    -------
+    callable
+        Thread-safe accessor with `loaded()`, `load_time()` and `reset()`
+        helpers.
+
+    """
+    name = f'{builder.__module__}.{builder.__qualname__}'
+    with _registry_lock:
+        if name in _registry:
+            return _registry[name]
+
+    lock = threading.RLock()
+    # (value, load_time) of the built resource, or None. The slot is only
+    # ever replaced whole and read once per call, so a concurrent `reset`
+    # can never be seen half done.
+    built = [None]
+
+    @functools.wraps(builder)
+    def accessor():
+        current = built[0]
+        if current is None:
+            with lock:
+                current = built[0]
+                if current is None:
+                    start = time.perf_counter()
+                    value = builder()
+                    current = (value, time.perf_counter() - start)
+                    built[0] = current
+        return current[0]
+
+    def reset():
+        """Drop the built value so the next call rebuilds it."""
+        with lock:
+            built[0] = None
+
+    def load_time():
+        current = built[0]
+        return None if current is None else current[1]
+
+    accessor.loaded = lambda: built[0] is not None
+    accessor.load_time = load_time
+    accessor.reset = reset
+    with _registry_lock:
+        return _registry.setdefault(name, accessor)
+
+
+def loaded_resources():
+    """Build times of the resources loaded so far in this process.
+
+    Returns
+    -------
+    dict
+        Seconds spent building each loaded resource, keyed by name.
+
+    """
+    with _registry_lock:
+        items = list(_registry.items())
+    return {name: accessor.load_time()
+            for name, accessor in items if accessor.loaded()}
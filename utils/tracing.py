@@ -0,0 +1,260 @@
+"""
+
+    Lightweight tracing of the recommendation pipeline.
+
+    Author: Explore Data Science Academy.
+
+    Description: Per-stage timers and counters for the hot paths of the
+    recommenders and data loaders, so a slow request can be attributed
+    to data loading, title lookups, neighbour search or ranking.
+
+      - `stage(name)` times a block, `traced(name)` a whole function and
+        `count(name)` bumps a counter;
+      - `request(name, profile=..., memory=...)` groups the stages run by
+        one recommendation and can capture a cProfile report and the
+        tracemalloc peak of that request;
+      - `snapshot()` / `export(path)` return the aggregated metrics, the
+        most recent requests, lazily loaded resources and cache counters
+        (shown on the app's hidden diagnostics page).
+
+    Tracing is off by default and costs one global lookup per stage while
+    off. Set `RECOMMENDER_TRACE=1` or call `enable()` to turn it on.
+
+    cProfile and tracemalloc are process-wide: only one request is
+    profiled at a time, and the memory peak of requests that overlap
+    includes each other's allocations.
+
+"""
+
+# Script dependencies
+import collections
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+SAMPLES_PER_STAGE = 1024
+RECENT_REQUESTS = 50
+
+_enabled = os.environ.get('RECOMMENDER_TRACE', '') not in ('', '0')
+_lock = threading.Lock()
+_stages = {}
+_counters = collections.Counter()
+_requests = collections.deque(maxlen=RECENT_REQUESTS)
+_local = threading.local()
+_profile_lock = threading.Lock()
+_tracemalloc_users = 0
+# Whether tracing started tracemalloc, rather than e.g. `-X tracemalloc`
+_tracemalloc_owned = False
+_NULL = contextlib.nullcontext()
+
+
+def enable():
+    """Start recording stages, counters and requests."""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stop recording; already recorded metrics are kept."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    """Whether tracing is currently on."""
+    return _enabled
+
+
+def reset():
+    """Forget every recorded metric and request."""
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _requests.clear()
+
+
+def _record(name, seconds):
+    with _lock:
+        stats = _stages.get(name)
+        if stats is None:
+            stats = _stages[name] = {
+                'count': 0, 'total': 0.0, 'max': 0.0,
+                'samples': collections.deque(maxlen=SAMPLES_PER_STAGE)}
+        stats['count'] += 1
+        stats['total'] += seconds
+        stats['max'] = max(stats['max'], seconds)
+        stats['samples'].append(seconds)
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace['stages'].append((name, seconds * 1000))
+
+
+@contextlib.contextmanager
+def _timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+
+def stage(name):
+    """Context manager timing a stage of the pipeline.
+
+    Parameters
+    ----------
+    name : str
+        Dotted stage name, e.g. `'content.similarity'`.
+
+    """
+    return _timed(name) if _enabled else _NULL
+
+
+def traced(name):
+    """Decorate a function so each call is timed as stage `name`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _timed(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """Increment counter `name` by `n`."""
+    if _enabled:
+        with _lock:
+            _counters[name] += n
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _lock:
+        if _tracemalloc_users == 0:
+            _tracemalloc_owned = not tracemalloc.is_tracing()
+            if _tracemalloc_owned:
+                tracemalloc.start()
+        _tracemalloc_users += 1
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _lock:
+        peak = tracemalloc.get_traced_memory()[1]
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_owned:
+            tracemalloc.stop()
+            _tracemalloc_owned = False
+        return peak
+
+
+@contextlib.contextmanager
+def _traced_request(name, profile, memory):
+    trace = {'name': name, 'started': time.time(), 'stages': []}
+    outer, _local.trace = getattr(_local, 'trace', None), trace
+    profiler = None
+    if profile and _profile_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        profiler.enable()
+    baseline = _start_tracemalloc() if memory else None
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        elapsed = time.perf_counter() - start
+        if memory:
+            trace['memory_peak_kb'] = (_stop_tracemalloc() - baseline) / 1024
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats(
+                'cumulative').print_stats(25)
+            trace['profile'] = out.getvalue()
+        elif profile:
+            trace['profile'] = None  # another request was being profiled
+        trace['total_ms'] = elapsed * 1000
+        _local.trace = outer
+        _record(f'request.{name}', elapsed)
+        with _lock:
+            _requests.append(trace)
+
+
+def request(name, profile=False, memory=False):
+    """Context manager grouping the stages of one recommendation request.
+
+    Parameters
+    ----------
+    name : str
+        Request type, e.g. `'content'`.
+    profile : bool
+        Capture a cProfile report (top 25 functions by cumulative time).
+    memory : bool
+        Capture the tracemalloc peak of the request, in KB.
+
+    Yields
+    ------
+    dict or None
+        The request trace, or None while tracing is disabled.
+
+    """
+    return _traced_request(name, profile, memory) if _enabled else _NULL
+
+
+def snapshot():
+    """Current metrics.
+
+    Returns
+    -------
+    dict
+        `enabled`, per-stage `stages` (count, total/mean/p50/p95/max ms),
+        `counters`, the most recent `requests`, build times of the loaded
+        `resources` and the recommendation `cache` counters.
+
+    """
+    from utils.cache import recommendation_cache
+    from utils.lazy import loaded_resources
+
+    with _lock:
+        stages = {name: dict(stats, samples=list(stats['samples']))
+                  for name, stats in _stages.items()}
+        counters = dict(_counters)
+        requests = list(_requests)
+    summary = {}
+    for name, stats in sorted(stages.items()):
+        p50, p95 = np.percentile(stats['samples'], [50, 95]) * 1000
+        summary[name] = {
+            'count': stats['count'],
+            'total_ms': stats['total'] * 1000,
+            'mean_ms': stats['total'] * 1000 / stats['count'],
+            'p50_ms': float(p50),
+            'p95_ms': float(p95),
+            'max_ms': stats['max'] * 1000,
+        }
+    return {
+        'enabled': _enabled,
+        'stages': summary,
+        'counters': counters,
+        'requests': requests,
+        'resources': loaded_resources(),
+        'cache': recommendation_cache.stats(),
+    }
+
+
+def export(path):
+    """Write `snapshot()` to a JSON file."""
+    with open(path, 'w') as f:
+        json.dump(snapshot(), f, indent=2, default=str)